@@ -0,0 +1,171 @@
+# bench/bench_load.py
+"""Load test of the read endpoints against the replay data source.
+
+Starts the server with ``TV_SOURCE=replay`` and an empty cache directory,
+loads ``--symbols`` synthetic symbols, then has ``--clients`` concurrent
+clients hit /data, /scan, /analyze_cached and /correlation_analysis for
+``--duration`` seconds and prints p50/p99 latency and throughput per
+endpoint. Run from the repository root:
+
+    python -m bench.bench_load --symbols 300 --clients 50 --duration 20
+
+``--url http://host:port`` benchmarks an already running server instead
+(its data source and cache are whatever it was started with). Needs httpx.
+"""
+import argparse
+import asyncio
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+try:
+    import httpx
+except ImportError:
+    sys.exit("bench_load needs httpx: pip install httpx")
+
+RANGES = ["1d", "1w", "1m", "6m", "1y", "2y"]
+# Relative request mix, roughly what the chart and scanner pages generate.
+MIX = {
+    "/data": 10,
+    "/data binary": 10,
+    "/analyze_cached": 6,
+    "/scan": 2,
+    "/correlation_analysis": 1,
+    "/correlation_analysis top": 1,
+}
+
+
+def request_for(kind: str, symbols: list):
+    symbol = random.choice(symbols)
+    rng = random.choice(RANGES)
+    if kind == "/data":
+        return "/data", {"symbol": symbol, "range": rng}
+    if kind == "/data binary":
+        return "/data", {"symbol": symbol, "range": rng, "format": "binary"}
+    if kind == "/analyze_cached":
+        return "/analyze_cached", {"symbol": symbol, "range": rng}
+    if kind == "/scan":
+        return "/scan", {"range": rng, "rsi": random.random() < 0.5, "macd": random.random() < 0.5}
+    if kind == "/correlation_analysis":
+        return "/correlation_analysis", {"symbols": ",".join(random.sample(symbols, min(8, len(symbols)))), "range": rng}
+    return "/correlation_analysis", {"symbols": "all", "range": rng, "top": 20}
+
+
+def start_server(port: int, cache_dir: str, latency: float, error_rate: float):
+    env = dict(os.environ,
+               TV_SOURCE="replay",
+               TV_REPLAY_LATENCY=str(latency),
+               TV_REPLAY_ERROR_RATE=str(error_rate),
+               SNAP_USER_COMMON=cache_dir)
+    return subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "server:app", "--port", str(port), "--log-level", "warning"],
+        env=env, stdout=subprocess.DEVNULL,
+    )
+
+
+async def wait_ready(client, timeout: float = 60):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            if (await client.get("/refresh_status")).status_code == 200:
+                return
+        except httpx.TransportError:
+            pass
+        await asyncio.sleep(0.25)
+    raise RuntimeError("server did not come up")
+
+
+async def warm(client, symbols: list, concurrency: int = 32):
+    """Load every symbol; /analyze_cached answers 202 while a symbol is still being fetched."""
+    limit = asyncio.Semaphore(concurrency)
+
+    async def one(symbol):
+        async with limit:
+            for _ in range(60):
+                r = await client.get("/analyze_cached", params={"symbol": symbol})
+                if r.status_code != 202:
+                    return
+                await asyncio.sleep(0.5)
+
+    t0 = time.perf_counter()
+    await asyncio.gather(*(one(s) for s in symbols))
+    return time.perf_counter() - t0
+
+
+async def run_load(client, symbols: list, clients: int, duration: float):
+    kinds = list(MIX)
+    weights = [MIX[k] for k in kinds]
+    latencies = {k: [] for k in kinds}
+    errors = {k: 0 for k in kinds}
+    stop = time.monotonic() + duration
+
+    async def worker():
+        while time.monotonic() < stop:
+            kind = random.choices(kinds, weights)[0]
+            path, params = request_for(kind, symbols)
+            t0 = time.perf_counter()
+            try:
+                r = await client.get(path, params=params)
+                ok = r.status_code < 500
+            except httpx.HTTPError:
+                ok = False
+            latencies[kind].append(time.perf_counter() - t0)
+            if not ok:
+                errors[kind] += 1
+
+    t0 = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(clients)))
+    return latencies, errors, time.perf_counter() - t0
+
+
+def report(latencies: dict, errors: dict, elapsed: float):
+    print(f"{'endpoint':28s} {'requests':>9s} {'errors':>7s} {'req/s':>8s} {'p50 ms':>8s} {'p99 ms':>8s}")
+    total = 0
+    for kind, values in latencies.items():
+        if not values:
+            continue
+        ms = np.asarray(values) * 1e3
+        total += len(values)
+        print(f"{kind:28s} {len(values):9d} {errors[kind]:7d} {len(values) / elapsed:8.1f} "
+              f"{np.percentile(ms, 50):8.2f} {np.percentile(ms, 99):8.2f}")
+    print(f"{'total':28s} {total:9d} {sum(errors.values()):7d} {total / elapsed:8.1f}")
+
+
+async def main(args):
+    symbols = [f"S{i:04d}" for i in range(args.symbols)]
+    server = None
+    url = args.url
+    if url is None:
+        cache_dir = tempfile.mkdtemp(prefix="tv-bench-")
+        server = start_server(args.port, cache_dir, args.latency, args.error_rate)
+        url = f"http://127.0.0.1:{args.port}"
+    limits = httpx.Limits(max_connections=args.clients + 32)
+    try:
+        async with httpx.AsyncClient(base_url=url, timeout=60, limits=limits) as client:
+            await wait_ready(client)
+            took = await warm(client, symbols)
+            print(f"warm-up: {len(symbols)} symbols in {took:.1f}s")
+            latencies, errors, elapsed = await run_load(client, symbols, args.clients, args.duration)
+            print(f"load: {args.clients} clients for {elapsed:.1f}s")
+            report(latencies, errors, elapsed)
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--symbols", type=int, default=300)
+    parser.add_argument("--clients", type=int, default=50)
+    parser.add_argument("--duration", type=float, default=20.0)
+    parser.add_argument("--latency", type=float, default=0.05, help="replay latency per upstream call (s)")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="replay failure rate per upstream call")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--url", help="benchmark this running server instead of starting one")
+    asyncio.run(main(parser.parse_args()))
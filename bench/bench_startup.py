@@ -0,0 +1,146 @@
+# bench/bench_startup.py
+"""Startup benchmark: import time, time to first page, time to a loaded cache.
+
+Each run starts a fresh interpreter, so nothing is warm but the OS page
+cache. Reported per run, then as medians:
+
+* import: ``import server`` wall time, and which heavy modules it pulled
+  in (none of pandas, scikit-learn and tvDatafeed should be);
+* first page: from spawning uvicorn until ``/`` and a static file answer;
+* cache loaded: until ``/refresh_status`` reports the bar store (filled
+  with ``--symbols`` synthetic symbols beforehand) as loaded.
+
+Run from the repository root:
+
+    python -m bench.bench_startup --runs 5 --symbols 500
+
+``--max-import-ms`` / ``--max-first-page-ms`` make it exit non-zero when
+the median exceeds the budget, to catch regressions in CI. Needs httpx.
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+try:
+    import httpx
+except ImportError:
+    sys.exit("bench_startup needs httpx: pip install httpx")
+
+HEAVY = ["pandas", "sklearn", "tvDatafeed", "tvdatafeed", "matplotlib", "plotly"]
+
+IMPORT_SCRIPT = """
+import sys, time
+t0 = time.perf_counter()
+import server
+ms = (time.perf_counter() - t0) * 1e3
+heavy = [m for m in {heavy!r} if m in sys.modules]
+print(f"{{ms:.1f}} {{','.join(heavy)}}")
+"""
+
+
+def populate(cache_dir: str, symbols: int):
+    """Fill a bar store with synthetic symbols, as a previous session would have left it."""
+    script = f"""
+from server.sources import ReplaySource
+from server.histo import RANGE_CONFIG, _fetch_plan, _group_ranges
+from server.store import BarStore
+import time
+store = BarStore({os.path.join(cache_dir, "bars")!r})
+source = ReplaySource(seed=1)
+for i in range({symbols}):
+    symbol = f"S{{i:04d}}"
+    data = {{}}
+    for label, members in _fetch_plan():
+        cfg = RANGE_CONFIG[label]
+        df = source.get_hist(symbol, "CSEMA", interval=cfg["interval"], n_bars=cfg["n_bars"])
+        data.update(_group_ranges(members, None, df, cfg["n_bars"], cfg["n_bars"]))
+    store.save_entry(symbol, {{"data": data, "exchange": "CSEMA", "last_updated": time.time(), "status": "ok"}},
+                     {{label: {{"trend": "bull"}} for label in data}})
+"""
+    env = dict(os.environ, SNAP_USER_COMMON=cache_dir, TV_SOURCE="replay")
+    subprocess.run([sys.executable, "-c", script], env=env, check=True, stdout=subprocess.DEVNULL)
+
+
+def measure_import(env: dict):
+    out = subprocess.run([sys.executable, "-c", IMPORT_SCRIPT.format(heavy=HEAVY)],
+                         env=env, check=True, capture_output=True, text=True).stdout
+    ms, _, heavy = out.strip().splitlines()[-1].partition(" ")
+    return float(ms), [m for m in heavy.split(",") if m]
+
+
+def _wait(client, path: str, deadline: float, ready=lambda r: r.status_code == 200):
+    while time.monotonic() < deadline:
+        try:
+            if ready(client.get(path)):
+                return True
+        except httpx.TransportError:
+            pass
+        time.sleep(0.01)
+    return False
+
+
+def measure_server(env: dict, port: int, timeout: float = 60):
+    t0 = time.perf_counter()
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "server:app", "--port", str(port), "--log-level", "warning"],
+        env=env, stdout=subprocess.DEVNULL,
+    )
+    deadline = time.monotonic() + timeout
+    try:
+        with httpx.Client(base_url=f"http://127.0.0.1:{port}", timeout=5) as client:
+            if not _wait(client, "/", deadline):
+                raise RuntimeError("server did not come up")
+            first_page = (time.perf_counter() - t0) * 1e3
+            _wait(client, "/static/js/chart.js", deadline)
+            static = (time.perf_counter() - t0) * 1e3
+            _wait(client, "/refresh_status", deadline, lambda r: r.status_code == 200 and r.json().get("cache_loaded"))
+            loaded = (time.perf_counter() - t0) * 1e3
+        return first_page, static, loaded
+    finally:
+        server.terminate()
+        server.wait()
+
+
+def main(args):
+    cache_dir = tempfile.mkdtemp(prefix="tv-startup-")
+    if args.symbols:
+        t0 = time.perf_counter()
+        populate(cache_dir, args.symbols)
+        print(f"bar store: {args.symbols} symbols written in {time.perf_counter() - t0:.1f}s")
+    env = dict(os.environ, SNAP_USER_COMMON=cache_dir, TV_SOURCE="replay", PYTHONDONTWRITEBYTECODE="1")
+    # The scheduler would refresh every symbol in the background; keep the
+    # measurement about startup itself.
+    env.setdefault("TV_REPLAY_LATENCY", "0")
+
+    rows = []
+    print(f"{'run':>4s} {'import ms':>10s} {'first page ms':>14s} {'static ms':>10s} {'cache loaded ms':>16s}  heavy imports")
+    for run in range(args.runs):
+        import_ms, heavy = measure_import(env)
+        first_page, static, loaded = measure_server(env, args.port)
+        rows.append((import_ms, first_page, static, loaded))
+        print(f"{run + 1:4d} {import_ms:10.1f} {first_page:14.1f} {static:10.1f} {loaded:16.1f}  {', '.join(heavy) or '-'}")
+    medians = [statistics.median(col) for col in zip(*rows)]
+    print(f"{'med':>4s} {medians[0]:10.1f} {medians[1]:14.1f} {medians[2]:10.1f} {medians[3]:16.1f}")
+
+    failed = False
+    if args.max_import_ms is not None and medians[0] > args.max_import_ms:
+        print(f"FAIL: median import {medians[0]:.1f} ms > {args.max_import_ms} ms")
+        failed = True
+    if args.max_first_page_ms is not None and medians[1] > args.max_first_page_ms:
+        print(f"FAIL: median first page {medians[1]:.1f} ms > {args.max_first_page_ms} ms")
+        failed = True
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--symbols", type=int, default=200, help="synthetic symbols in the bar store")
+    parser.add_argument("--port", type=int, default=8766)
+    parser.add_argument("--max-import-ms", type=float, help="fail if the median import time exceeds this")
+    parser.add_argument("--max-first-page-ms", type=float, help="fail if the median time to / exceeds this")
+    main(parser.parse_args())
@@ -0,0 +1,100 @@
+# bench/bench_streaming.py
+"""Forming-bar refresh: streamed overlay vs. ``analyze_dataframe``, per range.
+
+A refresh where only the forming bar moved advances the ``IndicatorState``
+and overlays the fields that ``calibrate`` found to agree with
+``analyze_dataframe``; a refresh that closed a bar still runs the full
+analysis (plus the state update). So the saving per range is
+
+    (share of refreshes with no closed bar) x (analyze_dataframe - streamed)
+
+and nothing on the others. The share printed below is one minus the
+refresh period over the bar length, during a session. The state gets the
+typed columns the cache holds; the full analysis is timed in-process, so
+the pack/unpack and pool round trip it pays in the server are not counted
+and the real saving is somewhat larger. The bench also checks every
+overlaid field against ``analyze_dataframe`` on the same bars and lists
+the fields that are not streamed.
+
+Needs ``server.analyze``. Run from the repository root:
+
+    python -m bench.bench_streaming
+"""
+import time
+
+import numpy as np
+import pandas as pd
+
+from server.histo import RANGE_CONFIG, interval_seconds
+from server.store import columns_from_dict
+from server.streaming import STREAMED, IndicatorState, _agrees, _lookup
+
+REFRESHES = 200
+
+
+def synthetic_range(n, seconds, seed=0):
+    rng = np.random.default_rng(seed)
+    close = 100 * np.exp(np.cumsum(rng.normal(0, 0.01, n)))
+    times = pd.date_range(end=pd.Timestamp.now().floor("D"), periods=n, freq=pd.Timedelta(seconds=seconds))
+    return {
+        "Time": times.astype(str).tolist(),
+        "Open": close.tolist(),
+        "High": (close * 1.01).tolist(),
+        "Low": (close * 0.99).tolist(),
+        "Close": close.tolist(),
+        "Volume": [1000.0] * n,
+    }
+
+
+def bench_range(label, analyze_dataframe):
+    cfg = RANGE_CONFIG[label]
+    n_bars, seconds = cfg["n_bars"], interval_seconds(cfg["interval"])
+    rdata = synthetic_range(n_bars, seconds)
+    state = IndicatorState(n_bars)
+    state.update(columns_from_dict(rdata))
+    base = analyze_dataframe(rdata, label)
+    state.calibrate(base)
+
+    rng = np.random.default_rng(1)
+    revisions = []
+    for _ in range(REFRESHES):
+        bar = dict(rdata)
+        bar["Close"] = rdata["Close"][:-1] + [rdata["Close"][-1] * (1 + rng.normal(0, 0.002))]
+        revisions.append((bar, columns_from_dict(bar)))
+
+    t0 = time.perf_counter()
+    for bar, _ in revisions:
+        full = analyze_dataframe(bar, label)
+    t_full = (time.perf_counter() - t0) / REFRESHES
+
+    t0 = time.perf_counter()
+    for _, cols in revisions:
+        state.update(cols)
+        streamed = state.overlay(base)
+    t_stream = (time.perf_counter() - t0) / REFRESHES
+
+    # The last revision's overlay against a full analysis of the same bars.
+    mismatched = [path for path in state.matched
+                  if not _agrees(_lookup(streamed, path), _lookup(full, path))]
+    share = max(0.0, 1 - cfg["refresh"] / seconds) if seconds else 0.0
+    saved = share * (t_full - t_stream) if state.matched else 0.0
+    print(f"{label:3s} bars={n_bars:4d} analyze_dataframe={t_full * 1e3:8.3f} ms  "
+          f"streamed={t_stream * 1e3:7.3f} ms  forming-bar share={share:5.1%}  "
+          f"saved={saved * 1e3:7.3f} ms/refresh ({saved / t_full if t_full else 0:.0%})")
+    print(f"    streamed fields: {', '.join('.'.join(p) for p in state.matched) or 'none (always full)'}")
+    skipped = [path for path in STREAMED if path not in state.matched]
+    if skipped:
+        print(f"    not streamed   : {', '.join('.'.join(p) for p in skipped)}")
+    print(f"    check vs analyze_dataframe: {'MISMATCH ' + str(mismatched) if mismatched else 'ok'}")
+
+
+def main():
+    from server.analyze import analyze_dataframe
+
+    print(f"refreshes={REFRESHES} per range")
+    for label in RANGE_CONFIG:
+        bench_range(label, analyze_dataframe)
+
+
+if __name__ == "__main__":
+    main()
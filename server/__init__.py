@@ -1,18 +1,25 @@
 from fastapi import FastAPI
 from fastapi.templating import Jinja2Templates
 from fastapi.staticfiles import StaticFiles
+from fastapi.responses import PlainTextResponse, Response
 import asyncio
 from pathlib import Path
 import json
 import time
-import numpy as np
 import os
-import math
 
-from .histo import fetch_data
-from .analyze import analyze_dataframe
-from .ml_model import trainer
-from .advanced_analysis import get_advanced_analysis, generate_decision_signal
+from .histo import FetchEngine, refresh_intervals, RANGE_CONFIG
+from .store import BarStore
+from .cache import BarCache
+from .scheduler import RefreshScheduler
+from .streaming import IndicatorState
+from .encoding import make_serializable, dumps, range_columns
+from .singleflight import SingleFlight
+from .correlation import CorrelationEngine
+from .compute import ComputeExecutor, LoopMonitor
+from .training import ModelRegistry, TrainingManager
+from .metrics import METRICS, flatten, profile_response
+from .shared import state_from_env
 
 # SNAP-SAFE CACHE
 CACHE_DIR = Path(
@@ -20,7 +27,9 @@ CACHE_DIR = Path(
 )
 CACHE_DIR.mkdir(parents=True, exist_ok=True)
 
+# Legacy monolithic cache, imported once into the bar store if present.
 CACHE_FILE = CACHE_DIR / "data_cache.json"
+STORE = BarStore(CACHE_DIR / "bars")
 
 app = FastAPI()
 
@@ -31,67 +40,186 @@ STATIC_DIR = SNAP_ROOT / "static"
 templates = Jinja2Templates(directory=str(TEMPLATES_DIR))
 app.mount("/static", StaticFiles(directory=str(STATIC_DIR)), name="static")
 
-DATA_CACHE = {}
-SEMAPHORE = asyncio.Semaphore(3)
-
-def make_serializable(obj):
-    if isinstance(obj, dict):
-        return {k: make_serializable(v) for k, v in obj.items()}
-    if isinstance(obj, list):
-        return [make_serializable(v) for v in obj]
-    if isinstance(obj, tuple):
-        return tuple(make_serializable(v) for v in obj)
-    if isinstance(obj, np.ndarray):
-        return make_serializable(obj.tolist())
-    if isinstance(obj, (np.generic,)):
-        obj = obj.item()
-    if isinstance(obj, float):
-        if math.isnan(obj) or math.isinf(obj):
-            return None
-    return obj
+def _range_windows():
+    return {label: cfg["n_bars"] for label, cfg in RANGE_CONFIG.items()}
+
+# Hot entries (bars on the heap, refreshed) are capped at CACHE_MAX_MB and
+# go cold (memory-mapped from STORE, not refreshed) after CACHE_TTL seconds
+# without a request.
+DATA_CACHE = BarCache(
+    STORE, _range_windows(),
+    max_bytes=int(float(os.environ.get("CACHE_MAX_MB", 512)) * 2**20),
+    ttl=float(os.environ.get("CACHE_TTL", 3600)),
+)
+# Symbols refreshed at once, and datafeed sessions (= upstream calls in flight)
+# they share. Every upstream call, whatever asked for it, is also held to
+# TV_RATE_LIMIT calls per second (bursts of TV_RATE_BURST).
+MAX_CONCURRENT_FETCHES = int(os.environ.get("TV_FETCH_CONCURRENCY", 8))
+FETCHER = FetchEngine(
+    sessions=int(os.environ.get("TV_SESSIONS", 4)),
+    rate=float(os.environ.get("TV_RATE_LIMIT", 2.0)),
+    burst=int(os.environ.get("TV_RATE_BURST", 5)),
+)
+SEMAPHORE = asyncio.Semaphore(MAX_CONCURRENT_FETCHES)
+CORRELATIONS = {label: CorrelationEngine(cfg["n_bars"]) for label, cfg in RANGE_CONFIG.items()}
+# Analysis and training run in worker processes (COMPUTE_WORKERS=0: in a thread).
+COMPUTE = ComputeExecutor(
+    int(os.environ["COMPUTE_WORKERS"]) if "COMPUTE_WORKERS" in os.environ else None,
+    timeout=float(os.environ.get("COMPUTE_TIMEOUT", 30)),
+)
+LOOP_MONITOR = LoopMonitor()
+# Leader lock, fetch queue and label log shared by the workers serving
+# CACHE_DIR (TV_SHARED_STATE=local: this process alone). Only the leader
+# fetches and writes the bar store; the others follow it every SYNC_INTERVAL.
+SHARED = state_from_env(CACHE_DIR)
+SYNC_INTERVAL = float(os.environ.get("TV_SYNC_INTERVAL", 1.0))
+
+def _load_trainer():
+    from .ml_model import trainer
+    return trainer
+
+# The model (and scikit-learn) and its snapshots are loaded on first use, not at startup.
+TRAINING = TrainingManager(
+    _load_trainer, COMPUTE, ModelRegistry(CACHE_DIR / "models"),
+    refit_every=int(os.environ.get("ML_REFIT_EVERY", 10)),
+    shared=SHARED,
+)
+# Called as listener(symbol, previous_entry, new_entry, refreshed_labels)
+# after every successful refresh.
+REFRESH_LISTENERS = []
+
+# ?profile=1 on any request returns its cProfile breakdown instead (PROFILE_REQUESTS=1 enables).
+PROFILE_REQUESTS = os.environ.get("PROFILE_REQUESTS", "0") == "1"
+
+@app.middleware("http")
+async def instrument_requests(request, call_next):
+    if PROFILE_REQUESTS and request.query_params.get("profile") == "1":
+        return PlainTextResponse(await profile_response(lambda: call_next(request)))
+    t0 = time.perf_counter()
+    response = await call_next(request)
+    # Label by route template: one series per endpoint, not per symbol or stray URL.
+    route = request.scope.get("route")
+    path = getattr(route, "path", None) or "unmatched"
+    METRICS.observe("http_request_seconds", time.perf_counter() - t0, path=path, status=response.status_code)
+    return response
 
 def safe_response(data, status_code: int = 200):
-    from fastapi.responses import JSONResponse
-    try:
-        prim = make_serializable(data)
-    except Exception:
-        prim = data
-    return JSONResponse(prim, status_code=status_code)
-
-def load_cache_from_disk():
-    global DATA_CACHE
-    if not CACHE_FILE.exists():
-        return
+    with METRICS.timer("serialize_seconds", fn="safe_response"):
+        body = dumps(data)
+    return Response(content=body, status_code=status_code, media_type="application/json")
+
+def _import_legacy_cache():
+    """One-off migration of data_cache.json into the bar store."""
     try:
         with CACHE_FILE.open("r") as f:
-            DATA_CACHE.update(json.load(f))
-            print(f"Loaded cache for {len(DATA_CACHE)} symbols from disk")
+            legacy = json.load(f)
+        for symbol, entry in legacy.items():
+            if entry.get("data"):
+                STORE.save_entry(symbol, entry, entry.get("analysis") or {})
+        CACHE_FILE.rename(CACHE_FILE.with_suffix(".json.migrated"))
+        print(f"Migrated {len(legacy)} symbols from {CACHE_FILE.name} to the bar store")
     except Exception as e:
-        print(f"Failed to load cache from disk: {e}")
+        print(f"Failed to migrate legacy cache: {e}")
+
+def _stored_fields(symbol: str) -> dict:
+    """Entry fields of a symbol in the bar store (its bars are read through ``LazyRanges``)."""
+    meta = STORE.meta(symbol)
+    return {
+        "exchange": meta.get("exchange", "CSEMA"),
+        "last_updated": meta.get("last_updated"),
+        "persisted_at": meta.get("last_updated"),
+        "status": meta.get("status", "ok"),
+        "analysis": STORE.read_analysis(symbol),
+        "analysis_last_updated": {},
+    }
+
+def _read_disk_cache() -> list:
+    """(symbol, entry fields) of every symbol in the bar store. Blocking; runs on a thread."""
+    if CACHE_FILE.exists() and not STORE.symbols() and SHARED.is_leader:
+        _import_legacy_cache()
+    return [(symbol, _stored_fields(symbol)) for symbol in STORE.symbols()]
+
+# Set once the bar store has been read into DATA_CACHE.
+CACHE_LOADED = asyncio.Event()
+
+async def load_cache_from_disk():
+    """Populate DATA_CACHE with cold entries from the bar store, reading it on a thread."""
+    with METRICS.timer("cache_load_seconds"):
+        found = await asyncio.to_thread(_read_disk_cache)
+    loaded = 0
+    for symbol, fields in found:
+        # Symbols requested while the store was being read are already loading.
+        if symbol in DATA_CACHE:
+            continue
+        DATA_CACHE[symbol] = DATA_CACHE.cold_entry(symbol, fields)
+        loaded += 1
+    CACHE_LOADED.set()
+    print(f"Loaded cache for {loaded} symbols from disk")
 
 def save_cache_to_disk():
-    try:
-        serializable = make_serializable(DATA_CACHE)
-        with CACHE_FILE.open("w") as f:
-            json.dump(serializable, f, indent=2)
-    except Exception as e:
-        print(f"Failed to save cache to disk: {e}")
+    """Append bars of entries refreshed since their last save."""
+    with METRICS.timer("cache_save_seconds"):
+        _save_cache_to_disk()
+
+def _save_cache_to_disk():
+    for symbol, entry in list(DATA_CACHE.items()):
+        if entry.get("status") != "ok" or not entry.get("data"):
+            continue
+        if DATA_CACHE.is_cold(entry):
+            continue
+        if entry.get("persisted_at") == entry.get("last_updated"):
+            continue
+        try:
+            STORE.save_entry(symbol, entry, make_serializable(entry.get("analysis") or {}))
+            entry["persisted_at"] = entry.get("last_updated")
+            METRICS.inc("cache_saved_symbols_total")
+        except Exception as e:
+            print(f"Failed to save cache for {symbol} to disk: {e}")
+
 
+async def update_cache_for_symbol(symbol: str, exchange: str = "CSEMA", ranges=None):
+    """Fetch new bars for ``symbol`` and re-run analysis on the refreshed ranges.
 
-async def update_cache_for_symbol(symbol: str, exchange: str = "CSEMA"):
+    With ``ranges`` only those ranges (and the ones sharing their interval)
+    are refreshed. Ranges not refreshed, because they were not asked for or
+    their interval failed to fetch, keep their bars and analysis.
+    """
+    t0 = time.perf_counter()
     async with SEMAPHORE:
+        METRICS.observe("semaphore_wait_seconds", time.perf_counter() - t0)
+        t0 = time.perf_counter()
         try:
-            data = await asyncio.to_thread(fetch_data, symbol, exchange)
+            prev = DATA_CACHE.get(symbol, {})
+            previous = prev.get("data") or {}
+            data = await FETCHER.fetch(symbol, exchange, previous, ranges)
             entry = {
-                "data": data,
+                "data": {label: data[label] if label in data else previous[label]
+                         for label in RANGE_CONFIG if label in data or label in previous},
+                "exchange": exchange,
                 "last_updated": time.time(),
                 "status": "ok",
-                "analysis": {},
-                "analysis_last_updated": {}
+                "analysis": dict(prev.get("analysis") or {}),
+                "analysis_last_updated": dict(prev.get("analysis_last_updated") or {}),
+                "indicators": dict(prev.get("indicators") or {}),
             }
+            prev_analysis = prev.get("analysis") or {}
             for rlabel, rdata in (data or {}).items():
                 try:
-                    ana = analyze_dataframe(rdata, rlabel)
+                    state = entry['indicators'].get(rlabel)
+                    if state is None:
+                        state = entry['indicators'][rlabel] = IndicatorState(RANGE_CONFIG[rlabel]["n_bars"])
+                    committed = state.update(rdata)
+                    base = prev_analysis.get(rlabel)
+                    if committed == 0 and state.matched and base and "error" not in base:
+                        # Only the forming bar moved: advance the streamed
+                        # indicators that match the analysis and keep the rest.
+                        with METRICS.timer("analysis_seconds", range=rlabel, mode="streamed"):
+                            ana = state.overlay(base)
+                    else:
+                        cols = range_columns(entry, rlabel)
+                        with METRICS.timer("analysis_seconds", range=rlabel, mode="full"):
+                            ana = await COMPUTE.analyze(rdata, rlabel, cols=cols)
+                        state.calibrate(ana)
                     entry['analysis'][rlabel] = ana
                     entry['analysis_last_updated'][rlabel] = time.time()
                 except Exception as e:
@@ -99,33 +227,232 @@ async def update_cache_for_symbol(symbol: str, exchange: str = "CSEMA"):
                     entry['analysis_last_updated'][rlabel] = time.time()
 
             DATA_CACHE[symbol] = entry
+            SCHEDULER.track(symbol, exchange, entry["last_updated"])
+            for listener in REFRESH_LISTENERS:
+                try:
+                    listener(symbol, prev, entry, list(data or {}))
+                except Exception as e:
+                    print(f"Refresh listener failed for {symbol}: {e}")
+            METRICS.observe("refresh_seconds", time.perf_counter() - t0, outcome="ok")
             print(f"Cache updated for {symbol}")
         except Exception as e:
+            METRICS.observe("refresh_seconds", time.perf_counter() - t0, outcome="error")
             prev = DATA_CACHE.get(symbol, {})
             prev["status"] = "error"
             prev["last_error"] = str(e)
             DATA_CACHE[symbol] = prev
             print(f"Cache update error for {symbol}:", e)
 
+SCHEDULER = RefreshScheduler(
+    update_cache_for_symbol,
+    refresh_intervals(),
+    workers=MAX_CONCURRENT_FETCHES,
+)
+
+def _track_promoted(symbol: str):
+    if not SHARED.is_leader:
+        return
+    entry = DATA_CACHE[symbol]
+    SCHEDULER.track(symbol, entry.get("exchange", "CSEMA"), entry.get("last_updated"))
+
+DATA_CACHE.on_demote.append(SCHEDULER.untrack)
+DATA_CACHE.on_promote.append(_track_promoted)
+
+def _cache_gauges():
+    usage = DATA_CACHE.usage()
+    return {
+        **flatten("cache", {k: v for k, v in usage.items() if k != "symbols"}),
+        "cache_symbol_bytes": [({"symbol": s, "tier": u["tier"]}, u["bytes"]) for s, u in usage["symbols"].items()],
+    }
+
+METRICS.collectors += [
+    lambda: flatten("scheduler", SCHEDULER.metrics()),
+    lambda: flatten("fetcher", FETCHER.metrics()),
+    lambda: flatten("compute", COMPUTE.metrics()),
+    lambda: flatten("loop", LOOP_MONITOR.metrics()),
+    _cache_gauges,
+]
+
+for _name, _text in {
+    "http_request_seconds": "Request latency by route template and status.",
+    "serialize_seconds": "Time spent encoding JSON responses.",
+    "cache_load_seconds": "Time to load the cache from the bar store at startup.",
+    "cache_save_seconds": "Time to persist changed entries to the bar store.",
+    "cache_saved_symbols_total": "Entries written to the bar store.",
+    "cache_requests_total": "Symbol lookups by outcome (hit, cold, miss, loading, error).",
+    "semaphore_wait_seconds": "Time a refresh waited for a refresh slot.",
+    "analysis_seconds": "Analysis time per range, streamed or full.",
+    "refresh_seconds": "Duration of a symbol refresh by outcome.",
+    "backtest_seconds": "Backtest time per stage.",
+    "bulk_parts_total": "Parts streamed by /bulk, by kind.",
+    "compute_seconds": "Compute task duration by task.",
+    "compute_timeouts_total": "Compute tasks that exceeded their timeout.",
+    "compute_resubmitted_total": "Compute tasks rerun after their pool was killed for another task.",
+    "compute_pack_seconds": "Time copying bars into shared memory for a compute task.",
+    "encoded_cache_total": "Encoded /data payload lookups by result.",
+    "compressed_cache_total": "Compressed /data payload lookups by result.",
+    "compress_seconds": "Time compressing /data payloads, by content coding.",
+    "fetch_rate_wait_seconds": "Time an upstream call waited for the request-rate budget.",
+    "fetch_failures_total": "Upstream calls that failed after every retry.",
+    "fetch_retries_total": "Upstream calls retried.",
+    "fetch_call_seconds": "Upstream call latency by interval and outcome.",
+    "fetch_bars_total": "Bars requested from upstream, by source range.",
+    "fetch_seconds": "Time fetching a source range, retries included.",
+    "merge_seconds": "Time merging fetched bars into the cached ranges.",
+}.items():
+    METRICS.describe(_name, _text)
+
+FLIGHTS = SingleFlight()
+# A symbol whose first fetch failed is retried on request after this many seconds.
+COLD_RETRY_AFTER = 60
+# How long a request waits for a cold symbol before answering "loading".
+COLD_FETCH_TIMEOUT = 30
+
+def ensure_symbol(symbol: str, exchange: str = "CSEMA"):
+    """Start loading ``symbol`` if it has no data yet.
+
+    Returns the shared in-flight task, or None when there is nothing to wait
+    for. This is the only place that writes the loading placeholder.
+    """
+    key = (symbol, exchange)
+    task = FLIGHTS.get(key)
+    if task is not None:
+        METRICS.inc("cache_requests_total", result="loading")
+        return task
+    DATA_CACHE.touch(symbol)
+    entry = DATA_CACHE.get(symbol)
+    if entry and entry.get("data"):
+        METRICS.inc("cache_requests_total", result="cold" if DATA_CACHE.is_cold(entry) else "hit")
+        return None
+    if entry and entry.get("status") == "error" and time.time() - entry.get("last_attempt", 0) < COLD_RETRY_AFTER:
+        METRICS.inc("cache_requests_total", result="error")
+        return None
+    METRICS.inc("cache_requests_total", result="miss")
+    DATA_CACHE[symbol] = {**(entry or {}), "status": "loading", "data": {}, "exchange": exchange,
+                          "last_attempt": time.time()}
+    if not SHARED.is_leader:
+        return FLIGHTS.start(key, lambda: _wait_for_leader(symbol, exchange))
+    return FLIGHTS.start(key, lambda: update_cache_for_symbol(symbol, exchange))
+
+# How long a follower waits for the leader to fetch a symbol it queued.
+LEADER_FETCH_TIMEOUT = 120
+
+async def _wait_for_leader(symbol: str, exchange: str):
+    """Follower side of a miss: queue it for the leader, whose fetch ``sync_from_store`` brings in."""
+    deadline = time.time() + LEADER_FETCH_TIMEOUT
+    try:
+        await asyncio.to_thread(SHARED.request_symbol, symbol, exchange)
+    except Exception as e:
+        # Still picked up if another worker queued it; otherwise this times out.
+        print(f"Failed to queue {symbol} for the refresh leader: {e}")
+    while time.time() < deadline:
+        await asyncio.sleep(SYNC_INTERVAL)
+        if (DATA_CACHE.get(symbol) or {}).get("data"):
+            return
+        if SHARED.is_leader:
+            # Took over meanwhile.
+            return await update_cache_for_symbol(symbol, exchange)
+    entry = DATA_CACHE.get(symbol) or {}
+    entry.update(status="error", last_error="Timed out waiting for the refresh leader")
+    DATA_CACHE[symbol] = entry
+
+async def load_symbol(symbol: str, exchange: str = "CSEMA", timeout: float = None) -> bool:
+    """Make sure ``symbol`` is loaded, waiting at most ``timeout`` seconds; False on timeout."""
+    task = ensure_symbol(symbol, exchange)
+    if task is None:
+        return True
+    try:
+        await asyncio.wait_for(asyncio.shield(task), timeout)
+        return True
+    except asyncio.TimeoutError:
+        return False
+
 async def update_cache_loop():
-    """Infinite loop to periodically update all cached symbols."""
+    """Keep hot symbols scheduled, persist refreshed entries and enforce the cache limits."""
     while True:
-        symbols = list(DATA_CACHE.keys())
-        for symbol in symbols:
-            asyncio.create_task(update_cache_for_symbol(symbol))
+        for symbol in DATA_CACHE.hot_symbols():
+            entry = DATA_CACHE[symbol]
+            SCHEDULER.track(symbol, entry.get("exchange", "CSEMA"), entry.get("last_updated"))
         save_cache_to_disk()
+        DATA_CACHE.enforce()
         await asyncio.sleep(60)
 
+def sync_from_store():
+    """Follower: adopt the entries the leader committed to the bar store since the last call."""
+    for symbol in STORE.reload():
+        prev = DATA_CACHE.get(symbol) or {}
+        entry = DATA_CACHE.cold_entry(symbol, _stored_fields(symbol))
+        if prev.get("data") and prev.get("last_updated") == entry.get("last_updated"):
+            continue
+        DATA_CACHE[symbol] = entry
+        for listener in REFRESH_LISTENERS:
+            try:
+                listener(symbol, prev, entry, list(entry["data"]))
+            except Exception as e:
+                print(f"Refresh listener failed for {symbol}: {e}")
+
+def _start_refreshing():
+    # Entries loaded from disk start cold. The first request for one tracks
+    # it with its saved timestamp, so stale ranges come due immediately and
+    # fresh ones wait their turn. After a takeover, symbols this worker
+    # served recently are tracked right away.
+    for symbol in DATA_CACHE.requested_since(time.time() - DATA_CACHE.ttl):
+        _track_promoted(symbol)
+    SCHEDULER.start()
+    asyncio.create_task(update_cache_loop())
+
+async def coordinate_loop():
+    """Leader election and cross-worker sync, every SYNC_INTERVAL seconds."""
+    leading = False
+    enforced = forwarded = time.time()
+    while True:
+        try:
+            if SHARED.try_lead() and not leading:
+                leading = True
+                print(f"Worker {os.getpid()} is the refresh leader")
+                sync_from_store()
+                _start_refreshing()
+            if leading:
+                for symbol, exchange in await asyncio.to_thread(SHARED.take_requests):
+                    ensure_symbol(symbol, exchange)
+                # Followers' clients count as this worker's: stay hot, keep priority.
+                for symbol, requested_at, viewed_at in await asyncio.to_thread(SHARED.take_touches):
+                    if requested_at:
+                        DATA_CACHE.touch(symbol)
+                    if viewed_at:
+                        SCHEDULER.touch(symbol)
+                if SHARED.shared:
+                    # Followers read what is saved; don't make them wait for the minute.
+                    save_cache_to_disk()
+            else:
+                sync_from_store()
+                since, forwarded = forwarded, time.time()
+                await asyncio.to_thread(SHARED.forward_touches, DATA_CACHE.requested_since(since),
+                                        SCHEDULER.viewed_since(since))
+                if time.time() - enforced >= 60:
+                    # update_cache_loop does this on the leader.
+                    DATA_CACHE.enforce()
+                    enforced = time.time()
+            await TRAINING.sync()
+        except Exception as e:
+            print(f"Worker sync failed: {e}")
+        await asyncio.sleep(SYNC_INTERVAL)
+
+async def _load_and_coordinate():
+    await load_cache_from_disk()
+    asyncio.create_task(coordinate_loop())
+
 @app.on_event("startup")
 async def startup_event():
-    load_cache_from_disk()
-    print(f"Startup: loaded cache for {len(DATA_CACHE)} symbols from disk")
-
-    async def warmup_cache():
-        for symbol in list(DATA_CACHE.keys()):
-            asyncio.create_task(update_cache_for_symbol(symbol))
-        asyncio.create_task(update_cache_loop())
+    # Start serving (/ and static files) right away; the cache loads in the background.
+    SHARED.try_lead()
+    LOOP_MONITOR.start()
+    asyncio.create_task(_load_and_coordinate())
 
-    asyncio.create_task(warmup_cache())
+@app.on_event("shutdown")
+async def shutdown_event():
+    COMPUTE.shutdown()
 
-from .routes import *
\ No newline at end of file
+from .routes import *
+from .live import *
+from .bulk import *
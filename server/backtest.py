@@ -0,0 +1,425 @@
+# server/backtest.py
+"""Vectorized backtests of the scanner signals over the stored history.
+
+For a range, every symbol's full history at the range's interval (what the
+bar store kept, plus the cached tail: ``resample.history``) is stacked into
+right-aligned (N, T) arrays (``batch.stack``), and the indicators are
+computed for every bar at once:
+
+* RSI and MACD are recursive; each walks the time axis once (``batch``),
+  every step a NumPy operation over all N symbols;
+* Fibonacci levels and the trend slope cover the trailing ``window`` bars
+  (default: the range's own length, so each step sees what the live
+  analysis of that range would have seen), from rolling extremes and
+  cumulative sums instead of a window pass per bar.
+
+The heuristic score of every bar is ``batch.score_batch``. Chart patterns
+come from the analysis module only (``analyze_dataframe`` on the window
+ending at each bar), so the ``patterns`` toggle is off by default and
+limited to ``MAX_PATTERN_BARS`` evaluated bars; without it the score is the
+scanner's score with patterns off. Bars before the first full window get
+no signal. ``step_columns``/``step_analyses`` hand the ML model the fields
+of the cached analysis that the enabled detectors keep, nothing else. Symbols are split into
+chunks that run in the compute pool in parallel, and the result is kept
+until a symbol's data changes, so re-running with other entry/exit rules
+does not recompute the indicators.
+
+``simulate`` walks the scores once for all symbols. A position opens at the
+close of a bar whose signal is at least ``entry``. It closes at the close of
+the first bar whose signal is at most ``exit``, after ``max_hold`` bars, or
+at the last bar. ``cost`` is charged per side. ``forward_labels`` turns the
+forward return over ``horizon`` bars into training labels.
+"""
+import asyncio
+
+import numpy as np
+
+from .batch import FIB_RATIOS, FIB_TOLERANCE, TREND_THRESHOLD, macd, rsi, score_batch, stack
+from .encoding import range_columns
+from .histo import RANGE_CONFIG, source_range
+from .metrics import METRICS
+from .resample import history
+from .store import TIME_COLUMN, epoch_to_times
+
+SIGNALS = ("score", "ml", "combined")
+CHUNK = 64
+MAX_PATTERN_BARS = 20000
+PATTERN_FIELDS = ("Open", "High", "Low", "Close", "Volume")
+KEEP_RESULTS = 4
+
+
+def rolling_extremes(high: np.ndarray, low: np.ndarray, window: int):
+    """Row-wise highest high and lowest low over the trailing ``window`` bars (NaN-aware)."""
+    from numpy.lib.stride_tricks import sliding_window_view
+
+    pad = ((0, 0), (window - 1, 0))
+    hi = np.pad(np.where(np.isnan(high), -np.inf, high), pad, constant_values=-np.inf)
+    lo = np.pad(np.where(np.isnan(low), np.inf, low), pad, constant_values=np.inf)
+    hi = sliding_window_view(hi, window, axis=1).max(axis=2)
+    lo = sliding_window_view(lo, window, axis=1).min(axis=2)
+    hi[np.isinf(hi)] = np.nan
+    lo[np.isinf(lo)] = np.nan
+    return hi, lo
+
+
+def _trailing(x: np.ndarray, window: int) -> np.ndarray:
+    """Row-wise sums over the trailing ``window`` columns."""
+    c = np.cumsum(x, axis=1)
+    out = c.copy()
+    out[:, window:] -= c[:, :-window]
+    return out
+
+
+def rolling_trend(close: np.ndarray, window: int):
+    """Trend of the trailing ``window`` bars at every bar: (labels, strength).
+
+    The trend is the least-squares slope as total relative change over the
+    window: "bull" above ``TREND_THRESHOLD``, "bear" below minus it.
+    """
+    valid = ~np.isnan(close)
+    t = np.broadcast_to(np.arange(close.shape[1], dtype=float), close.shape)
+    c = np.where(valid, close, 0.0)
+    tv = np.where(valid, t, 0.0)
+    n = _trailing(valid.astype(float), window)
+    st, sc = _trailing(tv, window), _trailing(c, window)
+    stt, stc = _trailing(tv * tv, window), _trailing(tv * c, window)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        slope = (n * stc - st * sc) / (n * stt - st * st)
+        strength = slope * n / (sc / n)
+    strength = np.where(n >= 2, strength, np.nan)
+    labels = np.where(strength > TREND_THRESHOLD, "bull",
+                      np.where(strength < -TREND_THRESHOLD, "bear", "flat"))
+    return labels, strength
+
+
+def valid_bars(close: np.ndarray, window: int) -> np.ndarray:
+    """Bars with a bar and a full ``window`` of history."""
+    return (np.cumsum(~np.isnan(close), axis=1) >= window) & ~np.isnan(close)
+
+
+def signals(cols: dict, window: int, rsi_on: bool = True, macd_on: bool = True, fib_on: bool = True,
+            patterns: np.ndarray = None) -> dict:
+    """Indicators and heuristic score of every bar of stacked ``Close``/``High``/``Low`` arrays.
+
+    ``patterns`` is an (N, T) object array of each bar's pattern list (``pattern_lists``);
+    without it the patterns detector is off.
+    """
+    close = cols["Close"]
+    high = cols.get("High", close)
+    low = cols.get("Low", close)
+    rsi_series = rsi(close)
+    line, sig, hist = macd(close)
+    prev_hist = np.concatenate([np.full((close.shape[0], 1), np.nan), hist[:, :-1]], axis=1)
+    hi, lo = rolling_extremes(high, low, window)
+    levels = hi[..., None] - (hi - lo)[..., None] * np.asarray(FIB_RATIOS)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        dist = np.abs(levels - close[..., None]) / close[..., None]
+        at_level = np.nanmin(np.where(np.isnan(dist), np.inf, dist), axis=2) <= FIB_TOLERANCE
+    labels, strength = rolling_trend(close, window)
+    res = {
+        "close": close,
+        "rsi": rsi_series,
+        "macd": line,
+        "macd_signal": sig,
+        "macd_hist": hist,
+        "macd_cross": (prev_hist <= 0) & (hist > 0),
+        "fib_high": hi,
+        "fib_low": lo,
+        "fib_at_level": at_level,
+        "trend": labels,
+        "trend_strength": strength,
+    }
+    flat = {k: v.ravel() for k, v in res.items()}
+    if patterns is not None:
+        res["patterns"] = patterns
+        has_patterns = np.fromiter((bool(p) for p in patterns.ravel()), dtype=bool, count=patterns.size)
+    else:
+        has_patterns = np.zeros(close.size, dtype=bool)
+    score = score_batch(flat, has_patterns, rsi_on, macd_on, fib_on, patterns=patterns is not None)
+    res["score"] = score.reshape(close.shape)
+    res["valid"] = valid_bars(close, window)
+    return res
+
+
+def _signals_task(cols: dict, window: int, toggles: tuple, patterns: np.ndarray = None) -> dict:
+    return signals(cols, window, *toggles, patterns=patterns)
+
+
+def pattern_lists(cols: dict, window: int, label: str) -> np.ndarray:
+    """``analyze_dataframe``'s ``patterns`` for the ``window`` bars ending at every valid bar.
+
+    Returns an (N, T) object array, None where a bar has no full window. Blocking;
+    one analysis per bar.
+    """
+    from .analyze import analyze_dataframe
+
+    close = cols["Close"]
+    out = np.full(close.shape, None, dtype=object)
+    for r, t in zip(*np.nonzero(valid_bars(close, window))):
+        bars = {f: cols[f][r, t - window + 1:t + 1] for f in PATTERN_FIELDS if f in cols}
+        bars[TIME_COLUMN] = cols[TIME_COLUMN][r, t - window + 1:t + 1].astype(np.int64).astype("datetime64[s]")
+        analysis = analyze_dataframe(bars, label) or {}
+        out[r, t] = list(analysis.get("patterns") or [])
+    return out
+
+
+def simulate(close: np.ndarray, signal: np.ndarray, valid: np.ndarray, entry: float, exit: float,
+             max_hold: int, cost: float = 0.0) -> dict:
+    """Trades of the entry/exit rule on every row: arrays ``row``, ``entry``, ``exit`` (bar indices), ``ret``."""
+    n, length = close.shape
+    opened = np.full(n, -1)
+    price = np.full(n, np.nan)
+    trades = {"row": [], "entry": [], "exit": [], "ret": []}
+    for t in range(length):
+        c = close[:, t]
+        s = signal[:, t]
+        held = (opened >= 0) & ~np.isnan(c)
+        with np.errstate(invalid="ignore"):
+            closing = held & ((s <= exit) | (t - opened >= max_hold) | (t == length - 1))
+            rows = np.flatnonzero(closing)
+            if len(rows):
+                trades["row"].append(rows)
+                trades["entry"].append(opened[rows])
+                trades["exit"].append(np.full(len(rows), t))
+                trades["ret"].append(c[rows] / price[rows] * (1 - cost) / (1 + cost) - 1)
+                opened[rows] = -1
+            opening = (opened < 0) & ~closing & valid[:, t] & (s >= entry) & (t < length - 1)
+        opened[opening] = t
+        price[opening] = c[opening]
+    return {k: np.concatenate(v) if v else np.empty(0, dtype=float if k == "ret" else int)
+            for k, v in trades.items()}
+
+
+def forward_returns(close: np.ndarray, horizon: int) -> np.ndarray:
+    out = np.full(close.shape, np.nan)
+    if horizon < close.shape[1]:
+        with np.errstate(invalid="ignore", divide="ignore"):
+            out[:, :-horizon] = close[:, horizon:] / close[:, :-horizon] - 1
+    return out
+
+
+def summarize(rets: np.ndarray, bars: np.ndarray = None, compound: bool = True) -> dict:
+    """Hit rate and return statistics of a set of trade returns.
+
+    With ``compound`` the trades are taken to be consecutive (one symbol) and
+    the compounded total return and maximum drawdown are added.
+    """
+    rets = np.asarray(rets, dtype=float)
+    if not len(rets):
+        return {"trades": 0}
+    gains, losses = rets[rets > 0].sum(), -rets[rets < 0].sum()
+    out = {
+        "trades": int(len(rets)),
+        "hit_rate": float((rets > 0).mean()),
+        "avg_return": float(rets.mean()),
+        "median_return": float(np.median(rets)),
+        "best": float(rets.max()),
+        "worst": float(rets.min()),
+        "profit_factor": float(gains / losses) if losses else None,
+    }
+    if compound:
+        equity = np.cumprod(1 + rets)
+        peak = np.maximum.accumulate(np.concatenate(([1.0], equity)))[1:]
+        out["total_return"] = float(equity[-1] - 1)
+        out["max_drawdown"] = float(np.max(1 - equity / peak))
+    if bars is not None:
+        out["avg_bars"] = float(np.mean(bars))
+    return out
+
+
+def signal_edge(signal: np.ndarray, valid: np.ndarray, fwd: np.ndarray, entry: float) -> dict:
+    """Forward returns of the bars that would open a position, against all evaluated bars."""
+    base = valid & ~np.isnan(fwd)
+    with np.errstate(invalid="ignore"):
+        fired = base & (signal >= entry)
+
+    def stats(mask):
+        r = fwd[mask]
+        if not len(r):
+            return {"bars": 0}
+        return {"bars": int(len(r)), "hit_rate": float((r > 0).mean()), "avg_return": float(r.mean())}
+
+    return {"signal": stats(fired), "all_bars": stats(base)}
+
+
+def forward_labels(symbols: list, times: np.ndarray, signal: np.ndarray, valid: np.ndarray, close: np.ndarray,
+                   horizon: int, min_return: float = 0.0, entry: float = None) -> list:
+    """(symbol, date, outcome) for evaluated bars: 1 if the return over ``horizon`` bars beats ``min_return``.
+
+    With ``entry`` only bars whose signal is at least ``entry`` are labelled.
+    """
+    fwd = forward_returns(close, horizon)
+    mask = valid & ~np.isnan(fwd)
+    if entry is not None:
+        with np.errstate(invalid="ignore"):
+            mask &= signal >= entry
+    rows, cols = np.nonzero(mask)
+    dates = epoch_to_times(times[rows, cols].astype(np.int64))
+    outcomes = (fwd[rows, cols] > min_return).astype(int)
+    return [(symbols[r], d, int(o)) for r, d, o in zip(rows, dates, outcomes)]
+
+
+def step_columns(res: dict, rows: np.ndarray, cols: np.ndarray, toggles: tuple = (True, True, True)) -> dict:
+    """The bars (rows[i], cols[i]) as flat arrays keyed by their path in the cached analysis.
+
+    Only fields the cached analysis has are included, and of those only what
+    ``filter_analysis`` keeps for the enabled detectors (``/scan_with_ml``
+    predicts on its output). ``patterns`` is there when the signals have them.
+    """
+    rsi_on, macd_on, fib_on = toggles
+    out = {}
+    if rsi_on:
+        out["rsi"] = res["rsi"][rows, cols]
+    if macd_on:
+        hist = res["macd_hist"][rows, cols]
+        out["macd.macd_cross"] = res["macd_cross"][rows, cols]
+        out["macd.direction"] = np.where(hist > 0, "up", np.where(hist < 0, "down", "flat"))
+    if fib_on:
+        out["fibonacci.at_level"] = res["fib_at_level"][rows, cols]
+    if "patterns" in res:
+        out["patterns"] = res["patterns"][rows, cols]
+    out["trend"] = res["trend"][rows, cols]
+    out["score"] = res["score"][rows, cols]
+    return out
+
+
+def step_analyses(columns: dict, start: int, stop: int) -> list:
+    """Analysis dicts, in the layout of the cached analysis, for rows ``start:stop`` of ``step_columns``."""
+    out = []
+    for i in range(start, stop):
+        analysis = {}
+        if "rsi" in columns:
+            rsi_value = columns["rsi"][i]
+            analysis["rsi"] = None if np.isnan(rsi_value) else float(rsi_value)
+        if "macd.macd_cross" in columns:
+            analysis["macd"] = {"macd_cross": bool(columns["macd.macd_cross"][i]),
+                                "direction": str(columns["macd.direction"][i])}
+        if "fibonacci.at_level" in columns:
+            analysis["fibonacci"] = {"at_level": bool(columns["fibonacci.at_level"][i])}
+        if "patterns" in columns:
+            analysis["patterns"] = list(columns["patterns"][i] or [])
+        analysis["trend"] = str(columns["trend"][i])
+        analysis["score"] = float(columns["score"][i])
+        out.append(analysis)
+    return out
+
+
+class Backtester:
+    """Per-bar signals of the cached universe, computed in the compute pool and kept per data version."""
+
+    def __init__(self, store, cache, compute):
+        self.store = store
+        self.cache = cache
+        self.compute = compute
+        self._results = {}   # (range, window, toggles) -> (signature, symbols, times, signals)
+
+    def _collect(self, items: list, range: str, fields=("Close", "High", "Low")):
+        """(symbols, stacked columns) of the symbols' full history. Blocking (memory-mapped reads)."""
+        source = source_range(range)
+        symbols, per_symbol = [], []
+        for symbol, entry in items:
+            try:
+                cols = history(self.store, symbol, source, range_columns(entry, source))
+            except Exception as e:
+                print(f"Backtest skipped {symbol}: {e}")
+                continue
+            if "Close" not in cols or not len(cols["Close"]):
+                continue
+            symbols.append(symbol)
+            per_symbol.append(cols)
+        if not symbols:
+            return [], None
+        length = max(len(c["Close"]) for c in per_symbol)
+        stacked = {f: stack([c.get(f, c["Close"]) for c in per_symbol], length) for f in fields}
+        stacked[TIME_COLUMN] = stack([c[TIME_COLUMN] for c in per_symbol], length)
+        return symbols, stacked
+
+    async def _patterns(self, stacked: dict, window: int, label: str) -> np.ndarray:
+        """``pattern_lists`` of every row, one compute task per symbol."""
+        evaluated = int(valid_bars(stacked["Close"], window).sum())
+        if evaluated > MAX_PATTERN_BARS:
+            raise ValueError(f"patterns runs the analysis on every bar: {evaluated} bars, at most "
+                             f"{MAX_PATTERN_BARS} (pass fewer symbols or a shorter range)")
+        rows = await asyncio.gather(*(
+            self.compute.run(pattern_lists, {f: v[r:r + 1] for f, v in stacked.items()}, window, label)
+            for r in range(len(stacked["Close"]))))
+        return np.concatenate(rows)
+
+    async def signals(self, range: str, window: int = None, toggles: tuple = (True, True, True),
+                      symbols: list = None, patterns: bool = False):
+        """(symbols, times, signals) for every cached symbol having ``range`` (or only ``symbols``).
+
+        ``times`` is an (N, T) float array of epoch seconds, NaN where a row has no bar.
+        With ``patterns`` the patterns detector is on (see ``pattern_lists``); raises
+        ValueError beyond ``MAX_PATTERN_BARS`` evaluated bars.
+        """
+        window = window or RANGE_CONFIG[range]["n_bars"]
+        items = [(s, e) for s, e in list(self.cache.items())
+                 if range in (e.get("data") or {}) and (symbols is None or s in symbols)]
+        signature = tuple((s, e.get("last_updated")) for s, e in items)
+        key = (range, window, tuple(toggles), patterns)
+        cached = self._results.get(key)
+        if cached and cached[0] == signature:
+            return cached[1:]
+
+        fields = PATTERN_FIELDS if patterns else ("Close", "High", "Low")
+        with METRICS.timer("backtest_seconds", stage="collect"):
+            names, stacked = await asyncio.to_thread(self._collect, items, range, fields)
+        if not names:
+            return [], None, None
+        found = None
+        if patterns:
+            with METRICS.timer("backtest_seconds", stage="patterns"):
+                found = await self._patterns(stacked, window, range)
+        times = stacked.pop(TIME_COLUMN)
+        with METRICS.timer("backtest_seconds", stage="signals"):
+            chunks = [slice(i, i + CHUNK) for i in np.arange(0, len(names), CHUNK)]
+            parts = await asyncio.gather(*(
+                self.compute.run(_signals_task, {f: v[c] for f, v in stacked.items()}, window, tuple(toggles),
+                                 None if found is None else found[c])
+                for c in chunks))
+        res = {k: np.concatenate([p[k] for p in parts]) for k in parts[0]}
+        if symbols is None:
+            # Only whole-universe runs are kept; they are the expensive ones.
+            self._results.pop(key, None)
+            self._results[key] = (signature, names, times, res)
+            for old in list(self._results)[:-KEEP_RESULTS]:
+                del self._results[old]
+        return names, times, res
+
+
+def report(symbols: list, times: np.ndarray, res: dict, signal: np.ndarray, entry: float, exit: float,
+           max_hold: int, cost: float, horizon: int, top: int = None, with_trades: bool = False) -> dict:
+    """Simulate the rule and summarize it for the universe and per symbol (best total return first)."""
+    close, valid = res["close"], res["valid"]
+    trades = simulate(close, signal, valid, entry, exit, max_hold, cost)
+    bars = trades["exit"] - trades["entry"]
+    evaluated = valid.any(axis=1)
+    first = valid.argmax(axis=1)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        hold = close[:, -1] / close[np.arange(len(close)), first] - 1
+    by_row = {}
+    order = np.argsort(trades["row"], kind="stable")
+    for rows in np.split(order, np.flatnonzero(np.diff(trades["row"][order])) + 1):
+        if len(rows):
+            by_row[int(trades["row"][rows[0]])] = rows
+    per_symbol = []
+    for row in np.flatnonzero(evaluated):
+        idx = by_row.get(int(row), np.empty(0, dtype=int))
+        per_symbol.append({"symbol": symbols[row], **summarize(trades["ret"][idx], bars[idx] if len(idx) else None),
+                           "buy_and_hold": float(hold[row])})
+    per_symbol.sort(key=lambda s: (s.get("total_return", -np.inf), s["symbol"]), reverse=True)
+    out = {
+        "universe": {**summarize(trades["ret"], bars, compound=False),
+                     "buy_and_hold": float(np.nanmean(hold[evaluated])) if evaluated.any() else None},
+        "edge": {"horizon": horizon, **signal_edge(signal, valid, forward_returns(close, horizon), entry)},
+        "evaluated_symbols": int(evaluated.sum()),
+        "evaluated_bars": int(valid.sum()),
+        "symbols": per_symbol[:top] if top else per_symbol,
+    }
+    if with_trades:
+        t = times[trades["row"], trades["entry"]], times[trades["row"], trades["exit"]]
+        opened, closed = (epoch_to_times(x.astype(np.int64)) if len(x) else [] for x in t)
+        out["trades"] = [{"symbol": symbols[r], "entry": o, "exit": c, "bars": int(b), "return": float(ret)}
+                         for r, o, c, b, ret in zip(trades["row"], opened, closed, bars, trades["ret"])]
+    return out
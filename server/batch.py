@@ -0,0 +1,87 @@
+# server/batch.py
+"""Vectorized indicators over many symbols at once.
+
+Columns of N symbols are stacked into right-aligned (N, T) arrays (shorter
+histories are left-padded with NaN), and RSI and MACD are computed for
+every bar of every symbol in one pass; ``score_batch`` is the heuristic
+score of ``routes.filter_analysis`` over such arrays. ``backtest`` builds
+its signals from these. Scans rank the cached analyses instead (see
+``leaderboard``).
+"""
+import numpy as np
+
+FIB_RATIOS = (0.0, 0.236, 0.382, 0.5, 0.618, 0.786, 1.0)
+FIB_TOLERANCE = 0.01
+TREND_THRESHOLD = 0.02
+
+
+def stack(series, length: int = None) -> np.ndarray:
+    """Right-align 1-D sequences into an (N, T) float array, NaN-padded on the left."""
+    length = length or max((len(s) for s in series), default=0)
+    out = np.full((len(series), length), np.nan)
+    for i, s in enumerate(series):
+        s = np.asarray(s, dtype=float)[-length:]
+        if len(s):
+            out[i, length - len(s):] = s
+    return out
+
+
+def ema(x: np.ndarray, alpha: float) -> np.ndarray:
+    """Row-wise exponential moving average seeded at each row's first valid value.
+
+    NaNs (the left padding) carry the previous value forward. The recursion
+    runs in pandas' compiled ``ewm`` over the time axis, not a Python loop.
+    """
+    import pandas as pd
+
+    if not x.size:
+        return np.full(x.shape, np.nan)
+    frame = pd.DataFrame(x.T)
+    return frame.ewm(alpha=alpha, adjust=False, ignore_na=True).mean().to_numpy().T
+
+
+def ema_span(x: np.ndarray, span: int) -> np.ndarray:
+    return ema(x, 2.0 / (span + 1))
+
+
+def _valid_counts(x: np.ndarray) -> np.ndarray:
+    return np.cumsum(~np.isnan(x), axis=1)
+
+
+def rsi(close: np.ndarray, period: int = 14) -> np.ndarray:
+    """Wilder RSI for every row; NaN until ``period`` price changes are available."""
+    diff = np.diff(close, axis=1)
+    gain = np.where(diff > 0, diff, np.where(np.isnan(diff), np.nan, 0.0))
+    loss = np.where(diff < 0, -diff, np.where(np.isnan(diff), np.nan, 0.0))
+    avg_gain = ema(gain, 1.0 / period)
+    avg_loss = ema(loss, 1.0 / period)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        rs = avg_gain / avg_loss
+        out = np.where(avg_loss == 0, np.where(avg_gain == 0, 50.0, 100.0), 100 - 100 / (1 + rs))
+    out[_valid_counts(diff) < period] = np.nan
+    return np.concatenate([np.full((close.shape[0], 1), np.nan), out], axis=1)
+
+
+def macd(close: np.ndarray, fast: int = 12, slow: int = 26, signal: int = 9):
+    """Return (macd, signal, histogram) arrays."""
+    line = ema_span(close, fast) - ema_span(close, slow)
+    sig = ema_span(line, signal)
+    return line, sig, line - sig
+
+
+def score_batch(res: dict, has_patterns: np.ndarray, rsi: bool = True, macd: bool = True,
+                fib: bool = True, patterns: bool = True) -> np.ndarray:
+    """Vectorized equivalent of ``routes.filter_analysis`` scoring."""
+    n = len(res["close"])
+    score = np.full(n, 0.5)
+    if rsi:
+        r = res["rsi"]
+        score += np.where(r < 30, 0.15, 0.0) - np.where(r > 70, 0.15, 0.0)
+    if macd:
+        score += np.where(res["macd_cross"], 0.10, 0.0)
+    if fib:
+        score += np.where(res["fib_at_level"], 0.08, 0.0)
+    if patterns:
+        score += np.where(has_patterns, 0.10, 0.0)
+    score += np.where(res["trend"] == "bull", 0.15, 0.0) - np.where(res["trend"] == "bear", 0.15, 0.0)
+    return np.clip(score, 0, 1)
@@ -0,0 +1,244 @@
+# server/bulk.py
+"""One request for many symbols and ranges: ``/bulk``.
+
+    GET /bulk?symbols=ATW,IAM&ranges=1d,1y&include=data,analysis,advanced
+
+(or POST the same keys as a JSON object, lists allowed) answers with
+newline-delimited JSON, one part per line, written as soon as it is ready:
+
+    {"symbol": .., "range": .., "kind": "data", "data": {...}, "meta": {...}}
+    {"symbol": .., "range": .., "kind": "analysis", "analysis": {...}, ...}
+    {"symbol": .., "range": .., "kind": "advanced", "advanced": .., "decision": .., "basic": ..}
+    {"symbol": .., "range": .., "kind": "error", "error": ".."}
+    {"symbol": .., "kind": "loading"}          still being fetched; ask again
+    {"kind": "done", "parts": .., "elapsed_ms": ..}
+
+Symbols are handled concurrently. Cached bars and analyses are written
+first, and the data parts reuse the encoded payloads ``/data`` keeps.
+Missing analyses and the advanced analysis of a symbol are computed in one
+compute task per interval: ranges of one interval are cut from the same bars
+(the shorter ranges are the newest bars of the longest), which are packed,
+unpacked and turned into a DataFrame once for all of them. Advanced results
+are kept in the entry until its bars change, shared with
+``/advanced_analysis``.
+"""
+import asyncio
+import time
+
+import numpy as np
+from fastapi import Request
+from fastapi.responses import StreamingResponse
+
+from . import (
+    app, DATA_CACHE, SCHEDULER, COMPUTE, COLD_FETCH_TIMEOUT, load_symbol, safe_response,
+)
+from .encoding import dumps, encoded_range, range_columns
+from .histo import RANGE_CONFIG, source_range
+from .metrics import METRICS
+from .routes import LEADERBOARD, cached_advanced, filter_analysis, store_advanced
+from .store import TIME_COLUMN
+
+BULK_MEDIA_TYPE = "application/x-ndjson"
+INCLUDE = ("data", "analysis", "advanced")
+MAX_BULK_SYMBOLS = 100
+
+
+def _line(part: dict, raw: dict = None) -> bytes:
+    """One NDJSON line; ``raw`` values are already encoded JSON bytes."""
+    body = dumps(part)
+    if raw:
+        body = body[:-1] + b"".join(b"," + dumps(k) + b":" + v for k, v in raw.items()) + b"}"
+    return body + b"\n"
+
+
+def _plan(entry: dict, labels: list) -> dict:
+    """{source range: [(label, start, stop)]}: each label's bars as a slice of its interval's longest range."""
+    data = entry.get("data") or {}
+    groups = {}
+    for label in labels:
+        times = range_columns(entry, label)[TIME_COLUMN]
+        source = source_range(label)
+        start, stop = 0, len(times)
+        if source != label and source in data:
+            source_times = range_columns(entry, source)[TIME_COLUMN]
+            start = int(np.searchsorted(source_times, times[0])) if len(times) else len(source_times)
+            stop = start + len(times)
+            if not np.array_equal(source_times[start:stop], times):
+                source, start, stop = label, 0, len(times)
+        elif source != label:
+            source = label
+        groups.setdefault(source, []).append((label, start, stop))
+    return groups
+
+
+def _as_list(value) -> list:
+    if value is None:
+        return []
+    if isinstance(value, str):
+        value = value.split(",")
+    return [str(v).strip() for v in value if str(v).strip()]
+
+
+class BulkRequest:
+    def __init__(self, params: dict):
+        self.symbols = list(dict.fromkeys(s.upper() for s in _as_list(params.get("symbols"))))
+        self.ranges = list(dict.fromkeys(_as_list(params.get("ranges")) or ["1d"]))
+        self.include = set(_as_list(params.get("include")) or ["data", "analysis"])
+        self.exchange = params.get("exchange") or "CSEMA"
+        self.toggles = tuple(str(params.get(k, True)).lower() not in ("false", "0", "no")
+                             for k in ("rsi", "macd", "fib", "patterns"))
+
+    def error(self):
+        if not self.symbols:
+            return "No symbols given"
+        if len(self.symbols) > MAX_BULK_SYMBOLS:
+            return f"At most {MAX_BULK_SYMBOLS} symbols per request"
+        bad = [r for r in self.ranges if r not in RANGE_CONFIG]
+        if bad:
+            return f"Invalid range: {', '.join(bad)}"
+        bad = sorted(self.include - set(INCLUDE))
+        if bad:
+            return f"Invalid include: {', '.join(bad)} (use {', '.join(INCLUDE)})"
+        return None
+
+
+async def symbol_parts(req: BulkRequest, symbol: str, emit):
+    """Emit the parts of one symbol: cached ones first, then those computed for it."""
+    SCHEDULER.touch(symbol)
+    if not await load_symbol(symbol, req.exchange, timeout=COLD_FETCH_TIMEOUT):
+        emit({"symbol": symbol, "kind": "loading"})
+        return
+    entry = DATA_CACHE.get(symbol, {})
+    data = entry.get("data") or {}
+    if not data:
+        emit({"symbol": symbol, "kind": "error", "error": f"No data available for {symbol}. "
+                                                          f"Last error: {entry.get('last_error')}"})
+        return
+
+    labels = []
+    for label in req.ranges:
+        if label not in data:
+            emit({"symbol": symbol, "range": label, "kind": "error", "error": f"No data for range {label}"})
+        else:
+            labels.append(label)
+    meta = {"symbol": symbol, "exchange": req.exchange, "last_updated": entry.get("last_updated"),
+            "status": entry.get("status")}
+    analyze, advanced = [], []
+    for label in labels:
+        if "data" in req.include:
+            emit({"symbol": symbol, "range": label, "kind": "data"},
+                 {"data": encoded_range(entry, label), "meta": dumps(meta)})
+        analysis = (entry.get("analysis") or {}).get(label)
+        if "analysis" in req.include:
+            if analysis and "error" not in analysis:
+                emit(_analysis_part(entry, symbol, label, analysis, req.toggles))
+            else:
+                analyze.append(label)
+        if "advanced" in req.include:
+            cached = cached_advanced(entry, label)
+            if cached is not None:
+                emit(_advanced_part(entry, symbol, label, *cached))
+            else:
+                advanced.append(label)
+    if not analyze and not advanced:
+        return
+
+    stamp = entry.get("last_updated")
+    groups = _plan(entry, [label for label in labels if label in analyze or label in advanced])
+
+    async def compute(source, members):
+        ranges = [(label, start, stop, label in analyze, label in advanced) for label, start, stop in members]
+        try:
+            results = await COMPUTE.bundle(data[source], ranges, cols=range_columns(entry, source))
+        except Exception as e:
+            for label, *_ in members:
+                emit({"symbol": symbol, "range": label, "kind": "error", "error": str(e)})
+            return
+        for label, *_ in members:
+            result = results.get(label) or {}
+            if "error" in result:
+                emit({"symbol": symbol, "range": label, "kind": "error", "error": result["error"]})
+                continue
+            if "analysis" in result:
+                entry.setdefault("analysis", {})[label] = result["analysis"]
+                entry.setdefault("analysis_last_updated", {})[label] = time.time()
+                LEADERBOARD.update(symbol, label, result["analysis"], entry["analysis_last_updated"][label])
+                emit(_analysis_part(entry, symbol, label, result["analysis"], req.toggles))
+            if "advanced" in result:
+                if entry.get("last_updated") == stamp:
+                    store_advanced(entry, label, result["advanced"], result["decision"])
+                emit(_advanced_part(entry, symbol, label, result["advanced"], result["decision"]))
+
+    await asyncio.gather(*(compute(source, members) for source, members in groups.items()))
+
+
+def _analysis_part(entry: dict, symbol: str, label: str, analysis: dict, toggles) -> dict:
+    return {"symbol": symbol, "range": label, "kind": "analysis", "analysis": filter_analysis(analysis, *toggles),
+            "analysis_last_updated": (entry.get("analysis_last_updated") or {}).get(label)}
+
+
+def _advanced_part(entry: dict, symbol: str, label: str, advanced: dict, decision: dict) -> dict:
+    return {"symbol": symbol, "range": label, "kind": "advanced", "advanced": advanced, "decision": decision,
+            "basic": (entry.get("analysis") or {}).get(label, {})}
+
+
+async def stream_parts(req: BulkRequest):
+    t0 = time.perf_counter()
+    queue = asyncio.Queue()
+    counts = {}
+
+    def emit(part: dict, raw: dict = None):
+        counts[part["kind"]] = counts.get(part["kind"], 0) + 1
+        queue.put_nowait(_line(part, raw))
+
+    async def run(symbol):
+        try:
+            await symbol_parts(req, symbol, emit)
+        except Exception as e:
+            emit({"symbol": symbol, "kind": "error", "error": str(e)})
+        finally:
+            queue.put_nowait(None)
+
+    tasks = [asyncio.create_task(run(symbol)) for symbol in req.symbols]
+    try:
+        pending = len(tasks)
+        while pending:
+            line = await queue.get()
+            if line is None:
+                pending -= 1
+                continue
+            yield line
+        for kind, n in counts.items():
+            METRICS.inc("bulk_parts_total", n, kind=kind)
+        yield _line({"kind": "done", "symbols": len(req.symbols), "parts": sum(counts.values()),
+                     "elapsed_ms": (time.perf_counter() - t0) * 1e3})
+    finally:
+        # Client went away: stop computing for it.
+        for task in tasks:
+            task.cancel()
+
+
+@app.api_route("/bulk", methods=["GET", "POST"])
+async def bulk(request: Request):
+    """Data, analysis and advanced analysis of many symbols and ranges, streamed as NDJSON parts.
+
+    Parameters (query string, or a JSON body for POST): ``symbols`` and ``ranges``
+    (comma-separated or lists), ``include`` (``data``, ``analysis``, ``advanced``;
+    default data and analysis), ``exchange`` and the ``rsi``/``macd``/``fib``/``patterns``
+    toggles of ``/analyze_cached``.
+    """
+    params = dict(request.query_params)
+    if request.method == "POST":
+        try:
+            body = await request.json()
+        except ValueError:
+            body = None
+        if not isinstance(body, dict):
+            return safe_response({'error': 'Body must be a JSON object'}, status_code=400)
+        params.update(body)
+    req = BulkRequest(params)
+    error = req.error()
+    if error:
+        return safe_response({'error': error}, status_code=400)
+    return StreamingResponse(stream_parts(req), media_type=BULK_MEDIA_TYPE,
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
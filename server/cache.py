@@ -0,0 +1,178 @@
+# server/cache.py
+"""``DATA_CACHE``: symbol -> entry, bounded in memory.
+
+Entries are hot or cold. A hot entry holds its bars as NumPy columns on the
+heap (int64 epoch ``Time``, float64 OHLCV; the shorter ranges of an
+interval are views of the longest one) and is kept fresh by the refresh
+scheduler. A cold entry keeps only its metadata and last analysis; its bars
+are memory-mapped from the bar store when read, so they cost page cache
+rather than heap, and nobody refreshes it.
+
+``enforce`` demotes hot entries to cold:
+
+* TTL: entries no client requested for ``ttl`` seconds;
+* LRU: least recently requested entries, while the hot entries together
+  take more than ``max_bytes``.
+
+A request for a cold symbol (``touch``) promotes it again: it is scheduled
+for refresh, which brings its bars back onto the heap.
+"""
+from collections import OrderedDict
+from collections.abc import MutableMapping
+import time
+
+import numpy as np
+
+from .encoding import make_serializable
+from .store import LazyRanges
+
+# Entry fields kept when an entry goes cold.
+COLD_FIELDS = ("exchange", "last_updated", "persisted_at", "status", "analysis",
+               "analysis_last_updated", "last_error", "last_attempt")
+
+
+def _array_bytes(arrays) -> int:
+    """Heap bytes behind ``arrays``, counting shared buffers once and memory maps not at all."""
+    seen = set()
+    total = 0
+    for arr in arrays:
+        base = arr
+        while isinstance(base, np.ndarray) and base.base is not None and isinstance(base.base, np.ndarray):
+            base = base.base
+        if isinstance(base, np.memmap) or id(base) in seen:
+            continue
+        seen.add(id(base))
+        total += base.nbytes if isinstance(base, np.ndarray) else 0
+    return total
+
+
+def entry_bytes(entry: dict) -> int:
+    """Heap bytes of an entry's bars, typed-column cache and encoded payloads."""
+    arrays = []
+    data = entry.get("data")
+    if data and not isinstance(data, LazyRanges):
+        for rdata in data.values():
+            arrays.extend(v for v in rdata.values() if isinstance(v, np.ndarray))
+    for _, cols in (entry.get("columns") or {}).values():
+        arrays.extend(v for v in cols.values() if isinstance(v, np.ndarray))
+    encoded = sum(len(body) for _, body in (entry.get("encoded") or {}).values())
+    return _array_bytes(arrays) + encoded
+
+
+class BarCache(MutableMapping):
+    def __init__(self, store, windows: dict, max_bytes: int, ttl: float):
+        self.store = store
+        self.windows = windows
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._entries = OrderedDict()   # least recently requested first
+        self._requested = {}    # last request, or insertion for never requested entries
+        self._touched = {}      # last request
+        # Called with the symbol when an entry goes cold / is requested while cold.
+        self.on_demote = []
+        self.on_promote = []
+        self.stats = {"demoted_ttl": 0, "demoted_lru": 0, "promoted": 0}
+
+    # -- mapping -----------------------------------------------------------
+
+    def __getitem__(self, symbol):
+        return self._entries[symbol]
+
+    def __setitem__(self, symbol, entry):
+        if symbol not in self._entries:
+            self._requested.setdefault(symbol, time.time())
+        self._entries[symbol] = entry
+
+    def __delitem__(self, symbol):
+        del self._entries[symbol]
+        self._requested.pop(symbol, None)
+        self._touched.pop(symbol, None)
+
+    def __iter__(self):
+        return iter(self._entries)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def entries(self) -> list:
+        """(symbol, entry) pairs, copied in one step (safe to take from another thread)."""
+        return list(self._entries.items())
+
+    # -- tiers -------------------------------------------------------------
+
+    @staticmethod
+    def is_cold(entry: dict) -> bool:
+        return isinstance(entry.get("data"), LazyRanges)
+
+    def cold_entry(self, symbol: str, fields: dict = None) -> dict:
+        """An entry whose bars are read from the bar store on demand."""
+        return {**(fields or {}), "data": LazyRanges(self.store, symbol, self.windows)}
+
+    def hot_symbols(self) -> list:
+        return [s for s, e in self._entries.items() if e.get("data") and not self.is_cold(e)]
+
+    def touch(self, symbol: str):
+        """Record a client request for ``symbol``; a cold entry is promoted."""
+        self._requested[symbol] = self._touched[symbol] = time.time()
+        if symbol not in self._entries:
+            return
+        self._entries.move_to_end(symbol)
+        if self.is_cold(self._entries[symbol]):
+            self.stats["promoted"] += 1
+            for listener in self.on_promote:
+                listener(symbol)
+
+    def requested_since(self, since: float) -> list:
+        """Symbols a client requested at or after ``since`` (epoch seconds)."""
+        return [s for s, t in self._touched.items() if t >= since and s in self._entries]
+
+    def demote(self, symbol: str):
+        entry = self._entries.get(symbol)
+        if not entry or not entry.get("data") or self.is_cold(entry):
+            return False
+        if entry.get("persisted_at") != entry.get("last_updated"):
+            # Cold bars are read back from the store, so they must be there.
+            self.store.save_entry(symbol, entry, make_serializable(entry.get("analysis") or {}))
+            entry["persisted_at"] = entry.get("last_updated")
+        if symbol not in self.store.symbols():
+            return False
+        self._entries[symbol] = self.cold_entry(symbol, {k: entry[k] for k in COLD_FIELDS if k in entry})
+        for listener in self.on_demote:
+            listener(symbol)
+        return True
+
+    def enforce(self, now: float = None):
+        """Demote idle entries, then least recently requested ones until under ``max_bytes``."""
+        now = now or time.time()
+        for symbol in self.hot_symbols():
+            if now - self._requested.get(symbol, 0) > self.ttl and self.demote(symbol):
+                self.stats["demoted_ttl"] += 1
+        sizes = {s: entry_bytes(self._entries[s]) for s in self.hot_symbols()}
+        total = sum(sizes.values())
+        for symbol in list(self._entries):
+            if total <= self.max_bytes:
+                break
+            if symbol in sizes and self.demote(symbol):
+                self.stats["demoted_lru"] += 1
+                total -= sizes[symbol]
+
+    def usage(self) -> dict:
+        """Memory accounting: per-symbol heap bytes and tier, plus totals."""
+        now = time.time()
+        symbols = {}
+        for symbol, entry in self._entries.items():
+            symbols[symbol] = {
+                "tier": "cold" if self.is_cold(entry) else "hot",
+                "bytes": entry_bytes(entry),
+                "idle": round(now - self._requested.get(symbol, now), 1),
+            }
+        hot = [u for u in symbols.values() if u["tier"] == "hot"]
+        return {
+            "max_bytes": self.max_bytes,
+            "ttl": self.ttl,
+            "hot_bytes": sum(u["bytes"] for u in hot),
+            "hot": len(hot),
+            "cold": len(symbols) - len(hot),
+            **self.stats,
+            "symbols": symbols,
+        }
@@ -0,0 +1,325 @@
+# server/compute.py
+"""CPU-bound work off the event loop.
+
+``ComputeExecutor`` runs analysis and training in a process pool so a heavy
+request cannot stall other clients or the refresh loop. Bars go to the
+workers through shared memory: the numeric columns of a range are packed
+into one block (int64 epoch Time, float64 values) and only its name and
+layout are pickled; training gets the bars of the whole cache in one
+block and converts them to the trainer's layout in the worker. Every task
+has a timeout; a task that overruns it has its worker processes killed and
+the pool is replaced, since a running task cannot be cancelled any other
+way. The other tasks that pool was running
+or holding are resubmitted, once, to the new pool.
+
+``LoopMonitor`` measures how late the event loop wakes up from a short
+sleep, which is how long some callback blocked it.
+"""
+import asyncio
+import copy
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import multiprocessing
+from multiprocessing import shared_memory
+import os
+import time
+import weakref
+
+import numpy as np
+
+from .metrics import METRICS
+from .store import columns_from_dict, dict_from_columns, TIME_COLUMN
+
+
+def _write_block(tables: list):
+    """Copy every column of ``tables`` (typed column dicts) into one new shared memory block.
+
+    Returns (block, [layout of each table]), a layout being [(name, dtype, offset, length)].
+    """
+    layouts = []
+    offset = 0
+    for cols in tables:
+        layout = []
+        for name, values in cols.items():
+            layout.append((name, values.dtype.str, offset, len(values)))
+            offset += values.nbytes
+        layouts.append(layout)
+    shm = shared_memory.SharedMemory(create=True, size=max(offset, 1))
+    for layout, cols in zip(layouts, tables):
+        for (name, dtype, start, n), values in zip(layout, cols.values()):
+            np.ndarray(n, dtype=dtype, buffer=shm.buf, offset=start)[:] = values
+    return shm, layouts
+
+
+def _read_block(name: str, layouts: list, time_dtype: str = None) -> list:
+    """Worker side of ``_write_block``: the tables as NumPy columns, detached from the block.
+
+    Each column is copied out of the block once, as an array (``Time`` as
+    ``time_dtype`` if given), so nothing is converted value by value.
+    """
+    # Workers share the parent's resource tracker, which unregisters the
+    # block when the parent unlinks it.
+    shm = shared_memory.SharedMemory(name=name)
+    try:
+        tables = []
+        for layout in layouts:
+            cols = {}
+            for col, dtype, start, n in layout:
+                values = np.ndarray(n, dtype=dtype, buffer=shm.buf, offset=start)
+                cols[col] = values.astype(time_dtype) if time_dtype and col == TIME_COLUMN else values.copy()
+                del values
+            tables.append(cols)
+    finally:
+        shm.close()
+    return tables
+
+
+def _pack(rdata: dict, cols: dict = None):
+    """Copy the numeric columns of ``rdata`` (or its already typed ``cols``) into a new shared memory block."""
+    if cols is None:
+        cols = columns_from_dict(rdata)
+    shm, (layout,) = _write_block([cols])
+    # Non-numeric columns (the repeated ``symbol``) are small; pickle them.
+    extra = {k: v for k, v in rdata.items() if k not in cols}
+    return shm, (shm.name, layout, extra)
+
+
+def _unpack(packed) -> dict:
+    """Worker side of ``_pack``: the range dict as NumPy columns (``Time`` as datetime64)."""
+    name, layout, extra = packed
+    (rdata,) = _read_block(name, [layout], "datetime64[s]")
+    rdata.update(extra)
+    return rdata
+
+
+def _pack_cache(cache: dict):
+    """``_pack`` for a training snapshot: the bars of every (symbol, range) in one block.
+
+    ``cache`` is {symbol: {"columns": {range: typed columns}, ...}}; the other
+    fields of each symbol (analysis, status) are small and pickled. Blocking.
+    """
+    keys = [(symbol, label) for symbol, item in cache.items() for label in item["columns"]]
+    shm, layouts = _write_block([cache[symbol]["columns"][label] for symbol, label in keys])
+    meta = {symbol: {k: v for k, v in item.items() if k != "columns"} for symbol, item in cache.items()}
+    return shm, (shm.name, keys, layouts, meta)
+
+
+def _unpack_cache(packed) -> dict:
+    """Worker side of ``_pack_cache``: the cache in the JSON ``/data`` layout ``trainer.train`` reads."""
+    name, keys, layouts, meta = packed
+    cache = {symbol: {**item, "data": {}} for symbol, item in meta.items()}
+    for (symbol, label), cols in zip(keys, _read_block(name, layouts)):
+        cache[symbol]["data"][label] = dict_from_columns(cols)
+    return cache
+
+
+def _analyze_task(packed, label):
+    from .analyze import analyze_dataframe
+
+    return analyze_dataframe(_unpack(packed), label)
+
+
+def _advanced_task(packed):
+    import pandas as pd
+    from .advanced_analysis import get_advanced_analysis, generate_decision_signal
+
+    advanced = get_advanced_analysis(pd.DataFrame(_unpack(packed)))
+    return advanced, generate_decision_signal(advanced)
+
+
+def _bundle_task(packed, ranges):
+    """Analysis of several ranges that share one set of bars.
+
+    ``ranges`` is [(label, start, stop, analyze, advanced)]: each range is bars
+    [start:stop] of the packed ones, and the flags say what to compute for
+    it. The bars are unpacked, and the DataFrame built, once for all of them.
+    Returns {label: {"analysis", "advanced", "decision"} or {"error"}}.
+    """
+    rdata = _unpack(packed)
+    frame = None
+    out = {}
+    for label, start, stop, analyze, advanced in ranges:
+        result = out[label] = {}
+        try:
+            if analyze:
+                from .analyze import analyze_dataframe
+
+                sliced = {k: v[start:stop] if isinstance(v, (list, np.ndarray)) else v for k, v in rdata.items()}
+                result["analysis"] = analyze_dataframe(sliced, label)
+            if advanced:
+                import pandas as pd
+                from .advanced_analysis import get_advanced_analysis, generate_decision_signal
+
+                if frame is None:
+                    frame = pd.DataFrame(rdata)
+                result["advanced"] = get_advanced_analysis(frame.iloc[start:stop].reset_index(drop=True))
+                result["decision"] = generate_decision_signal(result["advanced"])
+        except Exception as e:
+            result.clear()
+            result["error"] = str(e)
+    return out
+
+
+def _train_task(trainer, packed):
+    result = trainer.train(_unpack_cache(packed))
+    return trainer, result
+
+
+class ComputeExecutor:
+    def __init__(self, workers: int = None, timeout: float = 30.0):
+        """``workers`` = 0 runs tasks in a thread instead (no process pool)."""
+        self.workers = (os.cpu_count() or 2) if workers is None else workers
+        self.timeout = timeout
+        self._pool = None
+        self._killed = weakref.WeakSet()   # pools terminated for a task's timeout
+        self.stats = {"submitted": 0, "completed": 0, "errors": 0, "timeouts": 0, "resubmitted": 0,
+                      "pool_restarts": 0, "in_flight": 0, "last_ms": 0.0, "avg_ms": 0.0}
+
+    def _get_pool(self) -> ProcessPoolExecutor:
+        if self._pool is None:
+            # forkserver: workers don't inherit the server's threads and sockets.
+            self._pool = ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context("forkserver"))
+        return self._pool
+
+    def _recycle(self, pool, killed: bool = False):
+        if killed:
+            self._killed.add(pool)
+        if self._pool is not pool:
+            return
+        self._pool = None
+        self.stats["pool_restarts"] += 1
+        # ProcessPoolExecutor has no way to stop a running task.
+        for proc in list((getattr(pool, "_processes", None) or {}).values()):
+            proc.terminate()
+        pool.shutdown(wait=False, cancel_futures=True)
+
+    async def run(self, fn, *args, timeout: float = None):
+        """Run ``fn(*args)`` in the pool (``fn`` and its arguments must pickle)."""
+        timeout = self.timeout if timeout is None else timeout
+        self.stats["submitted"] += 1
+        self.stats["in_flight"] += 1
+        t0 = time.perf_counter()
+        try:
+            if not self.workers:
+                result = await asyncio.wait_for(asyncio.to_thread(fn, *args), timeout)
+            else:
+                result = await self._run_in_pool(fn, args, timeout)
+        except asyncio.TimeoutError:
+            self.stats["timeouts"] += 1
+            METRICS.inc("compute_timeouts_total", task=getattr(fn, "__name__", "task"))
+            raise TimeoutError(f"{getattr(fn, '__name__', fn)} exceeded {timeout}s")
+        except Exception:
+            self.stats["errors"] += 1
+            raise
+        finally:
+            self.stats["in_flight"] -= 1
+        elapsed = time.perf_counter() - t0
+        METRICS.observe("compute_seconds", elapsed, task=getattr(fn, "__name__", "task").strip("_"))
+        ms = elapsed * 1e3
+        self.stats["completed"] += 1
+        self.stats["last_ms"] = ms
+        self.stats["avg_ms"] = 0.9 * self.stats["avg_ms"] + 0.1 * ms
+        return result
+
+    def _collateral(self, pool) -> bool:
+        """A task failed because ``pool`` was killed for another task's timeout (not cancelled itself)."""
+        return pool in self._killed and not asyncio.current_task().cancelling()
+
+    async def _run_in_pool(self, fn, args, timeout):
+        for attempt in range(2):
+            pool = self._get_pool()
+            try:
+                fut = asyncio.get_running_loop().run_in_executor(pool, fn, *args)
+                return await asyncio.wait_for(fut, timeout)
+            except asyncio.TimeoutError:
+                self._recycle(pool, killed=True)
+                raise
+            except (BrokenProcessPool, asyncio.CancelledError) as e:
+                # Killing the pool breaks the tasks it was running and cancels
+                # the queued ones: run those again on the new pool.
+                if attempt == 0 and self._collateral(pool):
+                    self.stats["resubmitted"] += 1
+                    METRICS.inc("compute_resubmitted_total", task=getattr(fn, "__name__", "task"))
+                    continue
+                if isinstance(e, BrokenProcessPool):
+                    self._recycle(pool)
+                raise
+
+    async def run_on_bars(self, fn, rdata: dict, *args, cols: dict = None, timeout: float = None):
+        """``fn(packed_bars, *args)`` with ``rdata`` passed through shared memory.
+
+        Pass the range's typed columns (``encoding.range_columns``) as ``cols``
+        to skip converting them again on the event loop.
+        """
+        with METRICS.timer("compute_pack_seconds"):
+            shm, packed = _pack(rdata, cols)
+        try:
+            return await self.run(fn, packed, *args, timeout=timeout)
+        finally:
+            shm.close()
+            shm.unlink()
+
+    async def analyze(self, rdata: dict, label: str, cols: dict = None, timeout: float = None) -> dict:
+        return await self.run_on_bars(_analyze_task, rdata, label, cols=cols, timeout=timeout)
+
+    async def advanced(self, rdata: dict, cols: dict = None, timeout: float = None):
+        """(advanced analysis, decision signal) of one range."""
+        return await self.run_on_bars(_advanced_task, rdata, cols=cols, timeout=timeout)
+
+    async def bundle(self, rdata: dict, ranges: list, cols: dict = None, timeout: float = None) -> dict:
+        """Analysis of several ranges cut from the bars of ``rdata`` in one task (see ``_bundle_task``)."""
+        return await self.run_on_bars(_bundle_task, rdata, ranges, cols=cols, timeout=timeout)
+
+    async def train(self, trainer, cache: dict, timeout: float = None):
+        """Train a copy of ``trainer`` in a worker; returns (the fitted copy, the training result).
+
+        ``cache`` is {symbol: {"columns": {range: typed columns}, "analysis": ..,
+        ...}}; its bars go through shared memory, packed on a thread.
+        """
+        if not self.workers:
+            # No pickling to a worker process: copy here, the caller still serves ``trainer``.
+            trainer = await asyncio.to_thread(copy.deepcopy, trainer)
+        with METRICS.timer("compute_pack_seconds"):
+            shm, packed = await asyncio.to_thread(_pack_cache, cache)
+        try:
+            return await self.run(_train_task, trainer, packed, timeout=timeout)
+        finally:
+            shm.close()
+            shm.unlink()
+
+    def shutdown(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+
+    def metrics(self) -> dict:
+        return {"workers": self.workers, **self.stats}
+
+
+class LoopMonitor:
+    """Event loop lag: how much later than requested a short sleep returns."""
+
+    def __init__(self, interval: float = 0.1, stall: float = 0.1):
+        self.interval = interval
+        self.stall = stall
+        self._task = None
+        self.stats = {"last_lag_ms": 0.0, "avg_lag_ms": 0.0, "max_lag_ms": 0.0, "stalls": 0}
+
+    async def _run(self):
+        while True:
+            t0 = time.perf_counter()
+            await asyncio.sleep(self.interval)
+            lag = max(0.0, time.perf_counter() - t0 - self.interval)
+            ms = lag * 1e3
+            self.stats["last_lag_ms"] = ms
+            self.stats["avg_lag_ms"] = 0.95 * self.stats["avg_lag_ms"] + 0.05 * ms
+            self.stats["max_lag_ms"] = max(self.stats["max_lag_ms"], ms)
+            if lag >= self.stall:
+                self.stats["stalls"] += 1
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    def metrics(self) -> dict:
+        return dict(self.stats)
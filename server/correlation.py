@@ -0,0 +1,245 @@
+# server/correlation.py
+"""Incrementally maintained correlation of bar returns.
+
+Returns are placed on a grid of actual bar timestamps: row = timestamp,
+column = symbol, NaN where a symbol has no bar (or no previous bar) at that
+time. For every pair the engine keeps pairwise-complete running sums
+
+    n = M'M,  Sx = X'M,  Sxx = (X*X)'M,  Sxy = X'X
+
+(X = returns with NaN as 0, M = presence mask), so correlations need no
+pass over the history. When bars change, the old contribution of the
+touched rows is subtracted and the new one added: O(rows * N^2), as a
+matrix product. Rows older than the range window are evicted the same way,
+and the sums are rebuilt from scratch now and then to shed float drift.
+"""
+import numpy as np
+
+from .encoding import range_columns
+
+BLOCK = 256
+
+
+def _block_sums(A: np.ndarray, B: np.ndarray):
+    """Running-sum contributions of row blocks ``A`` (k, I) and ``B`` (k, J)."""
+    ma = ~np.isnan(A)
+    mb = ~np.isnan(B)
+    xa = np.where(ma, A, 0.0)
+    xb = np.where(mb, B, 0.0)
+    fa = ma.astype(float)
+    fb = mb.astype(float)
+    return fa.T @ fb, xa.T @ fb, (xa * xa).T @ fb, xa.T @ xb
+
+
+class CorrelationEngine:
+    def __init__(self, window: int, min_periods: int = 5, rebuild_every: int = 500):
+        self.window = window
+        self.min_periods = min_periods
+        self.rebuild_every = rebuild_every
+        self.R = np.full((0, 0), np.nan)
+        self.row_of = {}      # epoch seconds -> row
+        self.free_rows = []
+        self.col_of = {}      # symbol -> column
+        self.free_cols = []
+        self.stamps = {}      # symbol -> last_updated already applied
+        self.tail = {}        # symbol -> time of the last return applied
+        self.n = self.sx = self.sxx = self.sxy = np.zeros((0, 0))
+        self.updates = 0
+
+    # -- storage -------------------------------------------------------------
+
+    def _grow(self, rows: int = 0, cols: int = 0):
+        r0, c0 = self.R.shape
+        r1 = max(r0, rows)
+        c1 = max(c0, cols)
+        if (r1, c1) == (r0, c0):
+            return
+        R = np.full((r1, c1), np.nan)
+        R[:r0, :c0] = self.R
+        self.R = R
+        self.free_rows.extend(range(r1 - 1, r0 - 1, -1))
+        if c1 != c0:
+            for name in ("n", "sx", "sxx", "sxy"):
+                grown = np.zeros((c1, c1))
+                grown[:c0, :c0] = getattr(self, name)
+                setattr(self, name, grown)
+            self.free_cols.extend(range(c1 - 1, c0 - 1, -1))
+
+    def _row(self, t: int) -> int:
+        row = self.row_of.get(t)
+        if row is None:
+            if not self.free_rows:
+                self._grow(rows=max(16, 2 * self.R.shape[0]))
+            row = self.free_rows.pop()
+            self.row_of[t] = row
+        return row
+
+    def _col(self, symbol: str) -> int:
+        col = self.col_of.get(symbol)
+        if col is None:
+            if not self.free_cols:
+                self._grow(cols=max(16, 2 * self.R.shape[1]))
+            col = self.free_cols.pop()
+            self.col_of[symbol] = col
+        return col
+
+    # -- sums ------------------------------------------------------------------
+
+    def _apply(self, sign: float, block: np.ndarray):
+        if not len(block):
+            return
+        n, sx, sxx, sxy = _block_sums(block, block)
+        self.n += sign * n
+        self.sx += sign * sx
+        self.sxx += sign * sxx
+        self.sxy += sign * sxy
+
+    def _replace(self, rows: np.ndarray, cols: np.ndarray, values: np.ndarray):
+        touched = np.unique(rows)
+        self._apply(-1.0, self.R[touched])
+        self.R[rows, cols] = values
+        self._apply(1.0, self.R[touched])
+        self.updates += 1
+
+    def rebuild(self):
+        """Recompute every sum from the return grid, one column block pair at a time."""
+        N = self.R.shape[1]
+        for name in ("n", "sx", "sxx", "sxy"):
+            setattr(self, name, np.zeros((N, N)))
+        live = np.array(sorted(self.row_of.values()), dtype=int)
+        R = self.R[live]
+        for i in range(0, N, BLOCK):
+            for j in range(0, N, BLOCK):
+                n, sx, sxx, sxy = _block_sums(R[:, i:i + BLOCK], R[:, j:j + BLOCK])
+                self.n[i:i + BLOCK, j:j + BLOCK] = n
+                self.sx[i:i + BLOCK, j:j + BLOCK] = sx
+                self.sxx[i:i + BLOCK, j:j + BLOCK] = sxx
+                self.sxy[i:i + BLOCK, j:j + BLOCK] = sxy
+        self.updates = 0
+
+    def _evict(self):
+        excess = len(self.row_of) - self.window
+        if excess <= 0:
+            return
+        oldest = sorted(self.row_of)[:excess]
+        rows = np.array([self.row_of.pop(t) for t in oldest], dtype=int)
+        self._apply(-1.0, self.R[rows])
+        self.R[rows] = np.nan
+        self.free_rows.extend(rows.tolist())
+
+    def _drop(self, symbol: str):
+        col = self.col_of.pop(symbol)
+        rows = np.nonzero(~np.isnan(self.R[:, col]))[0]
+        if len(rows):
+            self._replace(rows, np.full(len(rows), col), np.full(len(rows), np.nan))
+        for name in ("n", "sx", "sxx", "sxy"):
+            m = getattr(self, name)
+            m[col, :] = 0.0
+            m[:, col] = 0.0
+        self.free_cols.append(col)
+        self.stamps.pop(symbol, None)
+        self.tail.pop(symbol, None)
+
+    # -- sync ------------------------------------------------------------------
+
+    def sync(self, cache: dict, range: str):
+        """Apply bars that changed in ``cache`` since the last sync."""
+        rows, cols, values = [], [], []
+        seen = set()
+        for symbol, entry in list(cache.items()):
+            if range not in (entry.get("data") or {}):
+                continue
+            seen.add(symbol)
+            stamp = entry.get("last_updated")
+            if symbol in self.col_of and self.stamps.get(symbol) == stamp:
+                continue
+            try:
+                bars = range_columns(entry, range)
+            except Exception:
+                continue
+            close = bars.get("Close")
+            if close is None or len(close) < 2:
+                continue
+            with np.errstate(divide="ignore", invalid="ignore"):
+                ret = close[1:] / close[:-1] - 1.0
+            ret[~np.isfinite(ret)] = np.nan
+            times = bars["Time"][1:]
+            start = 0
+            if symbol in self.tail:
+                start = int(np.searchsorted(times, self.tail[symbol], side="left"))
+            col = self._col(symbol)
+            for t, v in zip(times[start:].tolist(), ret[start:]):
+                rows.append(self._row(t))
+                cols.append(col)
+                values.append(v)
+            self.stamps[symbol] = stamp
+            self.tail[symbol] = int(times[-1])
+
+        for symbol in [s for s in self.col_of if s not in seen]:
+            self._drop(symbol)
+        if rows:
+            self._replace(np.array(rows, dtype=int), np.array(cols, dtype=int), np.array(values))
+        self._evict()
+        if self.updates >= self.rebuild_every:
+            self.rebuild()
+
+    # -- queries ---------------------------------------------------------------
+
+    def _corr(self, I: np.ndarray, J: np.ndarray) -> np.ndarray:
+        n = self.n[np.ix_(I, J)]
+        sx = self.sx[np.ix_(I, J)]
+        sy = self.sx[np.ix_(J, I)].T
+        sxx = self.sxx[np.ix_(I, J)]
+        syy = self.sxx[np.ix_(J, I)].T
+        sxy = self.sxy[np.ix_(I, J)]
+        with np.errstate(divide="ignore", invalid="ignore"):
+            cov = sxy - sx * sy / n
+            vx = sxx - sx * sx / n
+            vy = syy - sy * sy / n
+            corr = cov / np.sqrt(vx * vy)
+        bad = (n < self.min_periods) | (vx <= 1e-18) | (vy <= 1e-18)
+        corr[bad] = np.nan
+        return np.clip(corr, -1.0, 1.0)
+
+    def matrix(self, symbols) -> dict:
+        """Correlation of ``symbols`` as {column: {row: value}} (like DataFrame.corr().to_dict())."""
+        present = [s for s in symbols if s in self.col_of]
+        idx = np.array([self.col_of[s] for s in present], dtype=int)
+        corr = self._corr(idx, idx) if len(idx) else np.zeros((0, 0))
+        return {a: {b: (None if np.isnan(corr[j, i]) else float(corr[j, i])) for j, b in enumerate(present)}
+                for i, a in enumerate(present)}
+
+    def top_pairs(self, k: int, symbols=None, absolute: bool = False) -> list:
+        """The ``k`` most correlated distinct pairs, computed one row block at a time."""
+        names = [s for s in (symbols or self.col_of) if s in self.col_of]
+        idx = np.array([self.col_of[s] for s in names], dtype=int)
+        best_v = np.empty(0)
+        best_ij = np.empty((0, 2), dtype=int)
+        for start in range(0, len(idx), BLOCK):
+            block = self._corr(idx[start:start + BLOCK], idx)
+            rows = np.arange(start, start + len(block))[:, None]
+            block[np.arange(len(idx))[None, :] <= rows] = np.nan   # upper triangle only
+            score = np.abs(block) if absolute else block
+            flat = np.where(np.isnan(score), -np.inf, score).ravel()
+            take = min(k, int(np.isfinite(flat).sum()))
+            if take == 0:
+                continue
+            cand = np.argpartition(-flat, take - 1)[:take]
+            ij = np.stack([cand // len(idx) + start, cand % len(idx)], axis=1)
+            best_v = np.concatenate([best_v, flat[cand]])
+            best_ij = np.concatenate([best_ij, ij])
+            if len(best_v) > k:
+                keep = np.argpartition(-best_v, k - 1)[:k]
+                best_v, best_ij = best_v[keep], best_ij[keep]
+        order = np.argsort(-best_v, kind="stable")
+        out = []
+        for o in order:
+            i, j = best_ij[o]
+            a, b = idx[i], idx[j]
+            out.append({
+                "a": names[i],
+                "b": names[j],
+                "correlation": float(self._corr(np.array([a]), np.array([b]))[0, 0]),
+                "observations": int(self.n[a, b]),
+            })
+        return out
@@ -0,0 +1,231 @@
+# server/encoding.py
+"""JSON encoding for responses.
+
+The fast path hands the payload to the C encoder with ``allow_nan=False`` and
+only converts NumPy objects it meets. NaN/inf are mapped to null column by
+column with a vectorized mask. The recursive ``make_serializable`` walk is
+kept only as a fallback for Python floats that are NaN.
+
+Range payloads of ``/data`` are encoded once per refresh and kept as bytes
+in the cache entry, with an ETag so unchanged data is answered with 304.
+
+Compact OHLCV layout (``/data?format=binary``), all little-endian::
+
+    b"OHLC" | uint32 header length | header JSON, space-padded to 8 bytes
+    int64[n]    Time, epoch seconds
+    float32[n]  one block per column listed in header["columns"]
+
+The Time block starts on an 8-byte boundary and the float32 blocks on 4-byte
+ones, so the browser can wrap them in typed arrays without parsing.
+"""
+from collections.abc import Mapping
+import datetime
+import gzip
+import hashlib
+import json
+import math
+import struct
+
+import numpy as np
+from fastapi.responses import Response
+
+from .metrics import METRICS
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+_SEPARATORS = (",", ":")
+BINARY_MAGIC = b"OHLC"
+BINARY_MEDIA_TYPE = "application/x-ohlcv"
+# Bodies smaller than this are not worth compressing.
+COMPRESS_MIN_BYTES = 1024
+_COMPRESSED = {}
+_COMPRESSED_MAX = 256
+
+
+def make_serializable(obj):
+    if isinstance(obj, dict):
+        return {k: make_serializable(v) for k, v in obj.items()}
+    if isinstance(obj, list):
+        return [make_serializable(v) for v in obj]
+    if isinstance(obj, tuple):
+        return tuple(make_serializable(v) for v in obj)
+    if isinstance(obj, np.ndarray):
+        return make_serializable(obj.tolist())
+    if isinstance(obj, (np.generic,)):
+        obj = obj.item()
+    if isinstance(obj, (datetime.date, datetime.datetime)):
+        return _time_str(obj)
+    if isinstance(obj, float):
+        if math.isnan(obj) or math.isinf(obj):
+            return None
+    return obj
+
+
+def _array_to_list(arr: np.ndarray) -> list:
+    if arr.dtype.kind == "f":
+        finite = np.isfinite(arr)
+        if not finite.all():
+            out = arr.astype(object)
+            out[~finite] = None
+            return out.tolist()
+    return arr.tolist()
+
+
+def _time_str(value) -> str:
+    """Timestamps (analysis of datetime64 bars) in the ``/data`` ``Time`` format."""
+    if isinstance(value, datetime.datetime) and value.time() == datetime.time(0):
+        value = value.date()
+    return value.isoformat(sep=" ") if isinstance(value, datetime.datetime) else value.isoformat()
+
+
+def _default(obj):
+    if isinstance(obj, np.ndarray):
+        return _array_to_list(obj)
+    if isinstance(obj, np.datetime64):
+        obj = obj.item()
+    if isinstance(obj, (datetime.date, datetime.datetime)):
+        return _time_str(obj)
+    if isinstance(obj, np.floating):
+        value = float(obj)
+        return value if math.isfinite(value) else None
+    if isinstance(obj, np.generic):
+        return obj.item()
+    if isinstance(obj, Mapping):
+        return dict(obj)
+    if isinstance(obj, (set, frozenset)):
+        return list(obj)
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+def dumps(obj) -> bytes:
+    try:
+        text = json.dumps(obj, allow_nan=False, default=_default, separators=_SEPARATORS)
+    except ValueError:
+        text = json.dumps(make_serializable(obj), default=_default, separators=_SEPARATORS)
+    return text.encode()
+
+
+def _encode_column(values) -> str:
+    if isinstance(values, np.ndarray):
+        return json.dumps(_array_to_list(values), separators=_SEPARATORS)
+    try:
+        return json.dumps(values, allow_nan=False, separators=_SEPARATORS, default=_default)
+    except ValueError:
+        return json.dumps(_array_to_list(np.asarray(values, dtype=float)), separators=_SEPARATORS)
+
+
+def encode_columns(cols: Mapping) -> bytes:
+    """Encode a dict of equal-length columns one column at a time."""
+    parts = [json.dumps(str(name)) + ":" + _encode_column(values) for name, values in cols.items()]
+    return ("{" + ",".join(parts) + "}").encode()
+
+
+def etag_for(body: bytes) -> str:
+    return '"' + hashlib.blake2b(body, digest_size=12).hexdigest() + '"'
+
+
+def range_columns(entry: dict, range: str) -> dict:
+    """Typed columns (int64 epoch ``Time``, float64 values) of a range.
+
+    Cached entries already hold typed columns and are returned as they are;
+    a range dict of lists is converted once per refresh.
+    """
+    from .store import columns_from_dict, is_columnar
+
+    rdata = entry["data"][range]
+    if is_columnar(rdata):
+        return rdata
+    stamp = entry.get("last_updated")
+    columns = entry.setdefault("columns", {})
+    hit = columns.get(range)
+    if hit and hit[0] == stamp:
+        return hit[1]
+    cols = columns_from_dict(rdata)
+    columns[range] = (stamp, cols)
+    return cols
+
+
+def slice_since(cols: dict, since: int) -> dict:
+    """Bars at or after epoch ``since`` (the client's last bar is re-sent, it may have been revised)."""
+    start = int(np.searchsorted(cols["Time"], since, side="left"))
+    return {name: values[start:] for name, values in cols.items()}
+
+
+def encode_binary(cols: dict, header: dict) -> bytes:
+    names = [name for name in cols if name != "Time"]
+    n = len(cols["Time"])
+    head = json.dumps({**header, "n": n, "columns": names}, separators=_SEPARATORS).encode()
+    head += b" " * (-(len(BINARY_MAGIC) + 4 + len(head)) % 8)
+    parts = [BINARY_MAGIC, struct.pack("<I", len(head)), head,
+             np.ascontiguousarray(cols["Time"], dtype="<i8").tobytes()]
+    for name in names:
+        parts.append(np.ascontiguousarray(cols[name], dtype="<f4").tobytes())
+    return b"".join(parts)
+
+
+def json_columns(cols: dict) -> bytes:
+    """JSON ``/data`` layout of typed columns: ``Time`` as timestamp strings."""
+    from .store import epoch_to_times
+
+    return encode_columns({**cols, "Time": epoch_to_times(cols["Time"])})
+
+
+def encoded_range(entry: dict, range: str) -> bytes:
+    """Encoded bytes of ``entry['data'][range]``, reused until the entry is refreshed."""
+    stamp = entry.get("last_updated")
+    encoded = entry.setdefault("encoded", {})
+    hit = encoded.get(range)
+    if hit and hit[0] == stamp:
+        METRICS.inc("encoded_cache_total", result="hit")
+        return hit[1]
+    METRICS.inc("encoded_cache_total", result="miss")
+    with METRICS.timer("serialize_seconds", fn="encoded_range"):
+        body = json_columns(range_columns(entry, range))
+    encoded[range] = (stamp, body)
+    return body
+
+
+def _negotiate(accept_encoding: str):
+    accepted = {c.split(";")[0].strip() for c in (accept_encoding or "").split(",")}
+    if brotli is not None and "br" in accepted:
+        return "br"
+    if "gzip" in accepted:
+        return "gzip"
+    return None
+
+
+def _compress(body: bytes, etag: str, coding: str) -> bytes:
+    key = (etag, coding)
+    if key in _COMPRESSED:
+        METRICS.inc("compressed_cache_total", result="hit")
+        return _COMPRESSED[key]
+    METRICS.inc("compressed_cache_total", result="miss")
+    with METRICS.timer("compress_seconds", coding=coding):
+        out = brotli.compress(body, quality=5) if coding == "br" else gzip.compress(body, compresslevel=6)
+    if len(_COMPRESSED) >= _COMPRESSED_MAX:
+        _COMPRESSED.pop(next(iter(_COMPRESSED)))
+    _COMPRESSED[key] = out
+    return out
+
+
+def bytes_response(body: bytes, status_code: int = 200, if_none_match: str = None,
+                   accept_encoding: str = None, media_type: str = "application/json") -> Response:
+    """Pre-encoded body with an ETag, compressed if the client accepts it; 304 when the client already has it.
+
+    The body (JSON or binary, picked from ``Accept``) and its content coding
+    both select the representation, so each coding gets its own ETag
+    (``"<hash>-gzip"``) and caches are told to vary on both headers.
+    """
+    base = etag_for(body)
+    coding = _negotiate(accept_encoding) if len(body) >= COMPRESS_MIN_BYTES else None
+    etag = f'{base[:-1]}-{coding}"' if coding else base
+    headers = {"ETag": etag, "Cache-Control": "no-cache", "Vary": "Accept, Accept-Encoding"}
+    if if_none_match and etag in [t.strip() for t in if_none_match.split(",")]:
+        return Response(status_code=304, headers=headers)
+    if coding:
+        body = _compress(body, base, coding)
+        headers["Content-Encoding"] = coding
+    return Response(content=body, status_code=status_code, media_type=media_type, headers=headers)
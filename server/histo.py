@@ -1,83 +1,321 @@
-try:
-    from tvDatafeed import TvDatafeed, Interval
-except ImportError:
-    try:
-        from tvdatafeed import TvDatafeed, Interval
-    except ImportError:
-        TvDatafeed = None
-        Interval = None
-        print("WARNING: tvDatafeed not installed. Data fetching will not work.")
-
+import asyncio
+import calendar
+import enum
+from concurrent.futures import ThreadPoolExecutor
 import os
+import random
+import threading
+import time
 from dotenv import load_dotenv
-import pandas as pd
+
+from .sources import source_from_env
+from .metrics import METRICS
+from .store import times_to_epoch, TIME_DTYPE, VALUE_DTYPE
+
+BAR_COLUMNS = ('Time', 'Open', 'High', 'Low', 'Close', 'Volume')
+
+
+class Interval(enum.Enum):
+    """tvDatafeed's intervals (same values), so importing this module does not import it."""
+    in_1_minute = "1"
+    in_3_minute = "3"
+    in_5_minute = "5"
+    in_15_minute = "15"
+    in_30_minute = "30"
+    in_45_minute = "45"
+    in_1_hour = "1H"
+    in_2_hour = "2H"
+    in_3_hour = "3H"
+    in_4_hour = "4H"
+    in_daily = "1D"
+    in_weekly = "1W"
+    in_monthly = "1M"
+
+
+def load_tvdatafeed():
+    """(TvDatafeed, its Interval enum), imported on first use; (None, None) if not installed."""
+    try:
+        from tvDatafeed import TvDatafeed, Interval as TvInterval
+    except ImportError:
+        try:
+            from tvdatafeed import TvDatafeed, Interval as TvInterval
+        except ImportError:
+            return None, None
+    return TvDatafeed, TvInterval
 
 load_dotenv()
 USERNAME = os.getenv("TV_USERNAME")
 PASSWORD = os.getenv("TV_PASSWORD")
 
+# "refresh" is how often (seconds) the range goes stale. Ranges sharing an
+# interval are fetched together, at the cadence of the longest one.
 RANGE_CONFIG = {
-    "1d": {"interval": Interval.in_30_minute if Interval else None, "n_bars": 24},
-    "1w": {"interval": Interval.in_daily if Interval else None, "n_bars": 7},
-    "1m": {"interval": Interval.in_daily if Interval else None, "n_bars": 30},
-    "6m": {"interval": Interval.in_daily if Interval else None, "n_bars": 180},
-    "1y": {"interval": Interval.in_daily if Interval else None, "n_bars": 365},
-    "2y": {"interval": Interval.in_daily if Interval else None, "n_bars": 730},
+    "1d": {"interval": Interval.in_30_minute, "n_bars": 24, "refresh": 60},
+    "1w": {"interval": Interval.in_daily, "n_bars": 7, "refresh": 900},
+    "1m": {"interval": Interval.in_daily, "n_bars": 30, "refresh": 900},
+    "6m": {"interval": Interval.in_daily, "n_bars": 180, "refresh": 900},
+    "1y": {"interval": Interval.in_daily, "n_bars": 365, "refresh": 900},
+    "2y": {"interval": Interval.in_daily, "n_bars": 730, "refresh": 900},
 }
 
-tv = TvDatafeed(USERNAME, PASSWORD) if TvDatafeed and USERNAME and PASSWORD else (TvDatafeed() if TvDatafeed else None)
+# Bar length per interval, used to estimate how many bars are missing since
+# the last cached one.
+_INTERVAL_SECONDS = {
+    Interval.in_1_minute: 60,
+    Interval.in_3_minute: 3 * 60,
+    Interval.in_5_minute: 5 * 60,
+    Interval.in_15_minute: 15 * 60,
+    Interval.in_30_minute: 30 * 60,
+    Interval.in_45_minute: 45 * 60,
+    Interval.in_1_hour: 60 * 60,
+    Interval.in_2_hour: 2 * 60 * 60,
+    Interval.in_3_hour: 3 * 60 * 60,
+    Interval.in_4_hour: 4 * 60 * 60,
+    Interval.in_daily: 24 * 60 * 60,
+    Interval.in_weekly: 7 * 24 * 60 * 60,
+}
 
-def _safe_get_hist(symbol, exchange, interval, n_bars, retries=3, backoff=1.5):
-    """Call tv.get_hist with retries and exponential backoff."""
-    if not tv:
-        raise RuntimeError("tvDatafeed not available - cannot fetch data")
-    
-    last_exc = None
-    for attempt in range(retries):
-        try:
-            df = tv.get_hist(symbol, exchange, interval=interval, n_bars=n_bars)
-            return df
-        except Exception as e:
-            last_exc = e
-            try:
-                import time
-                time.sleep(backoff * (2 ** attempt))
-            except Exception:
-                pass
-    if last_exc:
-        raise last_exc
 
+def interval_seconds(interval) -> int:
+    return _INTERVAL_SECONDS.get(interval, 0)
 
-def fetch_data(symbol: str = "ATW", exchange: str = "CSEMA"):
-    """Fetch historical data for a given symbol and exchange.
 
-    This function will retry transient errors and only include ranges
-    which returned non-empty data. It raises exceptions for fatal failures.
+def _fetch_plan():
+    """Group ranges by interval; only the longest range of each group is fetched.
+
+    Returns a list of (source_label, [(label, n_bars), ...]) with the source
+    label first in its group.
     """
-    if not tv:
-        raise RuntimeError("tvDatafeed not available - cannot fetch data")
-    
-    data_dict = {}
+    groups = {}
+    for label, cfg in RANGE_CONFIG.items():
+        groups.setdefault(cfg["interval"], []).append((label, cfg["n_bars"]))
+    plan = []
+    for members in groups.values():
+        members.sort(key=lambda m: m[1], reverse=True)
+        plan.append((members[0][0], members))
+    return plan
+
+
+def source_range(label: str) -> str:
+    """The range fetched for ``label``'s interval; ``label``'s bars are its newest ones."""
+    for source, members in _fetch_plan():
+        if any(member == label for member, _ in members):
+            return source
+    raise KeyError(label)
+
+
+def refresh_intervals():
+    """Refresh period of each range that is fetched from upstream."""
+    return {source: RANGE_CONFIG[source]["refresh"] for source, _ in _fetch_plan()}
+
+
+def _normalize(df):
+    import pandas as pd
+
+    df = df.reset_index().rename(columns={
+        'datetime': 'Time',
+        'open': 'Open',
+        'high': 'High',
+        'low': 'Low',
+        'close': 'Close',
+        'volume': 'Volume'
+    })
+    df['Time'] = pd.to_datetime(df['Time'])
+    return df
+
+
+def _missing_bars(previous, interval, n_bars):
+    """Bars to request to cover the gap since the last cached bar (inclusive)."""
+    step = interval_seconds(interval)
+    times = (previous or {}).get('Time')
+    if not step or times is None or not len(times):
+        return n_bars
     try:
-        probe = _safe_get_hist(symbol, exchange, interval=RANGE_CONFIG["1d"]["interval"], n_bars=1, retries=2)
-    except Exception:
-        raise
+        last = int(times_to_epoch(times[-1:])[0])
+    except (TypeError, ValueError):
+        return n_bars
+    # Bar times are naive local times stored as if UTC; compare like with like.
+    elapsed = calendar.timegm(time.localtime()) - last
+    # +2: re-fetch the last (possibly still forming) bar and absorb clock skew.
+    return int(min(n_bars, max(0, elapsed) // step + 2))
 
-    for label, cfg in RANGE_CONFIG.items():
+
+def _merge(previous, df, n_bars):
+    """Merge a freshly fetched tail into the cached columns, dedupe on Time, trim to the window."""
+    import pandas as pd
+
+    frames = []
+    if previous and len(previous.get('Time', ())):
+        prev = pd.DataFrame({k: v for k, v in previous.items() if k in BAR_COLUMNS})
+        prev['Time'] = pd.to_datetime(times_to_epoch(previous['Time']), unit='s')
+        frames.append(prev)
+    if df is not None:
+        frames.append(df)
+    df = pd.concat(frames, ignore_index=True).drop_duplicates(subset='Time', keep='last').sort_values('Time').tail(n_bars)
+    return df.reset_index(drop=True)
+
+
+def _group_ranges(members, prev, df, n_request, n_bars):
+    """Typed columns of each range of one interval group, from the fetched tail ``df`` (a ``get_hist`` frame or None)."""
+    df = _normalize(df) if df is not None and not df.empty else None
+    base = prev if n_request < n_bars else None
+    if df is None and not base:
+        return {}
+    merged = _merge(base, df, n_bars)
+    if merged.empty:
+        return {}
+    full = {'Time': merged['Time'].values.astype('datetime64[s]').astype(TIME_DTYPE)}
+    for name in BAR_COLUMNS[1:]:
+        if name in merged:
+            full[name] = merged[name].to_numpy(dtype=VALUE_DTYPE)
+    # Shorter ranges are views of the longest one.
+    return {label: full if size >= len(merged) else {k: v[-size:] for k, v in full.items()}
+            for label, size in members}
+
+
+class TokenBucket:
+    """Request-rate budget: ``rate`` tokens per second, up to ``burst`` stored."""
+
+    def __init__(self, rate: float, burst: int):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def acquire(self, n: int = 1):
+        # More than ``burst`` tokens are never stored; wait for a full bucket instead.
+        n = min(n, self.burst)
+        while True:
+            self._refill()
+            if self.tokens >= n:
+                self.tokens -= n
+                return
+            await asyncio.sleep((n - self.tokens) / self.rate)
+
+
+class FetchEngine:
+    """Fetches bars through a bounded pool of data source sessions.
+
+    ``source`` defaults to the one selected by ``TV_SOURCE`` (see
+    ``sources.py``). Each pool thread owns one session, created on first use
+    and replaced after it fails. The interval groups of a symbol are
+    fetched concurrently, and so are different symbols, up to ``sessions``
+    calls at a time. Failed calls are retried after a jittered exponential
+    delay that is awaited, so no pool thread sleeps. Every call, retries
+    included, takes a token from ``bucket``: ``rate`` upstream calls per
+    second, up to ``burst`` at once.
+    """
+
+    def __init__(self, source=None, sessions: int = 4, retries: int = 3, backoff: float = 0.5, max_backoff: float = 8.0,
+                 rate: float = 2.0, burst: int = 5):
+        self.source = source or source_from_env(USERNAME, PASSWORD)
+        self.sessions = sessions
+        self.bucket = TokenBucket(rate, burst)
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self._executor = ThreadPoolExecutor(max_workers=sessions, thread_name_prefix="tv-fetch")
+        self._local = threading.local()
+        self.stats = {"calls": 0, "retries": 0, "failures": 0, "sessions_opened": 0,
+                      "in_flight": 0, "last_call_ms": 0.0, "avg_call_ms": 0.0}
+
+    def _get_hist(self, symbol, exchange, interval, n_bars):
+        """Runs on a pool thread, with that thread's session."""
+        session = getattr(self._local, "session", None)
+        if session is None:
+            session = self._local.session = self.source.session()
+            self.stats["sessions_opened"] += 1
         try:
-            df = _safe_get_hist(symbol, exchange, interval=cfg["interval"], n_bars=cfg["n_bars"])
+            return session.get_hist(symbol, exchange, interval=interval, n_bars=n_bars)
         except Exception:
-            continue
-
-        if df is not None and not df.empty:
-            df = df.reset_index().rename(columns={
-                'datetime': 'Time',
-                'open': 'Open',
-                'high': 'High',
-                'low': 'Low',
-                'close': 'Close',
-                'volume': 'Volume'
-            }).sort_values('Time')
-            df['Time'] = df['Time'].astype(str)
-            data_dict[label] = df.to_dict(orient='list')
-    return data_dict
\ No newline at end of file
+            self._local.session = None
+            raise
+
+    async def get_hist(self, symbol, exchange, interval, n_bars):
+        """``get_hist`` on a pooled session, retried with full jitter."""
+        loop = asyncio.get_running_loop()
+        name = getattr(interval, "name", str(interval))
+        for attempt in range(self.retries):
+            with METRICS.timer("fetch_rate_wait_seconds", interval=name):
+                await self.bucket.acquire()
+            self.stats["calls"] += 1
+            self.stats["in_flight"] += 1
+            t0 = time.perf_counter()
+            outcome = "error"
+            try:
+                result = await loop.run_in_executor(self._executor, self._get_hist, symbol, exchange, interval, n_bars)
+                outcome = "ok"
+                return result
+            except Exception:
+                if attempt == self.retries - 1:
+                    self.stats["failures"] += 1
+                    METRICS.inc("fetch_failures_total", interval=name)
+                    raise
+                self.stats["retries"] += 1
+                METRICS.inc("fetch_retries_total", interval=name)
+            finally:
+                self.stats["in_flight"] -= 1
+                elapsed = time.perf_counter() - t0
+                METRICS.observe("fetch_call_seconds", elapsed, interval=name, outcome=outcome)
+                ms = elapsed * 1e3
+                self.stats["last_call_ms"] = ms
+                self.stats["avg_call_ms"] = 0.9 * self.stats["avg_call_ms"] + 0.1 * ms
+            await asyncio.sleep(random.uniform(0, min(self.max_backoff, self.backoff * 2 ** attempt)))
+
+    async def _fetch_group(self, symbol, exchange, source, members, prev):
+        interval = RANGE_CONFIG[source]["interval"]
+        n_bars = RANGE_CONFIG[source]["n_bars"]
+        n_request = _missing_bars(prev, interval, n_bars)
+        METRICS.inc("fetch_bars_total", n_request, range=source)
+        with METRICS.timer("fetch_seconds", range=source):
+            df = await self.get_hist(symbol, exchange, interval=interval, n_bars=n_request)
+        # Normalizing, merging and slicing is CPU work; keep it off the event loop.
+        with METRICS.timer("merge_seconds", range=source):
+            return await asyncio.to_thread(_group_ranges, members, prev, df, n_request, n_bars)
+
+    async def fetch(self, symbol: str = "ATW", exchange: str = "CSEMA", previous: dict = None, ranges=None):
+        """Fetch historical data for a given symbol and exchange.
+
+        Returns {range label: typed columns}, int64 epoch ``Time`` and
+        float64 OHLCV, as ``store.columns_from_dict`` produces.
+
+        Only the longest range per interval is downloaded; shorter ranges on
+        the same interval are sliced from it, and the interval groups are
+        fetched concurrently. When ``previous`` (the cached range dict of the
+        symbol) is given, only the bars newer than the last cached one are
+        requested and merged into it. ``ranges`` restricts the fetch to the
+        interval groups containing those labels.
+
+        Groups that fail are left out; the last error is raised only when
+        every group failed.
+        """
+        previous = previous or {}
+        jobs = []
+        for source, members in _fetch_plan():
+            if ranges and not any(label in ranges for label, _ in members):
+                continue
+            try:
+                prev = previous.get(source)
+            except Exception:
+                prev = None
+            jobs.append(self._fetch_group(symbol, exchange, source, members, prev))
+
+        results = await asyncio.gather(*jobs, return_exceptions=True)
+        data_dict = {}
+        last_exc = None
+        for result in results:
+            if isinstance(result, Exception):
+                last_exc = result
+            else:
+                data_dict.update(result)
+        if last_exc and len(results) == sum(isinstance(r, Exception) for r in results):
+            raise last_exc
+        return {label: data_dict[label] for label in RANGE_CONFIG if label in data_dict}
+
+    def metrics(self) -> dict:
+        return {"sessions": self.sessions, "rate_tokens": round(self.bucket.tokens, 2), **self.stats}
@@ -0,0 +1,216 @@
+# server/leaderboard.py
+"""Materialized scanner rankings.
+
+For every range the leaderboard keeps one row per symbol, built from the
+symbol's cached analysis when a refresh changes it, and one sorted ranking
+per combination of the rsi/macd/fib/patterns toggles (16 of them). A scan
+is then a slice of the ranking: O(k) for k rows, not a pass over the cache.
+
+ML predictions are cached per (symbol, combination) as well. Symbols whose
+analysis changed (or all of them, after the model was retrained) are marked
+pending and predicted together, in one batch, the next time that
+combination is scanned with ML. A symbol stays pending until its prediction
+is stored, and one ML scan per combination predicts at a time (``lock``),
+so a failed batch is retried by the next scan instead of being lost.
+"""
+import asyncio
+from bisect import bisect_right, insort
+import itertools
+
+COMBOS = list(itertools.product((True, False), repeat=4))   # (rsi, macd, fib, patterns)
+
+
+class Ranking:
+    """Symbols sorted by descending score (ties by symbol)."""
+
+    def __init__(self):
+        self._keys = []      # sorted (-score, symbol)
+        self._score = {}
+
+    def put(self, symbol: str, score: float):
+        self.remove(symbol)
+        self._score[symbol] = score
+        insort(self._keys, (-score, symbol))
+
+    def remove(self, symbol: str):
+        score = self._score.pop(symbol, None)
+        if score is None:
+            return
+        i = bisect_right(self._keys, (-score, symbol)) - 1
+        del self._keys[i]
+
+    def count(self, min_score: float = None) -> int:
+        if min_score is None:
+            return len(self._keys)
+        # Keys are (-score, symbol); every symbol sorts after "".
+        return bisect_right(self._keys, (-min_score, "\uffff"))
+
+    def page(self, offset: int = 0, limit: int = None, min_score: float = None):
+        end = self.count(min_score)
+        if limit is not None:
+            end = min(end, offset + limit)
+        return [symbol for _, symbol in self._keys[offset:end]]
+
+    def score(self, symbol: str) -> float:
+        return self._score[symbol]
+
+    def __contains__(self, symbol):
+        return symbol in self._score
+
+    def __len__(self):
+        return len(self._keys)
+
+
+def _blend(score, prob):
+    """Combined score from the heuristic score and P(good); scalars or arrays."""
+    return score * 0.6 + prob * 0.4
+
+
+def _combined(score: float, prediction: dict) -> float:
+    prob = prediction.get('probability_good', 0.5) if prediction.get('model_available') else 0.5
+    return _blend(score, prob)
+
+
+class Leaderboard:
+    def __init__(self, score):
+        """``score(analysis, rsi, macd, fib, patterns)`` returns the filtered analysis with its ``score``."""
+        self.score = score
+        self._rows = {}       # range -> {symbol: {"analysis", "last_updated", "filtered": {combo: dict}}}
+        self._rankings = {}   # (range, combo) -> Ranking
+        self._ml = {}         # (range, combo) -> Ranking of combined scores
+        self._predictions = {}   # (range, combo) -> {symbol: prediction}
+        self._pending = {}    # (range, combo) -> symbols to predict
+        self._locks = {}      # (range, combo) -> asyncio.Lock held while predicting
+
+    def _ranking(self, store: dict, key) -> Ranking:
+        ranking = store.get(key)
+        if ranking is None:
+            ranking = store[key] = Ranking()
+        return ranking
+
+    def update(self, symbol: str, range: str, analysis: dict, last_updated: float = None):
+        """Re-rank ``symbol`` in ``range`` after its analysis changed."""
+        if not analysis or 'error' in analysis:
+            self.remove(symbol, range)
+            return
+        try:
+            filtered = {combo: self.score(analysis, *combo) for combo in COMBOS}
+        except Exception:
+            self.remove(symbol, range)
+            return
+        self._rows.setdefault(range, {})[symbol] = {
+            'analysis': analysis, 'last_updated': last_updated, 'filtered': filtered,
+        }
+        for combo in COMBOS:
+            self._ranking(self._rankings, (range, combo)).put(symbol, filtered[combo]['score'])
+            self._pending.setdefault((range, combo), set()).add(symbol)
+
+    def update_entry(self, symbol: str, entry: dict, labels=None):
+        analysis = entry.get('analysis') or {}
+        stamps = entry.get('analysis_last_updated') or {}
+        for label in labels if labels is not None else list(analysis):
+            self.update(symbol, label, analysis.get(label), stamps.get(label))
+
+    def remove(self, symbol: str, range: str = None):
+        for rng in [range] if range else list(self._rows):
+            if self._rows.get(rng, {}).pop(symbol, None) is None:
+                continue
+            for combo in COMBOS:
+                key = (rng, combo)
+                for store in (self._rankings, self._ml):
+                    if key in store:
+                        store[key].remove(symbol)
+                self._predictions.get(key, {}).pop(symbol, None)
+                self._pending.get(key, set()).discard(symbol)
+
+    def rebuild(self, cache: dict):
+        for symbol, entry in list(cache.items()):
+            self.update_entry(symbol, entry)
+
+    def invalidate_ml(self):
+        """The model changed: every cached prediction is stale."""
+        for rng, rows in self._rows.items():
+            for combo in COMBOS:
+                self._pending[(rng, combo)] = set(rows)
+
+    # -- queries -----------------------------------------------------------
+
+    def size(self, range: str) -> int:
+        return len(self._rows.get(range, {}))
+
+    def _row(self, range: str, combo, symbol: str) -> dict:
+        rsi, macd, fib, patterns = combo
+        row = self._rows[range][symbol]
+        filtered = row['filtered'][combo]
+        analysis = row['analysis']
+        return {
+            'symbol': symbol,
+            'score': float(filtered['score']),
+            'trend': analysis.get('trend'),
+            'patterns': (analysis.get('patterns') or []) if patterns else [],
+            'rsi': analysis.get('rsi') if rsi else None,
+            'macd_cross': bool((analysis.get('macd') or {}).get('macd_cross')) if macd else None,
+            'fib_at_level': bool((analysis.get('fibonacci') or {}).get('at_level')) if fib else None,
+            'last_updated': row['last_updated'],
+        }
+
+    def scan(self, range: str, combo, offset: int = 0, limit: int = None, min_score: float = None):
+        """(rows of the requested page, number of rows at or above ``min_score``)."""
+        ranking = self._rankings.get((range, combo))
+        if ranking is None:
+            return [], 0
+        symbols = ranking.page(offset, limit, min_score)
+        return [self._row(range, combo, s) for s in symbols], ranking.count(min_score)
+
+    def lock(self, range: str, combo) -> asyncio.Lock:
+        """Held by the ML scan predicting this combination."""
+        lock = self._locks.get((range, combo))
+        if lock is None:
+            lock = self._locks[(range, combo)] = asyncio.Lock()
+        return lock
+
+    def pending_predictions(self, range: str, combo) -> list:
+        """(symbol, filtered analysis) pairs whose prediction is missing or stale.
+
+        They stay pending until ``set_predictions`` stores their predictions.
+        """
+        rows = self._rows.get(range, {})
+        pending = self._pending.get((range, combo), set())
+        return [(s, rows[s]['filtered'][combo]) for s in sorted(pending) if s in rows]
+
+    def set_predictions(self, range: str, combo, pending: list, predictions):
+        """Store the predictions of ``pending_predictions`` pairs.
+
+        A symbol whose analysis changed while it was predicted stays pending.
+        """
+        key = (range, combo)
+        rows = self._rows.get(range, {})
+        cached = self._predictions.setdefault(key, {})
+        ranking = self._ranking(self._ml, key)
+        waiting = self._pending.get(key, set())
+        for (symbol, filtered), prediction in zip(pending, predictions):
+            if symbol not in rows:
+                waiting.discard(symbol)
+                continue
+            current = rows[symbol]['filtered'][combo]
+            cached[symbol] = prediction
+            ranking.put(symbol, _combined(current['score'], prediction))
+            if current is filtered:
+                waiting.discard(symbol)
+
+    def scan_ml(self, range: str, combo, offset: int = 0, limit: int = None, min_score: float = None):
+        """Like ``scan``, ranked by combined heuristic/ML score (``min_score`` applies to it)."""
+        key = (range, combo)
+        ranking = self._ml.get(key)
+        if ranking is None:
+            return [], 0
+        out = []
+        for symbol in ranking.page(offset, limit, min_score):
+            prediction = self._predictions[key][symbol]
+            out.append({
+                **self._row(range, combo, symbol),
+                'ml_prediction': prediction.get('prediction'),
+                'ml_confidence': prediction.get('confidence'),
+                'combined_score': ranking.score(symbol),
+            })
+        return out, ranking.count(min_score)
@@ -0,0 +1,163 @@
+# server/live.py
+"""Server-sent events for live bar and analysis updates.
+
+Clients open ``/stream?symbol=ATW&range=1d&scan=1d`` and get:
+
+    event: bars      bars from the last one the previous refresh had (epoch Time)
+    event: analysis  keys of the range's analysis that changed
+    event: scan      the same analysis diff, for scanner subscribers of the range
+    event: resync    the client fell behind; refetch everything
+
+Events are produced by a refresh listener, only for topics somebody
+subscribed to, and each one is encoded once and shared by every subscriber.
+"""
+import asyncio
+
+import numpy as np
+from fastapi import Request
+from fastapi.responses import StreamingResponse
+
+from . import app, DATA_CACHE, SCHEDULER, REFRESH_LISTENERS
+from .encoding import dumps, range_columns, slice_since
+from .store import times_to_epoch
+
+HEARTBEAT = 15
+QUEUE_SIZE = 256
+
+
+class Subscriber:
+    def __init__(self, topics):
+        self.topics = set(topics)
+        self.queue = asyncio.Queue(QUEUE_SIZE)
+
+
+class Broker:
+    def __init__(self):
+        self._subs = {}   # topic -> set of Subscriber
+
+    def subscribe(self, topics) -> Subscriber:
+        sub = Subscriber(topics)
+        for topic in sub.topics:
+            self._subs.setdefault(topic, set()).add(sub)
+        return sub
+
+    def unsubscribe(self, sub: Subscriber):
+        for topic in sub.topics:
+            subs = self._subs.get(topic)
+            if subs:
+                subs.discard(sub)
+                if not subs:
+                    del self._subs[topic]
+
+    def has_subscribers(self, topic) -> bool:
+        return bool(self._subs.get(topic))
+
+    def publish(self, topic, event: str, payload):
+        subs = self._subs.get(topic)
+        if not subs:
+            return
+        chunk = b"event: " + event.encode() + b"\ndata: " + dumps(payload) + b"\n\n"
+        for sub in list(subs):
+            try:
+                sub.queue.put_nowait(chunk)
+            except asyncio.QueueFull:
+                # Slow consumer: drop its backlog and make it start over.
+                while not sub.queue.empty():
+                    sub.queue.get_nowait()
+                sub.queue.put_nowait(b"event: resync\ndata: {}\n\n")
+
+    def stats(self) -> dict:
+        return {"topics": len(self._subs),
+                "subscribers": len({s for subs in self._subs.values() for s in subs})}
+
+
+BROKER = Broker()
+
+
+def _last_epoch(rdata):
+    times = (rdata or {}).get("Time")
+    if times is None or not len(times):
+        return None
+    return int(times_to_epoch(times[-1:])[0])
+
+
+def _bars_delta(prev_rdata, entry: dict, label: str):
+    cols = range_columns(entry, label)
+    last = _last_epoch(prev_rdata)
+    delta = cols if last is None else slice_since(cols, last)
+    if not len(delta["Time"]):
+        return None
+    if last is not None and len(delta["Time"]) == 1 and delta["Time"][0] == last:
+        prev_last = {k: v[-1] for k, v in prev_rdata.items() if k in delta and k != "Time"}
+        if all(np.isclose(delta[k][0], v, equal_nan=True) for k, v in prev_last.items()):
+            return None
+    return delta
+
+
+def _changed(a, b) -> bool:
+    try:
+        return bool(a != b)
+    except ValueError:  # NumPy arrays compare element-wise
+        return True
+
+
+def _analysis_diff(prev: dict, new: dict) -> dict:
+    return {k: v for k, v in (new or {}).items() if _changed((prev or {}).get(k), v)}
+
+
+def publish_refresh(symbol: str, prev: dict, entry: dict, labels):
+    prev_data = prev.get("data") or {}
+    prev_analysis = prev.get("analysis") or {}
+    for label in labels:
+        bars_topic = ("bars", symbol, label)
+        scan_topic = ("scan", label)
+        if not (BROKER.has_subscribers(bars_topic) or BROKER.has_subscribers(scan_topic)):
+            continue
+        if BROKER.has_subscribers(bars_topic):
+            delta = _bars_delta(prev_data.get(label), entry, label)
+            if delta is not None:
+                BROKER.publish(bars_topic, "bars", {
+                    "symbol": symbol, "range": label,
+                    "total": len(entry["data"][label]["Time"]),
+                    "last_updated": entry.get("last_updated"),
+                    "bars": delta,
+                })
+        diff = _analysis_diff(prev_analysis.get(label), (entry.get("analysis") or {}).get(label))
+        if diff:
+            payload = {"symbol": symbol, "range": label, "analysis": diff}
+            BROKER.publish(bars_topic, "analysis", payload)
+            BROKER.publish(scan_topic, "scan", payload)
+
+
+REFRESH_LISTENERS.append(publish_refresh)
+
+
+@app.get("/stream")
+async def stream(request: Request, symbol: str = None, range: str = None, scan: str = None):
+    """Server-sent events for one (symbol, range) and/or the scanner of one range."""
+    topics = []
+    if symbol and range:
+        topics.append(("bars", symbol, range))
+    if scan:
+        topics.append(("scan", scan))
+
+    async def events():
+        sub = BROKER.subscribe(topics)
+        try:
+            yield b"retry: 3000\n\n"
+            while not await request.is_disconnected():
+                if symbol:
+                    # A live chart stops polling /data: its events and
+                    # heartbeats are what keep the symbol hot and refreshed.
+                    DATA_CACHE.touch(symbol)
+                    SCHEDULER.touch(symbol)
+                try:
+                    chunk = await asyncio.wait_for(sub.queue.get(), HEARTBEAT)
+                except asyncio.TimeoutError:
+                    chunk = b": ping\n\n"
+                yield chunk
+        finally:
+            BROKER.unsubscribe(sub)
+
+    return StreamingResponse(events(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
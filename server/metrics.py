@@ -0,0 +1,195 @@
+# server/metrics.py
+"""In-process metrics in the Prometheus text format.
+
+``METRICS`` is the registry the hot paths record into:
+
+* ``METRICS.inc(name, **labels)`` counts events;
+* ``METRICS.observe(name, seconds, **labels)`` adds to a latency histogram,
+  and ``with METRICS.timer(name, **labels):`` times a block (wall time, so
+  it works around ``await`` too);
+* ``METRICS.describe(name, text)`` sets the ``# HELP`` line of a metric;
+* ``METRICS.collectors`` are callables returning ``{name: value}`` or
+  ``{name: [(labels, value), ...]}`` gauges, read when ``/metrics`` is
+  scraped (the ``metrics()`` dicts of the scheduler, fetcher, compute
+  pool, ...).
+
+``profile_response`` runs one request under cProfile for ``?profile=1``
+(with ``PROFILE_REQUESTS=1``).
+"""
+import asyncio
+from bisect import bisect_left
+from contextlib import contextmanager
+import cProfile
+import io
+import math
+import pstats
+import re
+import threading
+import time
+
+# Seconds; covers cache hits (sub-ms) to slow upstream fetches.
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+def _label_key(labels: dict) -> tuple:
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def _format_labels(key) -> str:
+    if not key:
+        return ""
+    parts = []
+    for k, v in key:
+        v = v.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+        parts.append(f'{k}="{v}"')
+    return "{" + ",".join(parts) + "}"
+
+
+def _format_value(value) -> str:
+    value = float(value)
+    if math.isnan(value):
+        return "NaN"
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(value) if value != int(value) else str(int(value))
+
+
+def _metric_name(name: str) -> str:
+    return re.sub(r"[^a-zA-Z0-9_:]", "_", name)
+
+
+class Histogram:
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class Registry:
+    def __init__(self, prefix: str = "tv_"):
+        self.prefix = prefix
+        self._counters = {}     # name -> {label key: value}
+        self._histograms = {}   # name -> {label key: Histogram}
+        self._help = {}
+        self._lock = threading.Lock()   # fetch threads record too
+        self.collectors = []
+
+    def describe(self, name: str, text: str):
+        """``# HELP`` text of ``name`` in ``render``."""
+        self._help[name] = text
+
+    def inc(self, name: str, value: float = 1, **labels):
+        key = _label_key(labels)
+        with self._lock:
+            series = self._counters.setdefault(name, {})
+            series[key] = series.get(key, 0) + value
+
+    def observe(self, name: str, seconds: float, **labels):
+        key = _label_key(labels)
+        with self._lock:
+            series = self._histograms.setdefault(name, {})
+            hist = series.get(key)
+            if hist is None:
+                hist = series[key] = Histogram()
+            hist.observe(seconds)
+
+    @contextmanager
+    def timer(self, name: str, **labels):
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - t0, **labels)
+
+    def _gauges(self):
+        out = {}
+        for collect in self.collectors:
+            try:
+                values = collect()
+            except Exception as e:
+                print(f"Metrics collector failed: {e}")
+                continue
+            for name, value in values.items():
+                if isinstance(value, list):
+                    out.setdefault(name, []).extend((_label_key(l), v) for l, v in value)
+                elif isinstance(value, (int, float)) and not isinstance(value, bool):
+                    out.setdefault(name, []).append(((), value))
+        return out
+
+    def render(self) -> str:
+        """All metrics in the Prometheus text exposition format."""
+        lines = []
+
+        def header(name, kind):
+            full = self.prefix + _metric_name(name)
+            if name in self._help:
+                lines.append(f"# HELP {full} {self._help[name]}")
+            lines.append(f"# TYPE {full} {kind}")
+            return full
+
+        with self._lock:
+            counters = {n: dict(s) for n, s in self._counters.items()}
+            histograms = {n: {k: (h.buckets, list(h.counts), h.sum, h.count) for k, h in s.items()}
+                          for n, s in self._histograms.items()}
+        for name in sorted(counters):
+            full = header(name, "counter")
+            for key, value in sorted(counters[name].items()):
+                lines.append(f"{full}{_format_labels(key)} {_format_value(value)}")
+        for name in sorted(histograms):
+            full = header(name, "histogram")
+            for key, (buckets, counts, total, count) in sorted(histograms[name].items()):
+                cumulative = 0
+                for bound, n in zip(buckets + (math.inf,), counts):
+                    cumulative += n
+                    le = key + (("le", _format_value(bound)),)
+                    lines.append(f"{full}_bucket{_format_labels(le)} {cumulative}")
+                lines.append(f"{full}_sum{_format_labels(key)} {_format_value(total)}")
+                lines.append(f"{full}_count{_format_labels(key)} {count}")
+        gauges = self._gauges()
+        for name in sorted(gauges):
+            full = header(name, "gauge")
+            for key, value in gauges[name]:
+                if value is None:
+                    continue
+                lines.append(f"{full}{_format_labels(key)} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+def flatten(prefix: str, stats: dict) -> dict:
+    """``{"a": 1, "b": 2}`` -> ``{"<prefix>_a": 1, "<prefix>_b": 2}`` for a collector."""
+    return {f"{prefix}_{k}": v for k, v in stats.items()}
+
+
+METRICS = Registry()
+
+
+_PROFILE_LOCK = asyncio.Lock()
+
+
+async def profile_response(call, limit: int = 40) -> str:
+    """Await ``call()`` under cProfile; the top functions by cumulative time, as text.
+
+    The profiler sees everything the event loop thread runs meanwhile, other
+    requests included; work in pool threads and processes is not profiled.
+    Only one profiler can be active, so profiled requests run one at a time.
+    """
+    async with _PROFILE_LOCK:
+        profiler = cProfile.Profile()
+        t0 = time.perf_counter()
+        profiler.enable()
+        try:
+            response = await call()
+        finally:
+            profiler.disable()
+        elapsed = time.perf_counter() - t0
+    out = io.StringIO()
+    stats = pstats.Stats(profiler, stream=out)
+    stats.sort_stats("cumulative").print_stats(limit)
+    status = getattr(response, "status_code", None)
+    return f"status: {status}\nwall time: {elapsed * 1e3:.2f} ms\n\n" + out.getvalue()
@@ -0,0 +1,221 @@
+# server/resample.py
+"""Reshaping OHLCV columns for charts: time windows, resampling, downsampling.
+
+All functions take and return typed columns (int64 epoch ``Time``, float64
+values), as ``encoding.range_columns`` produces.
+
+* ``resample`` aggregates bars into coarser ones (open=first, high=max,
+  low=min, close=last, volume=sum), with buckets aligned to UTC midnight,
+  Mondays for whole weeks and calendar months for ``M``.
+* ``minmax`` keeps, per bucket of consecutive bars, the bars holding the
+  lowest low and the highest high: at most ``max_points`` real bars, and
+  every extreme of the series survives.
+* ``lttb`` is Largest-Triangle-Three-Buckets on the close: at most
+  ``max_points`` real bars that keep the visual shape of the line.
+
+``select_bars`` picks the source for a request: the cached range, or, when
+the request reaches outside the cached window or asks for another interval,
+the full history in the bar store (which keeps every bar ever fetched), with
+the finest stored interval that can serve it.
+"""
+import re
+
+import numpy as np
+
+from .histo import RANGE_CONFIG, interval_seconds, _fetch_plan
+from .store import TIME_COLUMN
+
+DOWNSAMPLERS = ("minmax", "lttb")
+
+_UNITS = {"s": 1, "m": 60, "min": 60, "h": 3600, "d": 86400, "w": 7 * 86400}
+_WEEK_ORIGIN = 4 * 86400     # 1970-01-05, the first Monday after the epoch
+
+
+def parse_interval(text: str):
+    """``"30m"``, ``"4h"``, ``"1d"``, ``"1w"``, ``"1M"`` (months) or plain seconds.
+
+    Returns seconds, or ``("M", n)`` for calendar months.
+    """
+    match = re.fullmatch(r"\s*(\d+)\s*(s|m|min|h|d|w|M)?\s*", text or "")
+    if not match or int(match.group(1)) <= 0:
+        raise ValueError(f"Invalid interval: {text!r}")
+    n, unit = int(match.group(1)), match.group(2) or "s"
+    if unit == "M":
+        return ("M", n)
+    return n * _UNITS[unit]
+
+
+def parse_time(value):
+    """Epoch seconds from epoch seconds or an ISO date/time string (None passes through)."""
+    if value is None or value == "":
+        return None
+    text = str(value).strip()
+    if text.lstrip("-").isdigit():
+        return int(text)
+    import pandas as pd
+
+    try:
+        return int(pd.Timestamp(text).tz_localize(None).value // 10**9)
+    except (TypeError, ValueError):
+        raise ValueError(f"Invalid time: {value!r}")
+
+
+def window(cols: dict, start: int = None, end: int = None) -> dict:
+    """Bars with ``start`` <= Time <= ``end``."""
+    times = cols[TIME_COLUMN]
+    lo = 0 if start is None else int(np.searchsorted(times, start, side="left"))
+    hi = len(times) if end is None else int(np.searchsorted(times, end, side="right"))
+    return {name: values[lo:hi] for name, values in cols.items()}
+
+
+def _take(cols: dict, idx) -> dict:
+    return {name: values[idx] for name, values in cols.items()}
+
+
+def _bucket_start(times: np.ndarray, step) -> np.ndarray:
+    if isinstance(step, tuple):
+        months = times.astype("datetime64[s]").astype("datetime64[M]").astype(np.int64)
+        months -= months % step[1]
+        return months.astype("datetime64[M]").astype("datetime64[s]").astype(np.int64)
+    origin = _WEEK_ORIGIN if step % (7 * 86400) == 0 else 0
+    return (times - origin) // step * step + origin
+
+
+def resample(cols: dict, step) -> dict:
+    """Aggregate bars into ``step`` buckets (seconds or ``("M", n)``), labelled by bucket start."""
+    times = cols[TIME_COLUMN]
+    if not len(times):
+        return cols
+    buckets = _bucket_start(times, step)
+    starts = np.concatenate(([0], np.flatnonzero(np.diff(buckets)) + 1))
+    ends = np.append(starts[1:], len(times)) - 1
+    out = {TIME_COLUMN: buckets[starts]}
+    for name, values in cols.items():
+        if name == TIME_COLUMN:
+            continue
+        if name == "Open":
+            out[name] = values[starts]
+        elif name == "High":
+            out[name] = np.fmax.reduceat(values, starts)
+        elif name == "Low":
+            out[name] = np.fmin.reduceat(values, starts)
+        elif name == "Volume":
+            out[name] = np.add.reduceat(np.nan_to_num(values), starts)
+        else:
+            out[name] = values[ends]
+    return out
+
+
+def _bucket_ids(n: int, buckets: int) -> np.ndarray:
+    return np.arange(n) * buckets // n
+
+
+def minmax(cols: dict, max_points: int) -> dict:
+    """Per bucket, the bars with the lowest low and the highest high (at most ``max_points`` bars)."""
+    n = len(cols[TIME_COLUMN])
+    if n <= max_points:
+        return cols
+    buckets = max(1, max_points // 2)
+    ids = _bucket_ids(n, buckets)
+    starts = np.searchsorted(ids, np.arange(buckets))
+    low = np.asarray(cols.get("Low", cols["Close"]))
+    high = np.asarray(cols.get("High", cols["Close"]))
+    keep = []
+    for values, reduce in ((low, np.fmin), (high, np.fmax)):
+        extreme = reduce.reduceat(values, starts)
+        hits = np.flatnonzero(values == extreme[ids])
+        # First hit per bucket; all-NaN buckets fall back to their first bar.
+        _, first = np.unique(ids[hits], return_index=True)
+        chosen = np.array(starts)
+        chosen[ids[hits[first]]] = hits[first]
+        keep.append(chosen)
+    return _take(cols, np.unique(np.concatenate(keep)))
+
+
+def lttb(cols: dict, max_points: int) -> dict:
+    """Largest-Triangle-Three-Buckets on Time/Close (at most ``max_points`` bars)."""
+    n = len(cols[TIME_COLUMN])
+    if n <= max_points or max_points < 3:
+        return cols if n <= max_points else _take(cols, np.array([0, n - 1]))
+    x = cols[TIME_COLUMN].astype(np.float64)
+    y = np.nan_to_num(np.asarray(cols["Close"], dtype=np.float64))
+    # First and last bars are kept; the rest is split into max_points - 2 buckets.
+    edges = 1 + (np.arange(max_points - 1) * (n - 2)) // (max_points - 2)
+    idx = np.empty(max_points, dtype=np.int64)
+    idx[0], idx[-1] = 0, n - 1
+    a = 0
+    for b in range(max_points - 2):
+        lo, hi = edges[b], edges[b + 1]
+        nlo, nhi = hi, edges[b + 2] if b + 2 < len(edges) else n
+        cx, cy = x[nlo:nhi].mean(), y[nlo:nhi].mean()
+        area = np.abs((x[a] - cx) * (y[lo:hi] - y[a]) - (x[a] - x[lo:hi]) * (cy - y[a]))
+        a = lo + int(np.argmax(area))
+        idx[b + 1] = a
+    return _take(cols, idx)
+
+
+def downsample(cols: dict, max_points: int, method: str = "minmax") -> dict:
+    if method == "lttb":
+        return lttb(cols, max_points)
+    if method == "minmax":
+        return minmax(cols, max_points)
+    raise ValueError(f"Invalid downsample method: {method!r} (use one of {', '.join(DOWNSAMPLERS)})")
+
+
+def history(store, symbol: str, label: str, cols: dict) -> dict:
+    """Every stored bar of a range, followed by the cached bars newer than the store's."""
+    try:
+        stored = store.read_columns(symbol, label)
+    except KeyError:
+        return cols
+    if cols is None or not len(cols[TIME_COLUMN]):
+        return stored
+    if not len(stored[TIME_COLUMN]) or set(stored) != set(cols):
+        return cols
+    cut = int(np.searchsorted(stored[TIME_COLUMN], cols[TIME_COLUMN][0], side="left"))
+    return {name: np.concatenate((stored[name][:cut], cols[name])) for name in cols}
+
+
+def _step_seconds(step) -> float:
+    return step[1] * 30 * 86400 if isinstance(step, tuple) else step
+
+
+def select_bars(store, symbol: str, entry: dict, range: str, range_cols, interval: str = None,
+                start: int = None, end: int = None):
+    """(columns, meta) for a request: ``range``'s bars, or resampled from the best stored source.
+
+    ``range_cols(label)`` returns the cached columns of a range.
+    """
+    data = entry.get("data") or {}
+    meta = {}
+    if interval is None:
+        cols = range_cols(range)
+        if start is not None and len(cols[TIME_COLUMN]) and start < cols[TIME_COLUMN][0]:
+            cols = history(store, symbol, range, cols)
+        return window(cols, start, end), meta
+
+    step = parse_interval(interval)
+    target = _step_seconds(step)
+    candidates = []
+    for label, _ in _fetch_plan():
+        if label not in data:
+            continue
+        seconds = interval_seconds(RANGE_CONFIG[label]["interval"])
+        cols = history(store, symbol, label, range_cols(label))
+        if not seconds or not len(cols[TIME_COLUMN]):
+            continue
+        first = int(cols[TIME_COLUMN][0])
+        if start is not None:
+            # Finest interval that covers the window, else the longest history.
+            key = (seconds > target, first > start, seconds if first <= start else first)
+        else:
+            key = (seconds > target, first, seconds)
+        candidates.append((key, label, seconds, cols))
+    if not candidates:
+        raise KeyError(range)
+    _, label, seconds, cols = min(candidates, key=lambda c: c[0])
+    cols = window(cols, start, end)
+    if target > seconds:
+        cols = resample(cols, step)
+    meta.update({"interval": interval, "source_range": label, "source_interval": seconds})
+    return cols, meta
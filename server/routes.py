@@ -1,22 +1,43 @@
 # server/routes.py
-from fastapi import Request
-from . import app, templates, DATA_CACHE, update_cache_for_symbol, safe_response, load_cache_from_disk
-from .analyze import analyze_dataframe, score_trade
-from .advanced_analysis import get_advanced_analysis, generate_decision_signal
-from .ml_model import trainer
+from fastapi import Query, Request
+from fastapi.responses import Response
+from . import (
+    app, templates, STORE, DATA_CACHE, SCHEDULER, FETCHER, CORRELATIONS, COMPUTE, LOOP_MONITOR,
+    REFRESH_LISTENERS, TRAINING, COLD_FETCH_TIMEOUT, CACHE_LOADED, SHARED,
+    ensure_symbol, load_symbol, safe_response,
+)
+from .backtest import SIGNALS, Backtester, forward_labels, report, step_analyses, step_columns
+from .histo import RANGE_CONFIG
+from .leaderboard import Leaderboard, _blend
+from .metrics import METRICS
+from .resample import DOWNSAMPLERS, downsample, parse_time, select_bars
+from .encoding import (
+    BINARY_MEDIA_TYPE, bytes_response, dumps, encode_binary, encoded_range, json_columns,
+    range_columns, slice_since,
+)
+import os
 import time
-import pandas as pd
+import numpy as np
 import asyncio
 
 @app.get("/")
 async def root(request: Request):
-    return templates.TemplateResponse("index.html", {"request": request})
+    return templates.TemplateResponse(request, "index.html")
 
 @app.get("/data")
-async def data(symbol: str = "ATW", exchange: str = "CSEMA", range: str = "1d"):
-    if symbol not in DATA_CACHE:
-        DATA_CACHE[symbol] = {"status": "loading", "data": {}}
-        asyncio.create_task(update_cache_for_symbol(symbol, exchange))
+async def data(request: Request, symbol: str = "ATW", exchange: str = "CSEMA", range: str = "1d",
+               format: str = None, since: int = None, interval: str = None,
+               from_: str = Query(None, alias="from"), to: str = None,
+               max_points: int = None, downsample_method: str = Query("minmax", alias="downsample")):
+    """OHLCV for one range. ``format=binary`` (or ``Accept: application/x-ohlcv``) selects
+    the compact typed-array layout; ``since`` (epoch seconds) limits it to bars from that time.
+
+    ``interval`` (``30m``, ``4h``, ``1d``, ``1w``, ``1M``...) resamples the finest stored
+    bars, ``from``/``to`` (epoch seconds or ISO dates) select a window of the stored
+    history, and ``max_points`` caps the bar count with ``downsample=minmax`` (per-bucket
+    extremes) or ``lttb``."""
+    SCHEDULER.touch(symbol)
+    ensure_symbol(symbol, exchange)
 
     entry = DATA_CACHE.get(symbol, {})
     if entry.get("status") == "loading":
@@ -26,21 +47,60 @@ async def data(symbol: str = "ATW", exchange: str = "CSEMA", range: str = "1d"):
     if range not in data:
         return safe_response({"error": f"Invalid range: {range} or no data for symbol: {symbol}"}, status_code=404)
 
-    return safe_response({
-        range: data[range],
-        "meta": {
-            "symbol": symbol,
-            "exchange": exchange,
-            "last_updated": entry.get("last_updated"),
-            "status": entry.get("status")
-        }
-    })
+    meta = {
+        "symbol": symbol,
+        "exchange": exchange,
+        "last_updated": entry.get("last_updated"),
+        "status": entry.get("status")
+    }
+    if_none_match = request.headers.get("if-none-match")
+    accept_encoding = request.headers.get("accept-encoding")
+    binary = format == "binary" or BINARY_MEDIA_TYPE in request.headers.get("accept", "")
+
+    shaped = interval is not None or from_ is not None or to is not None or max_points is not None
+    if shaped:
+        if downsample_method not in DOWNSAMPLERS:
+            return safe_response({"error": f"Invalid downsample: {downsample_method} (use one of {', '.join(DOWNSAMPLERS)})"},
+                                 status_code=400)
+        try:
+            start, end = parse_time(from_), parse_time(to)
+            cols, shape = select_bars(STORE, symbol, entry, range, lambda label: range_columns(entry, label),
+                                      interval, start, end)
+        except ValueError as e:
+            return safe_response({"error": str(e)}, status_code=400)
+        except KeyError:
+            return safe_response({"error": f"No stored bars for {symbol}"}, status_code=404)
+        meta.update(shape, bars=len(cols["Time"]))
+        if max_points is not None:
+            if max_points < 2:
+                return safe_response({"error": "max_points must be at least 2"}, status_code=400)
+            cols = downsample(cols, max_points, downsample_method)
+            meta.update(max_points=max_points, downsample=downsample_method)
+
+    if binary or since is not None or shaped:
+        if not shaped:
+            cols = range_columns(entry, range)
+        meta["total"] = len(cols["Time"])
+        if since is not None:
+            meta["since"] = since
+            cols = slice_since(cols, since)
+
+    if binary:
+        body = encode_binary(cols, {"range": range, "meta": meta})
+        return bytes_response(body, if_none_match=if_none_match, accept_encoding=accept_encoding,
+                              media_type=BINARY_MEDIA_TYPE)
+
+    if since is not None or shaped:
+        payload = json_columns(cols)
+    else:
+        payload = encoded_range(entry, range)
+    body = b"{" + dumps(range) + b":" + payload + b',"meta":' + dumps(meta) + b"}"
+    return bytes_response(body, if_none_match=if_none_match, accept_encoding=accept_encoding)
 
 @app.get("/analyze")
 async def analyze(symbol: str = "ATW", exchange: str = "CSEMA", range: str = "1d"):
-    if symbol not in DATA_CACHE:
-        DATA_CACHE[symbol] = {"status": "loading", "data": {}}
-        asyncio.create_task(update_cache_for_symbol(symbol, exchange))
+    SCHEDULER.touch(symbol)
+    if ensure_symbol(symbol, exchange) is not None:
         return safe_response({"status": "loading", "message": f"Analysis for {symbol} will be ready soon."})
 
     entry = DATA_CACHE.get(symbol, {})
@@ -48,18 +108,26 @@ async def analyze(symbol: str = "ATW", exchange: str = "CSEMA", range: str = "1d
     if range not in data:
         return safe_response({'error': f'No data for range {range} for {symbol}'}, status_code=404)
 
+    # The refresh keeps the cached analysis current (streamed indicators),
+    # so only recompute when it is missing or failed.
+    cached = (entry.get('analysis') or {}).get(range)
+    if cached and 'error' not in cached:
+        return safe_response({'symbol': symbol, 'exchange': exchange, 'range': range, 'analysis': cached})
+
     try:
-        df_dict = data[range]
-        result = analyze_dataframe(df_dict, range)
+        result = await COMPUTE.analyze(data[range], range, cols=range_columns(entry, range))
         return safe_response({'symbol': symbol, 'exchange': exchange, 'range': range, 'analysis': result})
+    except TimeoutError as e:
+        return safe_response({'error': str(e)}, status_code=504)
     except Exception as e:
         return safe_response({'error': str(e)}, status_code=500)
     
 @app.get('/analyze_cached')
 async def analyze_cached(symbol: str = "ATW", exchange: str = "CSEMA", range: str = "1d", rsi: bool = True, macd: bool = True, fib: bool = True, patterns: bool = True):
     """Return cached analysis if present, otherwise compute, cache, and return it. Filters by enabled detectors."""
-    if symbol not in DATA_CACHE:
-        await update_cache_for_symbol(symbol, exchange)
+    SCHEDULER.touch(symbol)
+    if not await load_symbol(symbol, exchange, timeout=COLD_FETCH_TIMEOUT):
+        return safe_response({"status": "loading", "message": f"Analysis for {symbol} will be ready soon."}, status_code=202)
     entry = DATA_CACHE.get(symbol, {})
     if entry.get('status') == 'error' and not entry.get('data'):
         return safe_response({'error': f'No data available for {symbol}. Last error: {entry.get("last_error")}'}, status_code=503)
@@ -71,13 +139,15 @@ async def analyze_cached(symbol: str = "ATW", exchange: str = "CSEMA", range: st
         filtered = filter_analysis(ana, rsi, macd, fib, patterns)
         return safe_response({'symbol': symbol, 'exchange': exchange, 'range': range, 'analysis': filtered, 'analysis_last_updated': entry.get('analysis_last_updated', {}).get(range)})
     try:
-        df_dict = data[range]
-        result = analyze_dataframe(df_dict, range)
+        result = await COMPUTE.analyze(data[range], range, cols=range_columns(entry, range))
         filtered = filter_analysis(result, rsi, macd, fib, patterns)
         entry.setdefault('analysis', {})[range] = result
         entry.setdefault('analysis_last_updated', {})[range] = time.time()
         DATA_CACHE[symbol] = entry
+        LEADERBOARD.update(symbol, range, result, entry['analysis_last_updated'][range])
         return safe_response({'symbol': symbol, 'exchange': exchange, 'range': range, 'analysis': filtered})
+    except TimeoutError as e:
+        return safe_response({'error': str(e)}, status_code=504)
     except Exception as e:
         return safe_response({'error': str(e)}, status_code=500)
 
@@ -127,11 +197,21 @@ def filter_analysis(analysis: dict, rsi: bool, macd: bool, fib: bool, patterns:
     return filtered
 
 
+def cached_advanced(entry: dict, range: str):
+    """(advanced, decision) computed from the entry's current bars, or None."""
+    hit = (entry.get('advanced') or {}).get(range)
+    if hit and hit[0] == entry.get('last_updated'):
+        return hit[1], hit[2]
+    return None
+
+def store_advanced(entry: dict, range: str, advanced: dict, decision: dict):
+    entry.setdefault('advanced', {})[range] = (entry.get('last_updated'), advanced, decision)
+
+
 @app.get("/advanced_analysis")
 async def advanced_analysis_endpoint(symbol: str = "ATW", exchange: str = "CSEMA", range: str = "1d"):
     """Get advanced technical analysis with decision signals."""
-    load_cache_from_disk()
-    
+    SCHEDULER.touch(symbol)
     if symbol not in DATA_CACHE:
         return safe_response({'error': 'Symbol not in cache'}, status_code=404)
     
@@ -142,12 +222,13 @@ async def advanced_analysis_endpoint(symbol: str = "ATW", exchange: str = "CSEMA
         return safe_response({'error': f'Range {range} not available'}, status_code=404)
     
     try:
-        df_dict = data[range]
-        df = pd.DataFrame(df_dict)
-        
-        advanced = get_advanced_analysis(df)
-        decision = generate_decision_signal(advanced)
-        
+        cached = cached_advanced(entry, range)
+        if cached is None:
+            advanced, decision = await COMPUTE.advanced(data[range], cols=range_columns(entry, range))
+            store_advanced(entry, range, advanced, decision)
+        else:
+            advanced, decision = cached
+
         basic = entry.get('analysis', {}).get(range, {})
         
         return safe_response({
@@ -158,36 +239,44 @@ async def advanced_analysis_endpoint(symbol: str = "ATW", exchange: str = "CSEMA
             'decision': decision,
             'basic': basic
         })
+    except TimeoutError as e:
+        return safe_response({'error': str(e)}, status_code=504)
     except Exception as e:
         return safe_response({'error': str(e)}, status_code=500)
 
 
+CORRELATION_LOCK = asyncio.Lock()
+
 @app.get("/correlation_analysis")
-async def correlation_analysis_endpoint(symbols: str = "ATW,GTM,CIH", range: str = "1d"):
-    """Get correlation matrix between multiple symbols."""
-    load_cache_from_disk()
-    symbol_list = [s.strip() for s in symbols.split(',')]
+async def correlation_analysis_endpoint(symbols: str = "ATW,GTM,CIH", range: str = "1d", top: int = 0):
+    """Get correlation matrix between multiple symbols.
+
+    Returns are aligned on bar timestamps. With ``top`` > 0 only the ``top``
+    most correlated pairs are returned; ``symbols=all`` ranks the whole cache.
+    """
+    engine = CORRELATIONS.get(range)
+    if engine is None:
+        return safe_response({'error': f'Invalid range: {range}'}, status_code=404)
+    symbol_list = [s.strip() for s in symbols.split(',') if s.strip()]
     
     try:
-        data = {}
-        for symbol in symbol_list:
-            if symbol not in DATA_CACHE:
-                continue
-            entry = DATA_CACHE[symbol]
-            if range in entry.get('data', {}):
-                df_dict = entry['data'][range]
-                df = pd.DataFrame(df_dict)
-                data[symbol] = df['close'].values
-        
-        if not data:
+        # The engine's state lives in this process, so its matrix products
+        # run on a thread (NumPy releases the GIL); the lock serializes them.
+        async with CORRELATION_LOCK:
+            await asyncio.to_thread(engine.sync, DATA_CACHE, range)
+            if top > 0:
+                universe = None if symbol_list in ([], ['all'], ['*']) else symbol_list
+                pairs = await asyncio.to_thread(engine.top_pairs, top, universe)
+                return safe_response({
+                    'symbols': symbol_list,
+                    'range': range,
+                    'top_pairs': pairs
+                })
+            correlation_dict = engine.matrix(symbol_list)
+
+        if not correlation_dict:
             return safe_response({'error': 'No data available'}, status_code=404)
         
-        min_len = min(len(v) for v in data.values())
-        aligned_data = {k: v[-min_len:] for k, v in data.items()}
-        
-        corr_df = pd.DataFrame(aligned_data).corr()
-        correlation_dict = corr_df.to_dict()
-        
         return safe_response({
             'symbols': symbol_list,
             'range': range,
@@ -196,40 +285,55 @@ async def correlation_analysis_endpoint(symbols: str = "ATW,GTM,CIH", range: str
     except Exception as e:
         return safe_response({'error': str(e)}, status_code=500)
 
-    if not macd:
-        macd_info = filtered.get('macd', {})
-        macd_info.pop('macd_cross', None)
-        macd_info.pop('direction', None)
-    if not fib:
-        filtered.pop('fib', None)
-    if not patterns:
-        filtered.pop('patterns', None)
-    
-    signals = {k: v for k, v in filtered.items() if k not in ['error']}
-    from analyze import score_trade
-    filtered['score'] = score_trade(signals)
-    return filtered
+
+LEADERBOARD = Leaderboard(filter_analysis)
+
+
+def _update_leaderboard(symbol: str, prev: dict, entry: dict, labels):
+    LEADERBOARD.update_entry(symbol, entry, labels)
+
+
+REFRESH_LISTENERS.append(_update_leaderboard)
+
+
+async def _build_leaderboard():
+    await CACHE_LOADED.wait()
+    LEADERBOARD.rebuild(DATA_CACHE)
+
+
+@app.on_event("startup")
+async def build_leaderboard():
+    asyncio.create_task(_build_leaderboard())
 
 
 @app.get('/scan')
-async def scan(range: str = "1d", rsi: bool = True, macd: bool = True, fib: bool = True, patterns: bool = True):
-    """Scan all symbols in cache and return scores. Does NOT fetch new data (fast response)."""
-    results = []
-    for symbol, entry in DATA_CACHE.items():
-        if entry.get('analysis') and range in entry.get('analysis'):
-            ana = entry['analysis'][range]
-            filtered = filter_analysis(ana, rsi, macd, fib, patterns)
-            results.append({
-                'symbol': symbol,
-                'score': filtered.get('score'),
-                'trend': filtered.get('trend', {}).get('trend'),
-                'patterns': filtered.get('patterns', []),
-                'rsi': filtered.get('rsi'),
-                'macd_cross': filtered.get('macd', {}).get('macd_cross'),
-                'last_updated': entry.get('analysis_last_updated', {}).get(range)
-            })
-    results.sort(key=lambda x: x.get('score', 0), reverse=True)
-    return safe_response({'range': range, 'results': results, 'cached_symbols': len(results)})
+async def scan(range: str = "1d", rsi: bool = True, macd: bool = True, fib: bool = True, patterns: bool = True,
+               top: int = 0, offset: int = 0, min_score: float = None):
+    """Ranked scanner rows from the leaderboard. Does NOT fetch new data (fast response).
+
+    ``top`` limits the page size (0 = all), ``offset`` pages through the
+    ranking and ``min_score`` drops rows scoring below it.
+    """
+    results, total = LEADERBOARD.scan(range, (rsi, macd, fib, patterns), offset, top or None, min_score)
+    return safe_response({'range': range, 'results': results, 'total': total, 'offset': offset,
+                          'cached_symbols': LEADERBOARD.size(range)})
+
+@app.get('/refresh_status')
+async def refresh_status():
+    """Refresh scheduler queue depth, lag and throughput, datafeed pool usage, compute pool and loop lag."""
+    return safe_response({**SCHEDULER.metrics(), "cache_loaded": CACHE_LOADED.is_set(),
+                          "leader": SHARED.is_leader, "pid": os.getpid(), "fetcher": FETCHER.metrics(),
+                          "compute": COMPUTE.metrics(), "loop": LOOP_MONITOR.metrics()})
+
+@app.get('/metrics')
+async def metrics():
+    """Counters, latency histograms and gauges in the Prometheus text format."""
+    return Response(content=METRICS.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+@app.get('/cache_status')
+async def cache_status():
+    """Cache memory: hot/cold symbol counts, evictions, and heap bytes and idle time per symbol."""
+    return safe_response(DATA_CACHE.usage())
 
 @app.post('/scan_warmup')
 async def scan_warmup():
@@ -248,35 +352,65 @@ async def scan_warmup():
         "TGC"
     ]
     for symbol in symbols_list:
-        if symbol not in DATA_CACHE:
-            asyncio.create_task(update_cache_for_symbol(symbol))
+        ensure_symbol(symbol)
     return safe_response({'status': 'warmup_started', 'symbols': len(symbols_list)})
 
 
+def _training_snapshot() -> dict:
+    """Typed columns, analysis and status of every cached symbol. Blocking (cold ranges are read from disk).
+
+    The columns go to the training worker through shared memory and are turned
+    into the JSON /data layout there; per-entry caches (indicator state, encoded
+    bytes) stay behind.
+    """
+    return {symbol: {'columns': {label: range_columns(entry, label) for label in (entry.get('data') or {})},
+                     'analysis': entry.get('analysis') or {},
+                     'exchange': entry.get('exchange'),
+                     'status': entry.get('status')}
+            for symbol, entry in DATA_CACHE.entries()}
+
+
+TRAINING.listeners.append(lambda version: LEADERBOARD.invalidate_ml())
+
+
 @app.post("/train_model")
 async def train_model():
-    """Train ML model on accumulated cache data and labels."""
-    load_cache_from_disk()
-    result = trainer.train(DATA_CACHE)
-    return safe_response(result)
+    """Start training the ML model on accumulated cache data and labels in the background.
+
+    Poll ``/train_status?job=<id>`` for progress and the result.
+    """
+    already_running = TRAINING.running is not None
+    job = TRAINING.start(_training_snapshot)
+    return safe_response({'status': 'running' if already_running else 'started', 'job': job}, status_code=202)
+
+@app.get("/train_status")
+async def train_status(job: int = None):
+    """A training job (default: the latest one) with its stage, timings and result."""
+    found = TRAINING.job(job)
+    if found is None:
+        return safe_response({'error': 'No such training job'}, status_code=404)
+    return safe_response(found)
 
 @app.get("/model_info")
 async def model_info():
     """Get ML model info and metrics."""
-    info = trainer.get_model_info()
-    info['label_count'] = sum(len(v) for v in trainer.labels.values())
+    TRAINING.ensure_loaded()
+    info = TRAINING.trainer.get_model_info()
+    info['version'] = TRAINING.version
+    info['training'] = TRAINING.status()
+    info['label_count'] = sum(len(v) for v in TRAINING.trainer.labels.values())
     return safe_response(info)
 
 @app.post("/predict/{symbol}")
-async def predict_trade(symbol: str, range: str = "1d"):
+async def predict_trade(symbol: str, range: str = "1d", exchange: str = "CSEMA"):
     """Get ML prediction for a symbol using latest analysis."""
-    if symbol in DATA_CACHE and range in DATA_CACHE[symbol].get('analyses', {}):
-        analysis = DATA_CACHE[symbol]['analyses'][range]
-    else:
-        ohlcv = await asyncio.to_thread(fetch_data, symbol, range)
-        analysis = await asyncio.to_thread(analyze_dataframe, ohlcv, symbol)
+    if not await load_symbol(symbol, exchange, timeout=COLD_FETCH_TIMEOUT):
+        return safe_response({"status": "loading", "message": f"Data for {symbol} is being fetched..."}, status_code=202)
+    analysis = (DATA_CACHE.get(symbol, {}).get('analysis') or {}).get(range)
+    if not analysis:
+        return safe_response({'error': f'No analysis for range {range} for {symbol}'}, status_code=404)
     
-    ml_pred = trainer.predict(analysis)
+    ml_pred = (await asyncio.to_thread(TRAINING.predict_batch, [analysis]))[0]
     
     return safe_response({
         'symbol': symbol,
@@ -296,44 +430,127 @@ async def label_trade(symbol: str, request: Request):
     date = body.get('date')
     outcome = body.get('outcome', 0)
     
-    trainer.add_label(symbol, date, outcome)
+    await TRAINING.add_label(symbol, date, outcome, _training_snapshot)
     
     return safe_response({
         'status': 'labeled',
         'symbol': symbol,
         'date': date,
         'outcome': outcome,
-        'total_labels': sum(len(v) for v in trainer.labels.values())
+        'total_labels': sum(len(v) for v in TRAINING.trainer.labels.values())
     })
 
 @app.get("/scan_with_ml")
 async def scan_with_ml(range: str = "1d", rsi: bool = True, macd: bool = True, 
-                        fib: bool = True, patterns: bool = True):
-    """Scan all symbols with both heuristic and ML scores."""
-    load_cache_from_disk()
-    results = []
-    
-    for symbol, entry in DATA_CACHE.items():
-        if range not in entry.get('analyses', {}):
-            continue
-        
-        analysis = entry['analyses'][range]
-        filtered = filter_analysis(analysis, rsi, macd, fib, patterns)
-        
-        ml_pred = trainer.predict(filtered)
-        
-        results.append({
-            'symbol': symbol,
-            'score': filtered.get('score', 0),
-            'ml_prediction': ml_pred['prediction'],
-            'ml_confidence': ml_pred['confidence'],
-            'combined_score': (filtered.get('score', 0.5) * 0.6 + 
-                             (ml_pred.get('probability_good', 0.5) if ml_pred['model_available'] else 0.5) * 0.4),
-            'trend': filtered.get('trend', 'flat'),
-            'rsi': filtered.get('rsi'),
-            'macd_cross': filtered.get('macd', {}).get('macd_cross'),
-            'patterns': filtered.get('patterns', []),
-        })
-    
-    results.sort(key=lambda x: x.get('combined_score', 0), reverse=True)
-    return safe_response({'range': range, 'results': results})
\ No newline at end of file
+                        fib: bool = True, patterns: bool = True,
+                        top: int = 0, offset: int = 0, min_score: float = None):
+    """Scan all symbols with both heuristic and ML scores, ranked by the combined score.
+
+    Only symbols whose analysis changed since the last ML scan of this filter
+    combination (or every symbol, after retraining) are predicted, in one batch.
+    Symbols whose prediction failed are predicted again by the next scan.
+    """
+    combo = (rsi, macd, fib, patterns)
+    async with LEADERBOARD.lock(range, combo):
+        pending = LEADERBOARD.pending_predictions(range, combo)
+        if pending:
+            predictions = await asyncio.to_thread(TRAINING.predict_batch, [a for _, a in pending])
+            LEADERBOARD.set_predictions(range, combo, pending, predictions)
+    results, total = LEADERBOARD.scan_ml(range, combo, offset, top or None, min_score)
+    return safe_response({'range': range, 'results': results, 'total': total, 'offset': offset})
+
+
+BACKTEST = Backtester(STORE, DATA_CACHE, COMPUTE)
+
+
+def _ml_signal(res: dict, signal: str, toggles: tuple) -> np.ndarray:
+    """Per-bar ML probability (``ml``) or the scan's combined score (``combined``). Blocking."""
+    rows, cols = np.nonzero(res['valid'])
+    columns = step_columns(res, rows, cols, toggles)
+    prob = TRAINING.predict_columns(columns, lambda start, stop: step_analyses(columns, start, stop))
+    out = np.full(res['score'].shape, np.nan)
+    out[rows, cols] = _blend(columns['score'], prob) if signal == 'combined' else prob
+    return out
+
+
+def _backtest_args(range: str, window: int, symbols: str):
+    if range not in RANGE_CONFIG:
+        raise ValueError(f"Invalid range: {range}")
+    if window is not None and window < 2:
+        raise ValueError("window must be at least 2")
+    return [s.strip() for s in symbols.split(',') if s.strip()] if symbols else None
+
+@app.get("/backtest")
+async def backtest_endpoint(range: str = "6m", signal: str = "score", rsi: bool = True, macd: bool = True, fib: bool = True,
+                            patterns: bool = False, entry: float = 0.65, exit: float = 0.5, max_hold: int = 20, cost: float = 0.001,
+                            horizon: int = 5, window: int = None, symbols: str = None, top: int = 20,
+                            trades: bool = False):
+    """Replay the scanner signal over the stored history of every cached symbol and simulate trades.
+
+    ``signal`` is the heuristic ``score``, the model's probability (``ml``) or the ML
+    scan's ``combined`` score. A position opens when it reaches ``entry`` and closes
+    when it drops to ``exit`` or after ``max_hold`` bars; ``cost`` is charged per side.
+    ``window`` (default: the range's bar count) is the lookback of the Fibonacci levels
+    and the trend. ``symbols`` (comma-separated) restricts the universe, ``top`` the
+    per-symbol rows (0 = all) and ``trades`` adds the trade list. ``patterns`` turns the
+    patterns detector on; it runs the analysis on every bar, so it is off by default and
+    refused beyond ``backtest.MAX_PATTERN_BARS`` bars.
+    """
+    if signal not in SIGNALS:
+        return safe_response({'error': f"Invalid signal: {signal} (use one of {', '.join(SIGNALS)})"}, status_code=400)
+    if max_hold < 1 or horizon < 1:
+        return safe_response({'error': 'max_hold and horizon must be at least 1'}, status_code=400)
+    try:
+        wanted = _backtest_args(range, window, symbols)
+    except ValueError as e:
+        return safe_response({'error': str(e)}, status_code=400)
+    t0 = time.perf_counter()
+    try:
+        names, times, res = await BACKTEST.signals(range, window, (rsi, macd, fib), wanted, patterns)
+    except ValueError as e:
+        return safe_response({'error': str(e)}, status_code=400)
+    except TimeoutError as e:
+        return safe_response({'error': str(e)}, status_code=504)
+    if not names:
+        return safe_response({'error': f'No cached symbols with range {range}'}, status_code=404)
+    sig = res['score'] if signal == 'score' else await asyncio.to_thread(_ml_signal, res, signal, (rsi, macd, fib))
+    with METRICS.timer("backtest_seconds", stage="simulate"):
+        result = await asyncio.to_thread(report, names, times, res, sig, entry, exit, max_hold, cost, horizon,
+                                         top or None, trades)
+    return safe_response({'range': range, 'signal': signal, 'window': window or RANGE_CONFIG[range]['n_bars'],
+                          'params': {'entry': entry, 'exit': exit, 'max_hold': max_hold, 'cost': cost,
+                                     'rsi': rsi, 'macd': macd, 'fib': fib, 'patterns': patterns},
+                          **result, 'elapsed_ms': (time.perf_counter() - t0) * 1e3})
+
+@app.post("/backtest/labels")
+async def backtest_labels(range: str = "6m", horizon: int = 5, min_return: float = 0.0, signals_only: bool = True,
+                          entry: float = 0.65, rsi: bool = True, macd: bool = True, fib: bool = True,
+                          patterns: bool = False, window: int = None, symbols: str = None):
+    """Label historical bars by their return over the next ``horizon`` bars and train on them.
+
+    Outcome is 1 when the return beats ``min_return``, else 0. With ``signals_only``
+    only bars whose heuristic score reaches ``entry`` are labelled. Labels are added
+    to the trainer's (each call adds them again); a background refit starts once
+    enough have piled up, as with ``/label_trade``. The toggles, ``patterns`` included,
+    are those of ``/backtest``.
+    """
+    if horizon < 1:
+        return safe_response({'error': 'horizon must be at least 1'}, status_code=400)
+    try:
+        wanted = _backtest_args(range, window, symbols)
+    except ValueError as e:
+        return safe_response({'error': str(e)}, status_code=400)
+    try:
+        names, times, res = await BACKTEST.signals(range, window, (rsi, macd, fib), wanted, patterns)
+    except ValueError as e:
+        return safe_response({'error': str(e)}, status_code=400)
+    except TimeoutError as e:
+        return safe_response({'error': str(e)}, status_code=504)
+    if not names:
+        return safe_response({'error': f'No cached symbols with range {range}'}, status_code=404)
+    labels = await asyncio.to_thread(forward_labels, names, times, res['score'], res['valid'], res['close'],
+                                     horizon, min_return, entry if signals_only else None)
+    job = await TRAINING.add_labels(labels, _training_snapshot)
+    return safe_response({'status': 'labeled', 'range': range, 'horizon': horizon, 'labels': len(labels),
+                          'positive': sum(outcome for _, _, outcome in labels),
+                          'symbols': len({symbol for symbol, _, _ in labels}), 'job': job})
@@ -0,0 +1,172 @@
+# server/scheduler.py
+"""Refresh scheduler for cached symbols.
+
+Every (symbol, range) pair has its own next-due time, kept in a heap. When a
+pair becomes due it moves to a ready queue ordered by priority (symbols a
+client looked at recently go first), and a fixed pool of workers drains that
+queue. Pairs of the same symbol that are ready together are refreshed by a
+single call, and a pair is never queued twice while a refresh for it is in
+flight. The request-rate budget is charged by the fetcher, per upstream
+call, so cold loads and retries count against it as well.
+"""
+import asyncio
+import heapq
+import itertools
+import time
+
+# A symbol counts as "viewed" for this long after a client asked for it.
+VIEW_TTL = 120
+
+
+class RefreshScheduler:
+    def __init__(self, refresh, intervals: dict, workers: int = 3):
+        """``refresh(symbol, exchange, labels)`` is awaited for each batch of due ranges;
+        ``intervals`` maps each range label to its refresh period in seconds."""
+        self.refresh = refresh
+        self.intervals = intervals
+        self.workers = workers
+        self._seq = itertools.count()
+        self._due_heap = []          # (due, seq, symbol, label)
+        self._due = {}               # (symbol, label) -> due time currently in the heap
+        self._ready = []             # (priority, due, seq, symbol, label)
+        self._ready_keys = set()
+        self._inflight = set()       # (symbol, label)
+        self._exchange = {}
+        self._viewed = {}
+        self._wakeup = asyncio.Event()
+        self._has_ready = asyncio.Event()
+        self._tasks = []
+        self.stats = {"completed": 0, "errors": 0, "coalesced": 0,
+                      "last_lag": 0.0, "max_lag": 0.0, "avg_lag": 0.0}
+
+    # -- bookkeeping -------------------------------------------------------
+
+    def _push(self, symbol: str, label: str, due: float):
+        key = (symbol, label)
+        if key in self._due and self._due[key] <= due:
+            return
+        self._due[key] = due
+        heapq.heappush(self._due_heap, (due, next(self._seq), symbol, label))
+        self._wakeup.set()
+
+    def track(self, symbol: str, exchange: str = "CSEMA", last_updated: float = None):
+        """Schedule every range of ``symbol`` (no-op for ranges already scheduled)."""
+        self._exchange[symbol] = exchange
+        base = last_updated or time.time()
+        for label, period in self.intervals.items():
+            key = (symbol, label)
+            if key in self._due or key in self._ready_keys or key in self._inflight:
+                continue
+            self._push(symbol, label, base + period)
+
+    def untrack(self, symbol: str):
+        self._exchange.pop(symbol, None)
+        self._viewed.pop(symbol, None)
+        for label in self.intervals:
+            self._due.pop((symbol, label), None)
+        # Pairs already ready would otherwise refresh without their exchange.
+        if any(s == symbol for s, _ in self._ready_keys):
+            self._ready = [item for item in self._ready if item[3] != symbol]
+            heapq.heapify(self._ready)
+            self._ready_keys = {key for key in self._ready_keys if key[0] != symbol}
+
+    def touch(self, symbol: str):
+        """Record that a client is currently viewing ``symbol``."""
+        self._viewed[symbol] = time.time()
+
+    def viewed_since(self, since: float) -> list:
+        """Symbols ``touch``ed at or after ``since`` (epoch seconds)."""
+        return [s for s, t in self._viewed.items() if t >= since]
+
+    def _priority(self, symbol: str) -> int:
+        return 0 if time.time() - self._viewed.get(symbol, 0) < VIEW_TTL else 1
+
+    def _promote_due(self, now: float):
+        while self._due_heap and self._due_heap[0][0] <= now:
+            due, seq, symbol, label = heapq.heappop(self._due_heap)
+            key = (symbol, label)
+            if self._due.get(key) != due:
+                continue  # superseded or untracked
+            del self._due[key]
+            if key in self._inflight or key in self._ready_keys:
+                self.stats["coalesced"] += 1
+                continue
+            self._ready_keys.add(key)
+            heapq.heappush(self._ready, (self._priority(symbol), due, seq, symbol, label))
+            self._has_ready.set()
+
+    def _take_batch(self):
+        """Pop the best ready pair plus every other ready pair of the same symbol."""
+        _, due, _, symbol, label = heapq.heappop(self._ready)
+        batch = [(label, due)]
+        rest = []
+        while self._ready:
+            item = heapq.heappop(self._ready)
+            if item[3] == symbol:
+                batch.append((item[4], item[1]))
+                self.stats["coalesced"] += 1
+            else:
+                rest.append(item)
+        for item in rest:
+            heapq.heappush(self._ready, item)
+        for lbl, _ in batch:
+            self._ready_keys.discard((symbol, lbl))
+        return symbol, batch
+
+    # -- workers -----------------------------------------------------------
+
+    async def _dispatch(self):
+        while True:
+            now = time.time()
+            self._promote_due(now)
+            self._wakeup.clear()
+            timeout = self._due_heap[0][0] - now if self._due_heap else None
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _worker(self):
+        while True:
+            while not self._ready:
+                self._has_ready.clear()
+                await self._has_ready.wait()
+            symbol, batch = self._take_batch()
+            labels = [label for label, _ in batch]
+            keys = [(symbol, label) for label in labels]
+            self._inflight.update(keys)
+            try:
+                lag = max(0.0, time.time() - min(due for _, due in batch))
+                self.stats["last_lag"] = lag
+                self.stats["max_lag"] = max(self.stats["max_lag"], lag)
+                self.stats["avg_lag"] = 0.9 * self.stats["avg_lag"] + 0.1 * lag
+                await self.refresh(symbol, self._exchange.get(symbol, "CSEMA"), labels)
+                self.stats["completed"] += 1
+            except Exception as e:
+                self.stats["errors"] += 1
+                print(f"Scheduled refresh failed for {symbol} {labels}: {e}")
+            finally:
+                self._inflight.difference_update(keys)
+            if symbol in self._exchange:
+                for label in labels:
+                    self._push(symbol, label, time.time() + self.intervals[label])
+
+    def start(self):
+        if self._tasks:
+            return
+        self._tasks.append(asyncio.create_task(self._dispatch()))
+        for _ in range(self.workers):
+            self._tasks.append(asyncio.create_task(self._worker()))
+
+    def metrics(self) -> dict:
+        now = time.time()
+        overdue = sum(1 for due in self._due.values() if due <= now)
+        return {
+            "tracked_symbols": len(self._exchange),
+            "scheduled": len(self._due),
+            "queue_depth": len(self._ready) + overdue,
+            "in_flight": len(self._inflight),
+            "viewed_symbols": sum(1 for t in self._viewed.values() if now - t < VIEW_TTL),
+            "next_due_in": (self._due_heap[0][0] - now) if self._due_heap else None,
+            **self.stats,
+        }
@@ -0,0 +1,192 @@
+# server/shared.py
+"""State shared by the workers of one deployment.
+
+With ``uvicorn --workers N`` every worker is a separate process with its own
+``DATA_CACHE``. They coordinate through the cache directory:
+
+* the worker holding an exclusive lock on ``leader.lock`` is the leader. It
+  alone runs the refresh scheduler, fetches from upstream and writes the bar
+  store; the lock is released when its process exits, and another worker
+  takes over;
+* the other workers follow the bar store: they re-read its manifest when it
+  changes and serve bars (memory-mapped) and analysis from it. A symbol
+  nobody has fetched yet is queued for the leader instead of fetched, and
+  the symbols clients requested or viewed are forwarded to it, so it keeps
+  them hot, refreshed and prioritized;
+* labels go to a shared log that every worker replays into its trainer, and
+  model snapshots are shared through the model registry.
+
+``SqliteState`` keeps the queues and the label log in ``shared.db`` (WAL mode,
+so readers don't block the writer). Its calls block for as long as another
+worker holds the database lock (up to 5 s): callers on the event loop run
+them with ``asyncio.to_thread``. ``LocalState`` is the single-process
+variant: always the leader, everything in memory. ``TV_SHARED_STATE=local``
+selects it; it is also used where ``fcntl`` is unavailable.
+"""
+import os
+import sqlite3
+import threading
+import time
+from pathlib import Path
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+
+class LocalState:
+    """One worker: always the leader, queue and labels in memory."""
+
+    shared = False
+
+    def __init__(self):
+        self.is_leader = True
+        self._requests = {}
+        self._touches = {}
+        self._labels = []
+
+    def try_lead(self) -> bool:
+        return True
+
+    def request_symbol(self, symbol: str, exchange: str):
+        self._requests[symbol] = exchange
+
+    def take_requests(self) -> list:
+        requests, self._requests = list(self._requests.items()), {}
+        return requests
+
+    def forward_touches(self, requested, viewed):
+        now = time.time()
+        for symbol in requested:
+            self._touches[symbol] = (now, self._touches.get(symbol, (0, 0))[1])
+        for symbol in viewed:
+            self._touches[symbol] = (self._touches.get(symbol, (0, 0))[0], now)
+
+    def take_touches(self) -> list:
+        touches, self._touches = [(s, *t) for s, t in self._touches.items()], {}
+        return touches
+
+    def add_label(self, symbol: str, date, outcome) -> int:
+        self._labels.append((symbol, date, outcome))
+        return len(self._labels)
+
+    def add_labels(self, labels: list) -> int:
+        self._labels.extend(labels)
+        return len(self._labels)
+
+    def labels_since(self, label_id: int) -> list:
+        return [(i + 1, *label) for i, label in enumerate(self._labels[label_id:], start=label_id)]
+
+
+class SqliteState:
+    """Several workers on one cache directory: leader lock, request queue and label log."""
+
+    shared = True
+
+    def __init__(self, root):
+        self.root = Path(root)
+        self.root.mkdir(parents=True, exist_ok=True)
+        self.is_leader = False
+        self._lock_file = None
+        self._db = sqlite3.connect(str(self.root / "shared.db"), timeout=5, check_same_thread=False,
+                                   isolation_level=None)
+        self._db_lock = threading.Lock()
+        with self._db_lock:
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("PRAGMA synchronous=NORMAL")
+            self._db.execute("CREATE TABLE IF NOT EXISTS requests ("
+                             "symbol TEXT PRIMARY KEY, exchange TEXT, requested_at REAL)")
+            self._db.execute("CREATE TABLE IF NOT EXISTS touches ("
+                             "symbol TEXT PRIMARY KEY, requested_at REAL, viewed_at REAL)")
+            self._db.execute("CREATE TABLE IF NOT EXISTS labels ("
+                             "id INTEGER PRIMARY KEY AUTOINCREMENT, symbol TEXT, date TEXT, "
+                             "outcome, created_at REAL)")
+
+    def try_lead(self) -> bool:
+        """Take the leader lock if nobody holds it; True while this worker leads."""
+        if self.is_leader:
+            return True
+        f = open(self.root / "leader.lock", "a+")
+        try:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            f.close()
+            return False
+        f.seek(0)
+        f.truncate()
+        f.write(f"{os.getpid()}\n")
+        f.flush()
+        self._lock_file = f
+        self.is_leader = True
+        return True
+
+    def request_symbol(self, symbol: str, exchange: str):
+        with self._db_lock:
+            self._db.execute("INSERT OR REPLACE INTO requests VALUES (?, ?, ?)", (symbol, exchange, time.time()))
+
+    def take_requests(self) -> list:
+        with self._db_lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                rows = self._db.execute("SELECT symbol, exchange FROM requests").fetchall()
+                self._db.execute("DELETE FROM requests")
+            finally:
+                self._db.execute("COMMIT")
+        return rows
+
+    def forward_touches(self, requested, viewed):
+        """Follower: record that clients requested / are viewing these symbols (0: not since the last take)."""
+        now = time.time()
+        rows = {symbol: [now, 0] for symbol in requested}
+        for symbol in viewed:
+            rows.setdefault(symbol, [0, 0])[1] = now
+        if not rows:
+            return
+        with self._db_lock:
+            self._db.executemany(
+                "INSERT INTO touches VALUES (?, ?, ?) ON CONFLICT(symbol) DO UPDATE SET "
+                "requested_at = MAX(requested_at, excluded.requested_at), "
+                "viewed_at = MAX(viewed_at, excluded.viewed_at)",
+                [(symbol, requested_at, viewed_at) for symbol, (requested_at, viewed_at) in rows.items()])
+
+    def take_touches(self) -> list:
+        """Leader: (symbol, requested_at, viewed_at) forwarded since the last call."""
+        with self._db_lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                rows = self._db.execute("SELECT symbol, requested_at, viewed_at FROM touches").fetchall()
+                self._db.execute("DELETE FROM touches")
+            finally:
+                self._db.execute("COMMIT")
+        return rows
+
+    def add_label(self, symbol: str, date, outcome) -> int:
+        with self._db_lock:
+            cur = self._db.execute("INSERT INTO labels (symbol, date, outcome, created_at) VALUES (?, ?, ?, ?)",
+                                   (symbol, None if date is None else str(date), outcome, time.time()))
+            return cur.lastrowid
+
+    def add_labels(self, labels: list) -> int:
+        """Log many (symbol, date, outcome) labels in one transaction; returns the last id."""
+        now = time.time()
+        with self._db_lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                self._db.executemany("INSERT INTO labels (symbol, date, outcome, created_at) VALUES (?, ?, ?, ?)",
+                                     [(s, None if d is None else str(d), o, now) for s, d, o in labels])
+            finally:
+                self._db.execute("COMMIT")
+            return self._db.execute("SELECT MAX(id) FROM labels").fetchone()[0] or 0
+
+    def labels_since(self, label_id: int) -> list:
+        """(id, symbol, date, outcome) of every label after ``label_id``."""
+        with self._db_lock:
+            return self._db.execute("SELECT id, symbol, date, outcome FROM labels WHERE id > ? ORDER BY id",
+                                    (label_id,)).fetchall()
+
+
+def state_from_env(root):
+    if os.environ.get("TV_SHARED_STATE", "sqlite") == "local" or fcntl is None:
+        return LocalState()
+    return SqliteState(root)
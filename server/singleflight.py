@@ -0,0 +1,23 @@
+# server/singleflight.py
+"""Single-flight execution: concurrent callers for the same key share one task."""
+import asyncio
+
+
+class SingleFlight:
+    def __init__(self):
+        self._inflight = {}
+
+    def start(self, key, factory) -> asyncio.Task:
+        """Return the task running for ``key``, starting ``factory()`` if there is none."""
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.create_task(factory())
+            self._inflight[key] = task
+            task.add_done_callback(lambda _t, key=key: self._inflight.pop(key, None))
+        return task
+
+    def get(self, key):
+        return self._inflight.get(key)
+
+    def __len__(self):
+        return len(self._inflight)
@@ -0,0 +1,125 @@
+# server/sources.py
+"""Where bars come from.
+
+A source hands out sessions; a session has the ``TvDatafeed.get_hist``
+signature and returns a DataFrame indexed by ``datetime`` with
+open/high/low/close/volume columns. ``FetchEngine`` opens one session per
+pool thread.
+
+``TV_SOURCE=replay`` swaps TradingView for ``ReplaySource``, which serves
+bars recorded in a bar store (``TV_REPLAY_DIR``) or, for symbols it has no
+recording of, a seeded random walk. ``TV_REPLAY_LATENCY`` (seconds) and
+``TV_REPLAY_ERROR_RATE`` (0..1) make it behave like a slow, flaky upstream.
+"""
+import calendar
+import os
+import random
+import time
+import zlib
+
+import numpy as np
+
+
+class _TvSession:
+    """A logged-in ``TvDatafeed`` taking ``histo.Interval`` values."""
+
+    def __init__(self, tv, tv_interval):
+        self.tv = tv
+        self.tv_interval = tv_interval
+
+    def get_hist(self, symbol, exchange, interval, n_bars):
+        return self.tv.get_hist(symbol, exchange, interval=self.tv_interval(interval.value), n_bars=n_bars)
+
+
+class TradingViewSource:
+    def __init__(self, username: str = None, password: str = None):
+        self.username = username
+        self.password = password
+
+    def session(self):
+        """Import tvDatafeed and log in; the first fetch pays for both, not startup."""
+        from .histo import load_tvdatafeed
+
+        TvDatafeed, TvInterval = load_tvdatafeed()
+        if not TvDatafeed:
+            raise RuntimeError("tvDatafeed not available - cannot fetch data")
+        if self.username and self.password:
+            return _TvSession(TvDatafeed(self.username, self.password), TvInterval)
+        return _TvSession(TvDatafeed(), TvInterval)
+
+
+class ReplaySource:
+    def __init__(self, root=None, latency: float = 0.0, error_rate: float = 0.0, seed: int = 0):
+        from .store import BarStore
+
+        self.store = BarStore(root) if root else None
+        self.latency = latency
+        self.error_rate = error_rate
+        self.seed = seed
+
+    def session(self):
+        # Stateless apart from the RNG draws, so every thread can share it.
+        return self
+
+    def _recorded(self, symbol: str, step: int):
+        if self.store is None or symbol not in self.store.symbols():
+            return None
+        for label in self.store.ranges(symbol):
+            cols = self.store.read_columns(symbol, label)
+            times = np.asarray(cols["Time"])
+            if len(times) > 1 and int(np.median(np.diff(times))) == step:
+                return cols
+        return None
+
+    def _synthetic(self, symbol: str, step: int, n_bars: int) -> dict:
+        rng = np.random.default_rng([self.seed, zlib.crc32(symbol.encode()), step])
+        # Naive exchange-local timestamps, like TvDatafeed returns.
+        end = calendar.timegm(time.localtime()) // step * step
+        times = end - step * np.arange(n_bars - 1, -1, -1, dtype=np.int64)
+        close = 100 * np.exp(np.cumsum(rng.normal(0, 0.01, n_bars)))
+        open_ = np.r_[close[0], close[:-1]]
+        spread = np.abs(rng.normal(0, 0.004, n_bars)) * close
+        return {
+            "Time": times,
+            "Open": open_,
+            "High": np.maximum(open_, close) + spread,
+            "Low": np.minimum(open_, close) - spread,
+            "Close": close,
+            "Volume": rng.integers(100, 10000, n_bars).astype(float),
+        }
+
+    def get_hist(self, symbol, exchange, interval=None, n_bars=10):
+        import pandas as pd
+
+        from .histo import interval_seconds
+
+        if self.latency:
+            time.sleep(self.latency * random.uniform(0.5, 1.5))
+        if self.error_rate and random.random() < self.error_rate:
+            raise ConnectionError(f"replay: injected failure for {exchange}:{symbol}")
+        step = interval_seconds(interval)
+        cols = self._recorded(symbol, step) or self._synthetic(symbol, step, n_bars)
+        df = pd.DataFrame({
+            "symbol": f"{exchange}:{symbol}",
+            "open": np.asarray(cols["Open"])[-n_bars:],
+            "high": np.asarray(cols["High"])[-n_bars:],
+            "low": np.asarray(cols["Low"])[-n_bars:],
+            "close": np.asarray(cols["Close"])[-n_bars:],
+            "volume": np.asarray(cols["Volume"])[-n_bars:],
+        }, index=pd.to_datetime(np.asarray(cols["Time"])[-n_bars:], unit="s"))
+        df.index.name = "datetime"
+        return df
+
+
+def source_from_env(username: str = None, password: str = None):
+    """The data source selected by ``TV_SOURCE`` (``tradingview`` or ``replay``)."""
+    kind = os.environ.get("TV_SOURCE", "tradingview").lower()
+    if kind == "replay":
+        return ReplaySource(
+            os.environ.get("TV_REPLAY_DIR") or None,
+            latency=float(os.environ.get("TV_REPLAY_LATENCY", 0.0)),
+            error_rate=float(os.environ.get("TV_REPLAY_ERROR_RATE", 0.0)),
+        )
+    if kind != "tradingview":
+        raise ValueError(f"Unknown TV_SOURCE: {kind}")
+    return TradingViewSource(username, password)
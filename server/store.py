@@ -0,0 +1,284 @@
+# server/store.py
+"""Columnar, append-only bar store.
+
+Layout under the store root::
+
+    manifest.json                      symbol -> exchange, status, ranges
+    <SYMBOL>/analysis.json             last analysis computed for the symbol
+    <SYMBOL>/<range>/<Column>.bin      one raw little-endian column per field
+
+The manifest is the commit point. A column file may hold more rows than the
+manifest records (an interrupted append); those rows are ignored on read and
+overwritten by the next write. Column files never shrink in place (a range
+written from scratch replaces its files), so other processes reading the
+store through memory maps never see a mapped row vanish.
+"""
+from collections.abc import Mapping
+from pathlib import Path
+import json
+import os
+import tempfile
+
+import numpy as np
+
+MANIFEST_VERSION = 1
+TIME_COLUMN = "Time"
+TIME_DTYPE = "<i8"
+VALUE_DTYPE = "<f8"
+
+
+def _atomic_write_json(path: Path, obj):
+    """Write JSON to a temp file next to ``path`` and rename it into place."""
+    fd, tmp = tempfile.mkstemp(dir=str(path.parent), prefix=path.name, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w") as f:
+            json.dump(obj, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, path)
+    except BaseException:
+        try:
+            os.unlink(tmp)
+        except OSError:
+            pass
+        raise
+
+
+def _safe_name(name: str) -> str:
+    return str(name).replace(os.sep, "_").replace("..", "_")
+
+
+def times_to_epoch(times) -> np.ndarray:
+    """Convert a list of timestamp strings to int64 epoch seconds (epoch input is passed through)."""
+    if len(times) == 0:
+        return np.empty(0, dtype=TIME_DTYPE)
+    if isinstance(times, np.ndarray) and times.dtype.kind in "iu":
+        return times.astype(TIME_DTYPE, copy=False)
+    import pandas as pd
+
+    ts = pd.to_datetime(pd.Series(times))
+    return ts.values.astype("datetime64[s]").astype(TIME_DTYPE)
+
+
+def epoch_to_times(epoch) -> list:
+    """Inverse of ``times_to_epoch``, producing the timestamp strings of the JSON ``/data`` layout."""
+    import pandas as pd
+
+    return pd.Series(pd.to_datetime(np.asarray(epoch, dtype=TIME_DTYPE), unit="s")).astype(str).tolist()
+
+
+def is_columnar(rdata) -> bool:
+    """True if ``rdata`` already holds typed columns (int64 epoch ``Time``)."""
+    times = (rdata or {}).get(TIME_COLUMN) if isinstance(rdata, Mapping) else None
+    return isinstance(times, np.ndarray) and times.dtype.kind in "iu"
+
+
+def columns_from_dict(rdata: dict) -> dict:
+    """Split a range dict of lists into typed NumPy columns (typed columns are kept as they are).
+
+    Non-numeric columns (e.g. the repeated ``symbol`` column) are dropped.
+    """
+    cols = {TIME_COLUMN: times_to_epoch(rdata.get(TIME_COLUMN, []))}
+    n = len(cols[TIME_COLUMN])
+    for name, values in rdata.items():
+        if name == TIME_COLUMN or len(values) != n:
+            continue
+        try:
+            cols[name] = np.asarray(values, dtype=VALUE_DTYPE)
+        except (TypeError, ValueError):
+            continue
+    return cols
+
+
+def dict_from_columns(cols: dict) -> dict:
+    out = {TIME_COLUMN: epoch_to_times(cols[TIME_COLUMN])}
+    for name, values in cols.items():
+        if name != TIME_COLUMN:
+            out[name] = np.asarray(values).tolist()
+    return out
+
+
+class BarStore:
+    """Per-symbol, per-range column files plus a small JSON manifest."""
+
+    def __init__(self, root):
+        self.root = Path(root)
+        self.root.mkdir(parents=True, exist_ok=True)
+        self.manifest_path = self.root / "manifest.json"
+        self._manifest = None
+        self._manifest_sig = None
+
+    def _signature(self):
+        try:
+            st = os.stat(self.manifest_path)
+        except FileNotFoundError:
+            return None
+        return (st.st_ino, st.st_mtime_ns, st.st_size)
+
+    @property
+    def manifest(self) -> dict:
+        """Read on first access, so constructing a store costs no I/O."""
+        if self._manifest is None:
+            self._manifest_sig = self._signature()
+            self._manifest = self._read_manifest()
+        return self._manifest
+
+    def reload(self) -> list:
+        """Pick up a manifest committed by another process; returns the symbols whose entry changed."""
+        sig = self._signature()
+        if self._manifest is not None and sig == self._manifest_sig:
+            return []
+        old = self.manifest["symbols"]
+        self._manifest_sig = sig
+        self._manifest = self._read_manifest()
+        return [s for s, meta in self._manifest["symbols"].items() if old.get(s) != meta]
+
+    def _read_manifest(self) -> dict:
+        if not self.manifest_path.exists():
+            return {"version": MANIFEST_VERSION, "symbols": {}}
+        try:
+            with self.manifest_path.open("r") as f:
+                manifest = json.load(f)
+        except Exception as e:
+            print(f"Failed to read bar store manifest: {e}")
+            return {"version": MANIFEST_VERSION, "symbols": {}}
+        manifest.setdefault("symbols", {})
+        return manifest
+
+    def _commit(self):
+        _atomic_write_json(self.manifest_path, self.manifest)
+        self._manifest_sig = self._signature()
+
+    def _range_dir(self, symbol: str, label: str) -> Path:
+        return self.root / _safe_name(symbol) / _safe_name(label)
+
+    def symbols(self) -> list:
+        return list(self.manifest["symbols"].keys())
+
+    def meta(self, symbol: str) -> dict:
+        return self.manifest["symbols"].get(symbol, {})
+
+    def ranges(self, symbol: str) -> dict:
+        return self.meta(symbol).get("ranges", {})
+
+    def read_columns(self, symbol: str, label: str, window: int = None) -> dict:
+        """Memory-map the committed rows of a range, optionally only the last ``window``."""
+        rmeta = self.ranges(symbol).get(label)
+        if not rmeta:
+            raise KeyError(label)
+        rows = rmeta["rows"]
+        start = max(0, rows - window) if window else 0
+        rdir = self._range_dir(symbol, label)
+        cols = {}
+        for name, dtype in rmeta["columns"].items():
+            path = rdir / f"{name}.bin"
+            if rows == 0:
+                cols[name] = np.empty(0, dtype=dtype)
+                continue
+            mm = np.memmap(path, dtype=dtype, mode="r", shape=(rows,))
+            cols[name] = mm[start:]
+        return cols
+
+    def read_analysis(self, symbol: str) -> dict:
+        path = self.root / _safe_name(symbol) / "analysis.json"
+        if not path.exists():
+            return {}
+        try:
+            with path.open("r") as f:
+                return json.load(f)
+        except Exception as e:
+            print(f"Failed to read analysis for {symbol}: {e}")
+            return {}
+
+    def _append_range(self, symbol: str, label: str, cols: dict) -> dict:
+        """Append bars newer than the stored tail; the last stored bar may be revised."""
+        rdir = self._range_dir(symbol, label)
+        rdir.mkdir(parents=True, exist_ok=True)
+        new_times = cols[TIME_COLUMN]
+        dtypes = {name: (TIME_DTYPE if name == TIME_COLUMN else VALUE_DTYPE) for name in cols}
+        rmeta = self.ranges(symbol).get(label)
+
+        if rmeta and rmeta["rows"] and set(rmeta["columns"]) == set(dtypes):
+            keep = rmeta["rows"]
+            last = rmeta["last_time"]
+            start = int(np.searchsorted(new_times, last, side="left"))
+            if start < len(new_times) and new_times[start] == last:
+                # The stored tail bar may still be forming; rewrite it.
+                keep -= 1
+        else:
+            keep, start = 0, 0
+
+        if start >= len(new_times) and rmeta:
+            return rmeta
+
+        for name, dtype in dtypes.items():
+            path = rdir / f"{name}.bin"
+            itemsize = np.dtype(dtype).itemsize
+            # Copy out first: ``cols`` may be a memory map of this very file.
+            payload = np.ascontiguousarray(cols[name][start:], dtype=dtype).tobytes()
+            if keep:
+                # Overwrite from the first new row on.
+                with open(path, "r+b" if path.exists() else "w+b") as f:
+                    f.seek(keep * itemsize)
+                    f.write(payload)
+                    f.flush()
+                    os.fsync(f.fileno())
+            else:
+                tmp = path.with_suffix(".tmp")
+                with open(tmp, "wb") as f:
+                    f.write(payload)
+                    f.flush()
+                    os.fsync(f.fileno())
+                os.replace(tmp, path)
+
+        rows = keep + len(new_times) - start
+        return {
+            "rows": rows,
+            "last_time": int(new_times[-1]) if len(new_times) else (rmeta or {}).get("last_time"),
+            "columns": dtypes,
+        }
+
+    def save_entry(self, symbol: str, entry: dict, analysis: dict = None):
+        """Persist the ranges and analysis of one ``DATA_CACHE`` entry."""
+        meta = dict(self.meta(symbol))
+        ranges = dict(meta.get("ranges", {}))
+        for label, rdata in (entry.get("data") or {}).items():
+            if not rdata or not len(rdata.get(TIME_COLUMN, ())):
+                continue
+            ranges[label] = self._append_range(symbol, label, columns_from_dict(rdata))
+        if analysis is not None:
+            sdir = self.root / _safe_name(symbol)
+            sdir.mkdir(parents=True, exist_ok=True)
+            _atomic_write_json(sdir / "analysis.json", analysis)
+        meta.update({
+            "exchange": entry.get("exchange", meta.get("exchange", "CSEMA")),
+            "last_updated": entry.get("last_updated"),
+            "status": entry.get("status", "ok"),
+            "ranges": ranges,
+        })
+        self.manifest["symbols"][symbol] = meta
+        self._commit()
+
+
+class LazyRanges(Mapping):
+    """Range label -> typed OHLCV columns, memory-mapped from the bar store on first access."""
+
+    def __init__(self, store: BarStore, symbol: str, windows: dict = None):
+        self._store = store
+        self._symbol = symbol
+        self._labels = list(store.ranges(symbol).keys())
+        self._windows = windows or {}
+        self._loaded = {}
+
+    def __getitem__(self, label):
+        if label not in self._loaded:
+            if label not in self._labels:
+                raise KeyError(label)
+            self._loaded[label] = self._store.read_columns(self._symbol, label, self._windows.get(label))
+        return self._loaded[label]
+
+    def __iter__(self):
+        return iter(self._labels)
+
+    def __len__(self):
+        return len(self._labels)
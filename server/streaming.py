@@ -0,0 +1,265 @@
+# server/streaming.py
+"""Incremental indicator state.
+
+Each cached range keeps an ``IndicatorState`` that has consumed every bar up
+to the last *closed* one. The newest bar is usually still forming and gets
+revised on every refresh, so it is never committed: its values come from
+``peek``, which evaluates the indicators as if the bar were pushed without
+changing the state. Advancing the state costs O(new bars), not O(window);
+a refresh that closed a bar still runs the full analysis, so the saving
+applies to refreshes where only the forming bar moved.
+
+EMAs are seeded at the first value and Wilder RSI is an EMA with
+alpha=1/period. EMAs carry history from before the window's left edge, so
+values converge to a from-scratch recompute within ``(1 - alpha) ** window``.
+
+Streamed values only stand in for fields of ``analyze_dataframe``'s result
+that they reproduce: after every full analysis, ``calibrate`` compares the
+two on the same bars, and ``overlay`` then replaces only the fields that
+agreed (a flag such as ``macd_cross`` also needs the values it is derived
+from to agree). Fields the analysis does not have are never added.
+"""
+from collections import deque
+import math
+
+import numpy as np
+
+from .batch import FIB_RATIOS, FIB_TOLERANCE
+from .store import times_to_epoch
+
+
+class EMA:
+    __slots__ = ("alpha", "value")
+
+    def __init__(self, span: int = None, alpha: float = None):
+        self.alpha = alpha if alpha is not None else 2.0 / (span + 1)
+        self.value = None
+
+    def peek(self, x: float) -> float:
+        if self.value is None:
+            return x
+        return self.alpha * x + (1 - self.alpha) * self.value
+
+    def push(self, x: float) -> float:
+        self.value = self.peek(x)
+        return self.value
+
+
+class WilderRSI:
+    def __init__(self, period: int = 14):
+        self.period = period
+        self.gain = EMA(alpha=1.0 / period)
+        self.loss = EMA(alpha=1.0 / period)
+        self.prev_close = None
+        self.changes = 0
+
+    @staticmethod
+    def _rsi(gain: float, loss: float) -> float:
+        if loss == 0:
+            return 50.0 if gain == 0 else 100.0
+        return 100 - 100 / (1 + gain / loss)
+
+    def peek(self, close: float):
+        if self.prev_close is None or self.changes + 1 < self.period:
+            return None
+        d = close - self.prev_close
+        return self._rsi(self.gain.peek(max(d, 0.0)), self.loss.peek(max(-d, 0.0)))
+
+    def push(self, close: float):
+        value = self.peek(close)
+        if self.prev_close is not None:
+            d = close - self.prev_close
+            self.gain.push(max(d, 0.0))
+            self.loss.push(max(-d, 0.0))
+            self.changes += 1
+        self.prev_close = close
+        return value
+
+
+class MACD:
+    def __init__(self, fast: int = 12, slow: int = 26, signal: int = 9):
+        self.fast = EMA(fast)
+        self.slow = EMA(slow)
+        self.signal = EMA(signal)
+        self.prev_hist = None
+
+    def peek(self, close: float):
+        line = self.fast.peek(close) - self.slow.peek(close)
+        sig = self.signal.peek(line)
+        return line, sig, line - sig
+
+    def push(self, close: float):
+        line, sig, hist = self.peek(close)
+        self.fast.push(close)
+        self.slow.push(close)
+        self.signal.push(line)
+        self.prev_hist = hist
+        return line, sig, hist
+
+
+class RollingExtremes:
+    """Highest high / lowest low over the last ``window`` bars (monotonic deques)."""
+
+    def __init__(self, window: int):
+        self.window = window
+        self.index = -1
+        self.highs = deque()   # (index, high), decreasing
+        self.lows = deque()    # (index, low), increasing
+
+    def _front(self, dq, index):
+        for i, v in dq:
+            if i > index - self.window:
+                return v
+        return None
+
+    def peek(self, high: float, low: float):
+        index = self.index + 1
+        hi = self._front(self.highs, index)
+        lo = self._front(self.lows, index)
+        return (high if hi is None else max(hi, high)), (low if lo is None else min(lo, low))
+
+    def push(self, high: float, low: float):
+        self.index += 1
+        while self.highs and self.highs[-1][1] <= high:
+            self.highs.pop()
+        self.highs.append((self.index, high))
+        while self.lows and self.lows[-1][1] >= low:
+            self.lows.pop()
+        self.lows.append((self.index, low))
+        limit = self.index - self.window
+        while self.highs[0][0] <= limit:
+            self.highs.popleft()
+        while self.lows[0][0] <= limit:
+            self.lows.popleft()
+        return self.highs[0][1], self.lows[0][1]
+
+
+# Streamed fields, as paths into the analysis, and the fields each one is derived from.
+STREAMED = {
+    ('rsi',): (),
+    ('macd', 'macd'): (),
+    ('macd', 'signal'): (),
+    ('macd', 'histogram'): (),
+    ('macd', 'macd_cross'): (('macd', 'histogram'),),
+    ('macd', 'direction'): (('macd', 'histogram'),),
+    ('fibonacci', 'high'): (),
+    ('fibonacci', 'low'): (),
+    ('fibonacci', 'at_level'): (('fibonacci', 'high'), ('fibonacci', 'low')),
+}
+# Relative tolerance for a streamed value to count as the analysis' own.
+CALIBRATION_RTOL = 1e-6
+
+
+def _lookup(d: dict, path: tuple):
+    for key in path:
+        if not isinstance(d, dict) or key not in d:
+            return None
+        d = d[key]
+    return d
+
+
+def _agrees(streamed, computed) -> bool:
+    if streamed is None or computed is None:
+        return False
+    if isinstance(streamed, (bool, str)) or isinstance(computed, (bool, str, np.bool_)):
+        return streamed == computed
+    try:
+        return math.isclose(float(streamed), float(computed), rel_tol=CALIBRATION_RTOL, abs_tol=1e-12)
+    except (TypeError, ValueError):
+        return False
+
+
+class IndicatorState:
+    """RSI, MACD and Fibonacci levels for one (symbol, range), advanced bar by bar."""
+
+    def __init__(self, window: int):
+        self.window = window
+        self.rsi = WilderRSI()
+        self.macd = MACD()
+        self.extremes = RollingExtremes(window)
+        self.last_time = None
+        self.latest = {}
+        self.matched = ()
+
+    def _push(self, close, high, low):
+        self.rsi.push(close)
+        self.macd.push(close)
+        self.extremes.push(high, low)
+
+    def update(self, rdata: dict) -> int:
+        """Advance by the bars of ``rdata`` newer than the last committed one.
+
+        All but the final bar are committed; the final one is evaluated with
+        ``peek``. Returns the number of newly committed bars, or -1 if the
+        history no longer extends the state and it was rebuilt.
+        """
+        times = times_to_epoch(rdata.get('Time', []))
+        closes = rdata['Close']
+        highs = rdata.get('High', closes)
+        lows = rdata.get('Low', closes)
+        n = len(times)
+        if n == 0:
+            return 0
+
+        rebuilt = False
+        start = 0
+        if self.last_time is not None:
+            start = int(np.searchsorted(times, self.last_time, side='right'))
+            if start == 0 or times[start - 1] != self.last_time:
+                # History was rewritten or the gap is older than the window.
+                matched = self.matched
+                self.__init__(self.window)
+                self.matched = matched
+                start, rebuilt = 0, True
+
+        for i in range(start, n - 1):
+            self._push(closes[i], highs[i], lows[i])
+        if n - 1 > start:
+            self.last_time = int(times[n - 2])
+
+        close = closes[-1]
+        rsi = self.rsi.peek(close)
+        line, sig, hist = self.macd.peek(close)
+        hi, lo = self.extremes.peek(highs[-1], lows[-1])
+        levels = {f"{r:.3f}": hi - (hi - lo) * r for r in FIB_RATIOS}
+        at_level = bool(close) and min(abs(v - close) for v in levels.values()) / abs(close) <= FIB_TOLERANCE
+        prev_hist = self.macd.prev_hist
+        self.latest = {
+            'rsi': rsi,
+            'macd': {
+                'macd': line,
+                'signal': sig,
+                'histogram': hist,
+                'macd_cross': prev_hist is not None and prev_hist <= 0 < hist,
+                'direction': 'up' if hist > 0 else ('down' if hist < 0 else 'flat'),
+            },
+            'fibonacci': {'high': hi, 'low': lo, 'at_level': at_level},
+        }
+        return -1 if rebuilt else max(0, n - 1 - start)
+
+    def calibrate(self, analysis: dict):
+        """Record which streamed fields agree with ``analysis``, computed from the same bars.
+
+        Call right after ``update`` with the bars ``analysis`` was computed on.
+        """
+        agreed = {path for path in STREAMED
+                  if _agrees(_lookup(self.latest, path), _lookup(analysis or {}, path))}
+        self.matched = tuple(path for path in STREAMED
+                             if path in agreed and all(dep in agreed for dep in STREAMED[path]))
+
+    def overlay(self, analysis: dict) -> dict:
+        """Copy of ``analysis`` with the fields found to agree by ``calibrate`` set to the streamed values."""
+        out = dict(analysis)
+        for path in self.matched:
+            value = _lookup(self.latest, path)
+            if value is None:
+                continue
+            if isinstance(value, np.generic):
+                value = value.item()
+            target = out
+            for key in path[:-1]:
+                inner = dict(target[key])
+                target[key] = inner
+                target = inner
+            target[path[-1]] = value
+        return out
@@ -0,0 +1,345 @@
+# server/training.py
+"""Background training, versioned model snapshots and batched inference.
+
+``TrainingManager`` wraps ``ml_model.trainer``, imported (with
+scikit-learn) the first time the model is used rather than at startup:
+
+* ``start`` runs training as a background job in the compute pool (one job
+  at a time) and records its stage, timings and result; ``/train_status``
+  reports it.
+* every successful fit is pickled to ``<root>/v0001.pkl``, ``v0002.pkl``, ...
+  and ``latest.json`` points at the newest one. At startup nothing is read;
+  the latest snapshot is loaded the first time the model is needed.
+* labels arriving through ``/label_trade`` refit the model incrementally
+  with ``trainer.partial_fit(symbol, date, outcome)`` when the trainer has
+  it, otherwise a full background refit is started once ``refit_every`` new
+  labels have piled up. Bulk labels (``add_labels``, e.g. generated by a
+  backtest) always go through a full refit.
+* ``predict_batch`` scores many analyses in one call, using
+  ``trainer.predict_batch`` (one feature matrix, one model call) when the
+  trainer has it. ``predict_columns`` scores rows given as arrays keyed by
+  analysis path (the backtest's per-bar signals) and hands them to
+  ``trainer.predict_columns`` without building a dict per row; trainers
+  without it get the rows as dicts, ``PREDICT_CHUNK`` at a time.
+* ``partial_fit``, ``predict_batch`` and ``predict_columns`` are optional
+  trainer methods, looked up when called. ``ml_model.trainer`` as shipped
+  defines none of them, so it still predicts one analysis per ``predict``
+  call and refits in full; ``/train_status`` reports which ones the loaded
+  trainer has (``incremental``, ``batched``, ``columnar``).
+* predictions, incremental fits, snapshots and the adoption of a new fit
+  hold a lock, so ``predict_batch`` threads never read a model while it
+  changes; full fits train a copy.
+* with several workers, labels go through the shared label log and
+  ``sync`` replays other workers' labels and adopts model versions they
+  saved. Each snapshot records the last label id it includes.
+"""
+import asyncio
+import itertools
+import json
+import os
+import pickle
+import threading
+import time
+from pathlib import Path
+
+import numpy as np
+
+from .store import _atomic_write_json
+
+MAX_JOBS = 20
+PREDICT_CHUNK = 4096
+
+
+class ModelRegistry:
+    """Trainer snapshots, one pickle per version."""
+
+    def __init__(self, root):
+        self.root = Path(root)
+        self.root.mkdir(parents=True, exist_ok=True)
+        self._pointer = self.root / "latest.json"
+        self._save_lock = threading.Lock()
+
+    def latest(self):
+        try:
+            with self._pointer.open("r") as f:
+                return json.load(f)
+        except (FileNotFoundError, ValueError):
+            return None
+
+    def versions(self) -> list:
+        return sorted(int(p.stem[1:]) for p in self.root.glob("v*.pkl") if p.stem[1:].isdigit())
+
+    def save(self, state: bytes, info: dict) -> int:
+        """Write a pickled trainer state as the next version."""
+        # Saves from concurrent fits would otherwise pick the same version.
+        with self._save_lock:
+            version = (self.versions() or [0])[-1] + 1
+            path = self.root / f"v{version:04d}.pkl"
+            tmp = path.with_suffix(".tmp")
+            with tmp.open("wb") as f:
+                f.write(state)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp, path)
+            _atomic_write_json(self._pointer, {"version": version, "saved_at": time.time(), **info})
+        return version
+
+    def load(self, trainer, version: int = None):
+        """Restore ``trainer`` from ``version`` (default: latest); returns the version or None."""
+        if version is None:
+            latest = self.latest()
+            if not latest:
+                return None
+            version = latest["version"]
+        with (self.root / f"v{version:04d}.pkl").open("rb") as f:
+            trainer.__dict__.update(pickle.load(f))
+        return version
+
+
+class TrainingManager:
+    def __init__(self, load_trainer, compute, registry: ModelRegistry, refit_every: int = 10,
+                 timeout: float = 600, shared=None):
+        """``load_trainer()`` returns the trainer; it is called on first use.
+        ``shared`` (``shared.py``) holds the label log."""
+        self._load_trainer = load_trainer
+        self._trainer = None
+        self.shared = shared
+        self._label_id = 0
+        self.compute = compute
+        self.registry = registry
+        self.refit_every = refit_every
+        self.timeout = timeout
+        self.version = None
+        self._loaded = False
+        self._ids = itertools.count(1)
+        self._jobs = {}
+        self._running = None
+        self.labels_since_fit = 0
+        # Held by threads that read or change the fitted model.
+        self._lock = threading.Lock()
+        # Called with the new version after every successful fit.
+        self.listeners = []
+
+    @property
+    def trainer(self):
+        if self._trainer is None:
+            self._trainer = self._load_trainer()
+        return self._trainer
+
+    # -- snapshots ---------------------------------------------------------
+
+    def ensure_loaded(self):
+        """Load the latest snapshot the first time the model is needed."""
+        if self._loaded:
+            return
+        self._loaded = True
+        try:
+            latest = self.registry.latest()
+            self.version = self.registry.load(self.trainer)
+            if self.version is not None:
+                self._label_id = (latest or {}).get("label_id", 0)
+                print(f"Loaded model snapshot v{self.version}")
+        except Exception as e:
+            print(f"Failed to load model snapshot: {e}")
+        self._replay_labels()
+
+    def _apply_labels(self, rows):
+        """Add logged (id, symbol, date, outcome) labels newer than the last one this trainer has."""
+        for label_id, symbol, date, outcome in rows:
+            if label_id <= self._label_id:
+                continue  # replayed meanwhile
+            self.trainer.add_label(symbol, date, outcome)
+            self._label_id = label_id
+
+    def _replay_labels(self):
+        """Add the labels logged since the last one this trainer has. Blocking."""
+        if self.shared is not None:
+            self._apply_labels(self.shared.labels_since(self._label_id))
+
+    async def _replay_labels_async(self):
+        """``_replay_labels`` with the label log read on a thread."""
+        if self.shared is not None:
+            self._apply_labels(await asyncio.to_thread(self.shared.labels_since, self._label_id))
+
+    def _adopt_version(self, latest: dict):
+        try:
+            self.version = self.registry.load(self.trainer, latest["version"])
+            self._label_id = latest.get("label_id", 0)
+            print(f"Adopted model snapshot v{self.version}")
+        except Exception as e:
+            print(f"Failed to load model snapshot v{latest.get('version')}: {e}")
+
+    async def sync(self):
+        """Adopt model versions and labels other workers wrote (no-op until the model is used)."""
+        if not self._loaded or self._running is not None:
+            return
+        latest = await asyncio.to_thread(self.registry.latest)
+        if latest and latest.get("version") != self.version:
+            await asyncio.to_thread(self._locked, self._adopt_version, latest)
+        await self._replay_labels_async()
+
+    def _locked(self, fn, *args):
+        with self._lock:
+            return fn(*args)
+
+    def _state(self) -> bytes:
+        return pickle.dumps(self.trainer.__dict__, protocol=pickle.HIGHEST_PROTOCOL)
+
+    def _adopt(self, trained, labels):
+        self.trainer.__dict__.update(trained.__dict__)
+        if labels is not None:
+            # The copy was trained on; keep labels that arrived meanwhile.
+            self.trainer.labels = labels
+
+    async def _fitted(self, info: dict, consumed: int):
+        state = await asyncio.to_thread(self._locked, self._state)
+        info = {**info, "label_id": self._label_id}
+        self.version = await asyncio.to_thread(self.registry.save, state, info)
+        self.labels_since_fit = max(0, self.labels_since_fit - consumed)
+        for listener in self.listeners:
+            try:
+                listener(self.version)
+            except Exception as e:
+                print(f"Model listener failed: {e}")
+
+    # -- jobs --------------------------------------------------------------
+
+    @property
+    def running(self):
+        """The job currently running, or None."""
+        return self._running
+
+    def job(self, job_id: int = None):
+        if job_id is None:
+            job_id = max(self._jobs, default=None)
+        return self._jobs.get(job_id)
+
+    def _set(self, job: dict, stage: str):
+        job["stage"] = stage
+        job["stages"].append((stage, time.time() - job["started_at"]))
+
+    async def _run(self, job: dict, snapshot):
+        try:
+            self.ensure_loaded()
+            self._set(job, "snapshot")
+            cache = await asyncio.to_thread(snapshot)
+            consumed = self.labels_since_fit
+            labels = getattr(self.trainer, "labels", None)
+            self._set(job, "training")
+            trained, result = await self.compute.train(self.trainer, cache, timeout=self.timeout)
+            await asyncio.to_thread(self._locked, self._adopt, trained, labels)
+            job["result"] = result
+            if (result or {}).get("status") == "success":
+                self._set(job, "saving")
+                await self._fitted({"job": job["id"], "metrics": result.get("metrics")}, consumed)
+                job["version"] = self.version
+            job["status"] = "done"
+        except Exception as e:
+            job["status"] = "failed"
+            job["error"] = str(e)
+            print(f"Training job {job['id']} failed: {e}")
+        finally:
+            job["finished_at"] = time.time()
+            self._set(job, job["status"])
+            self._running = None
+
+    def start(self, snapshot, reason: str = "manual") -> dict:
+        """Start a background fit on ``snapshot()`` (``ComputeExecutor.train``'s cache; called on a thread).
+
+        While a job is running it is returned instead of starting another.
+        """
+        if self._running is not None:
+            return self._running
+        job = {"id": next(self._ids), "reason": reason, "status": "running", "stage": "queued",
+               "stages": [], "started_at": time.time(), "finished_at": None,
+               "result": None, "version": None, "error": None}
+        self._jobs[job["id"]] = job
+        for old in sorted(self._jobs)[:-MAX_JOBS]:
+            del self._jobs[old]
+        self._running = job
+        asyncio.create_task(self._run(job, snapshot))
+        return job
+
+    async def add_label(self, symbol: str, date, outcome, snapshot):
+        """Record a label and refit: incrementally if the trainer can, else in the background."""
+        self.ensure_loaded()
+        if self.shared is not None:
+            # Logged first, then replayed in order with other workers' labels.
+            await asyncio.to_thread(self.shared.add_label, symbol, date, outcome)
+            await self._replay_labels_async()
+        else:
+            self.trainer.add_label(symbol, date, outcome)
+        self.labels_since_fit += 1
+        partial_fit = getattr(self.trainer, "partial_fit", None)
+        if partial_fit is not None:
+            try:
+                result = await asyncio.to_thread(self._locked, partial_fit, symbol, date, outcome)
+                if (result or {}).get("status", "success") == "success":
+                    await self._fitted({"partial_fit": symbol}, 1)
+                return
+            except Exception as e:
+                print(f"Incremental refit failed, falling back to a full one: {e}")
+        if self.labels_since_fit >= self.refit_every:
+            self.start(snapshot, reason="labels")
+
+    async def add_labels(self, labels: list, snapshot):
+        """Record many (symbol, date, outcome) labels; returns the refit job started, if any."""
+        self.ensure_loaded()
+        if not labels:
+            return None
+        if self.shared is not None:
+            await asyncio.to_thread(self.shared.add_labels, labels)
+            await self._replay_labels_async()
+        else:
+            for symbol, date, outcome in labels:
+                self.trainer.add_label(symbol, date, outcome)
+        self.labels_since_fit += len(labels)
+        if self.labels_since_fit >= self.refit_every:
+            return self.start(snapshot, reason="labels")
+        return None
+
+    # -- inference ---------------------------------------------------------
+
+    def predict_batch(self, analyses: list) -> list:
+        """Predictions for many analysis dicts (blocking; run it on a thread)."""
+        self.ensure_loaded()
+        with self._lock:
+            batch = getattr(self.trainer, "predict_batch", None)
+            if batch is not None:
+                return list(batch(analyses))
+            return [self.trainer.predict(a) for a in analyses]
+
+    def predict_columns(self, columns: dict, analyses) -> np.ndarray:
+        """P(good) for every row of ``columns`` ({analysis path: 1-D array}), 0.5 without a model. Blocking.
+
+        ``trainer.predict_columns(columns)`` builds its feature matrix straight
+        from the arrays and returns the probabilities, or None without a model.
+        Other trainers get ``analyses(start, stop)``, the rows as analysis dicts.
+        """
+        n = len(next(iter(columns.values()), ()))
+        self.ensure_loaded()
+        with self._lock:
+            vectorized = getattr(self.trainer, "predict_columns", None)
+            if vectorized is not None:
+                prob = vectorized(columns)
+                return np.full(n, 0.5) if prob is None else np.asarray(prob, dtype=float)
+        out = np.full(n, 0.5)
+        for start in range(0, n, PREDICT_CHUNK):
+            stop = min(n, start + PREDICT_CHUNK)
+            out[start:stop] = [p.get("probability_good", 0.5) if p.get("model_available") else 0.5
+                               for p in self.predict_batch(analyses(start, stop))]
+        return out
+
+    def status(self) -> dict:
+        return {
+            "version": self.version,
+            "versions": self.registry.versions(),
+            "labels_since_fit": self.labels_since_fit,
+            "label_id": self._label_id,
+            "refit_every": self.refit_every,
+            "incremental": hasattr(self.trainer, "partial_fit"),
+            "batched": hasattr(self.trainer, "predict_batch"),
+            "columnar": hasattr(self.trainer, "predict_columns"),
+            "running": self._running,
+            "last_job": self.job(),
+        }
@@ -1,4 +1,4 @@
-import { getData, setCurrentRange, setCurrentSymbol, setCurrentExchange, currentRange as rangeRef, currentSymbol as symbolRef, currentExchange as exchangeRef, getAnalyzerSettings, setAnalyzerSettings } from "./data.js";
+import { getData, loadWorkspace, takePrefetched, onLive, isLive, setScanSubscription, setCurrentRange, setCurrentSymbol, setCurrentExchange, currentRange as rangeRef, currentSymbol as symbolRef, currentExchange as exchangeRef, getAnalyzerSettings, setAnalyzerSettings } from "./data.js";
 import { calculateSMA, calculateEMA, calculateRSI, calculateBB, calculateMACD } from "./indicators.js";
 
 let chartInitialized = false;
@@ -264,9 +264,12 @@ export async function plotChart() {
 
     try {
         const settings = getAnalyzerSettings();
-        const anaRes = await fetch(`/analyze_cached?symbol=${symbolRef}&exchange=${exchangeRef}&range=${rangeRef}&rsi=${settings.rsi}&macd=${settings.macd}&fib=${settings.fib}&patterns=${settings.patterns}`);
-        if (anaRes.ok) {
-            const anaJson = await anaRes.json();
+        let anaJson = takePrefetched('analysis', symbolRef, rangeRef);
+        if (!anaJson) {
+            const anaRes = await fetch(`/analyze_cached?symbol=${symbolRef}&exchange=${exchangeRef}&range=${rangeRef}&rsi=${settings.rsi}&macd=${settings.macd}&fib=${settings.fib}&patterns=${settings.patterns}`);
+            anaJson = anaRes.ok ? await anaRes.json() : null;
+        }
+        if (anaJson) {
             const analysis = anaJson.analysis || anaJson;
             if (analysis) {
                 // update status with score/patterns
@@ -430,7 +433,17 @@ document.getElementById("downloadJSON").addEventListener("click", async () => {
     }
 });
 
-setInterval(plotChart, 10000);
+// Replot when the server pushes bars or analysis; poll only while the live
+// stream is down.
+let _replotTimer = null;
+function scheduleReplot() {
+    clearTimeout(_replotTimer);
+    _replotTimer = setTimeout(plotChart, 250);
+}
+onLive('bars', scheduleReplot);
+onLive('analysis', scheduleReplot);
+onLive('resync', scheduleReplot);
+setInterval(() => { if (!isLive()) plotChart(); }, 10000);
 try {
     const symEl = document.getElementById('symbolSelect');
     const exEl = document.getElementById('exchangeSelect');
@@ -443,7 +456,16 @@ try {
     console.warn('Could not create initial tab:', e);
 }
 
-plotChart();
+// Load every tab's symbol in one /bulk request; the chart is drawn as soon
+// as its own data and analysis have streamed in.
+(function loadInitialWorkspace() {
+    let plotted = false;
+    const plotOnce = () => { if (!plotted) { plotted = true; plotChart(); } };
+    const symbols = [...new Set(Object.values(tabLayouts).map(t => t.symbol))];
+    loadWorkspace(symbols, [rangeRef], ['data', 'analysis'], (part) => {
+        if (part.kind === 'analysis' && part.symbol === symbolRef && part.range === rangeRef) plotOnce();
+    }).catch(e => console.warn('Workspace load failed:', e)).finally(plotOnce);
+})();
 
 (function(){
     const splitter = document.getElementById('splitter');
@@ -488,7 +510,16 @@ plotChart();
     window.addEventListener('touchmove', (e) => { if (e.touches && e.touches[0]) onMove(e.touches[0].clientX); }, {passive:false});
     window.addEventListener('touchend', onUp);
 })();
+let _scanReloadTimer = null;
+onLive('scan', () => {
+    const view = document.getElementById('scannerView');
+    if (!view || view.style.display === 'none') return;
+    clearTimeout(_scanReloadTimer);
+    _scanReloadTimer = setTimeout(() => loadScannerResults(document.getElementById('scannerRangeSelect').value), 1000);
+});
+
 async function loadScannerResults(range = "1d") {
+    setScanSubscription(range);
     const settings = getAnalyzerSettings();
     const loading = document.getElementById('scannerLoading');
     const resultsDiv = document.getElementById('scannerResults');
@@ -707,7 +738,14 @@ async function trainMLModel() {
     
     try {
         const res = await fetch('/train_model', { method: 'POST' });
-        const json = await res.json();
+        let job = (await res.json()).job;
+        // Training runs in the background; poll until the job finishes.
+        while (job.status === 'running') {
+            status.textContent = `Training (${job.stage})...`;
+            await new Promise(resolve => setTimeout(resolve, 1000));
+            job = await (await fetch(`/train_status?job=${job.id}`)).json();
+        }
+        const json = job.status === 'done' ? job.result : { status: 'failed' };
         
         if (json.status === 'success') {
             status.textContent = '✓ Trained';
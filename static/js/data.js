@@ -31,24 +31,188 @@ export function setCurrentExchange(exchange) {
     currentExchange = exchange.toUpperCase();
 }
 
+// Last /data payload per query, revalidated with If-None-Match and
+// extended with only the bars from the last one we hold (since=).
+const _dataCache = new Map();
+const OHLCV_MEDIA_TYPE = 'application/x-ohlcv';
+
+function _cacheKey(symbol, exchange, range) {
+    return new URLSearchParams({ symbol, exchange, range, format: 'binary' }).toString();
+}
+
+function _epochToTime(t) {
+    return new Date(t * 1000).toISOString().slice(0, 19).replace('T', ' ');
+}
+
+// Decode the compact layout served by /data?format=binary (see server/encoding.py).
+function decodeOhlcv(buf) {
+    const view = new DataView(buf);
+    const headLen = view.getUint32(4, true);
+    const header = JSON.parse(new TextDecoder().decode(new Uint8Array(buf, 8, headLen)));
+    const n = header.n;
+    let offset = 8 + headLen;
+    const epoch = Array.from(new BigInt64Array(buf, offset, n), Number);
+    offset += n * 8;
+    const payload = { _epoch: epoch, Time: epoch.map(_epochToTime), _meta: header.meta };
+    header.columns.forEach(name => {
+        const col = new Float32Array(buf, offset, n);
+        payload[name] = Array.from(col, v => Number.isNaN(v) ? null : Number(v.toPrecision(7)));
+        offset += n * 4;
+    });
+    return payload;
+}
+
+// Replace the bars from `tail` onwards and keep at most `total` bars.
+function mergeTail(prev, tail, total) {
+    const since = tail._epoch.length ? tail._epoch[0] : Infinity;
+    let keep = prev._epoch.findIndex(t => t >= since);
+    if (keep < 0) keep = prev._epoch.length;
+    const merged = { _meta: tail._meta };
+    Object.keys(tail).forEach(name => {
+        if (name === '_meta') return;
+        const combined = (prev[name] || []).slice(0, keep).concat(tail[name]);
+        merged[name] = combined.slice(Math.max(0, combined.length - total));
+    });
+    return merged;
+}
+
+// Parts of a /bulk workspace load (see server/bulk.py), keyed by
+// kind|symbol|range. Each one answers the first request it can save, if
+// that comes within PREFETCH_TTL_MS.
+const _prefetched = new Map();
+const PREFETCH_TTL_MS = 30000;
+
+function _partKey(kind, symbol, range) {
+    return `${kind}|${symbol}|${range}`;
+}
+
+export function takePrefetched(kind, symbol, range) {
+    const key = _partKey(kind, symbol, range);
+    const hit = _prefetched.get(key);
+    _prefetched.delete(key);
+    return hit && Date.now() - hit.at < PREFETCH_TTL_MS ? hit.part : undefined;
+}
+
+// Data and analyses of many symbols and ranges in one request. Parts are
+// newline-delimited JSON, handed to onPart as they stream in.
+export async function loadWorkspace(symbols, ranges, include = ['data', 'analysis'], onPart = null) {
+    const res = await fetch('/bulk', {
+        method: 'POST',
+        headers: { 'Content-Type': 'application/json' },
+        body: JSON.stringify({ symbols, ranges, include, exchange: currentExchange, ...getAnalyzerSettings() }),
+    });
+    if (!res.ok || !res.body) return;
+    const handle = (line) => {
+        if (!line.trim()) return;
+        const part = JSON.parse(line);
+        if (part.range) _prefetched.set(_partKey(part.kind, part.symbol, part.range), { part, at: Date.now() });
+        if (onPart) onPart(part);
+    };
+    const reader = res.body.getReader();
+    const decoder = new TextDecoder();
+    let buffered = '';
+    for (;;) {
+        const { done, value } = await reader.read();
+        if (done) break;
+        buffered += decoder.decode(value, { stream: true });
+        const lines = buffered.split('\n');
+        buffered = lines.pop();
+        lines.forEach(handle);
+    }
+    handle(buffered);
+}
+
+// Live updates over /stream (server-sent events). While the stream for the
+// current symbol/range is open, pushed bars are merged into _dataCache and
+// getData() answers from it without a request.
+let _live = null;
+let _scanRange = null;
+const _liveListeners = { bars: [], analysis: [], scan: [], resync: [] };
+
+export function onLive(event, cb) {
+    _liveListeners[event].push(cb);
+}
+
+export function isLive() {
+    return !!(_live && _live.open);
+}
+
+export function setScanSubscription(range) {
+    if (_scanRange === range) return;
+    _scanRange = range;
+    connectLive();
+}
+
+export function connectLive() {
+    if (typeof EventSource === 'undefined') return;
+    const params = new URLSearchParams({ symbol: currentSymbol, range: currentRange });
+    if (_scanRange) params.set('scan', _scanRange);
+    const url = '/stream?' + params.toString();
+    if (_live && _live.url === url) return;
+    if (_live) _live.es.close();
+
+    const es = new EventSource(url);
+    const live = { es, url, key: _cacheKey(currentSymbol, currentExchange, currentRange), open: false };
+    es.onopen = () => { live.open = true; };
+    es.onerror = () => { live.open = false; };
+    es.addEventListener('bars', (ev) => {
+        const msg = JSON.parse(ev.data);
+        const cached = _dataCache.get(live.key);
+        if (cached) {
+            const bars = msg.bars;
+            const tail = { ...bars, _epoch: bars.Time, Time: bars.Time.map(_epochToTime) };
+            const meta = cached.payload._meta || {};
+            cached.payload = mergeTail(cached.payload, tail, msg.total);
+            cached.payload._meta = { ...meta, last_updated: msg.last_updated };
+        }
+        _liveListeners.bars.forEach(cb => cb(msg));
+    });
+    ['analysis', 'scan'].forEach(name => es.addEventListener(name, (ev) => {
+        const msg = JSON.parse(ev.data);
+        _liveListeners[name].forEach(cb => cb(msg));
+    }));
+    es.addEventListener('resync', () => {
+        _dataCache.delete(live.key);
+        _liveListeners.resync.forEach(cb => cb());
+    });
+    _live = live;
+}
+
 export async function getData() {
     const loading = document.getElementById('loadingIndicator');
     const progress = document.getElementById('fetchProgress');
     if (loading) loading.style.display = 'inline-flex';
     if (progress) progress.style.display = 'block';
     try {
-        const params = new URLSearchParams({
-            symbol: currentSymbol,
-            exchange: currentExchange,
-            range: currentRange
-        });
-        const res = await fetch('/data?' + params.toString());
-        const data = await res.json();
-        if (data.error) return { Time: [], Open: [], High: [], Low: [], Close: [], Volume: [], _meta: { status: 'error', message: data.error } };
-
-        // server returns { <range>: {...}, meta: {...} }
-        const payload = data[currentRange] || { Time: [], Open: [], High: [], Low: [], Close: [], Volume: [] };
-        if (data.meta) payload._meta = data.meta;
+        const key = _cacheKey(currentSymbol, currentExchange, currentRange);
+        const params = new URLSearchParams(key);
+        const cached = _dataCache.get(key);
+        connectLive();
+        if (cached && isLive() && _live.key === key) return cached.payload;
+        const part = takePrefetched('data', currentSymbol, currentRange);
+        if (part && !cached) return { ...part.data, _meta: part.meta };
+        const headers = { Accept: OHLCV_MEDIA_TYPE };
+        if (cached) {
+            headers['If-None-Match'] = cached.etag;
+            params.set('since', cached.payload._epoch[cached.payload._epoch.length - 1]);
+        }
+        const res = await fetch('/data?' + params.toString(), { headers, cache: 'no-store' });
+        if (res.status === 304 && cached) return cached.payload;
+
+        let payload;
+        if ((res.headers.get('Content-Type') || '').startsWith(OHLCV_MEDIA_TYPE)) {
+            const tail = decodeOhlcv(await res.arrayBuffer());
+            payload = cached ? mergeTail(cached.payload, tail, tail._meta.total) : tail;
+        } else {
+            const data = await res.json();
+            if (data.error) return { Time: [], Open: [], High: [], Low: [], Close: [], Volume: [], _meta: { status: 'error', message: data.error } };
+            // server returns { <range>: {...}, meta: {...} } or a loading status
+            payload = data[currentRange] || { Time: [], Open: [], High: [], Low: [], Close: [], Volume: [] };
+            if (data.meta) payload._meta = data.meta;
+            return payload;
+        }
+        const etag = res.headers.get('ETag');
+        if (etag && payload._epoch.length) _dataCache.set(key, { etag, payload });
         return payload;
     } catch (e) {
         console.error("Data fetch error:", e);
@@ -0,0 +1,12 @@
+# tests/conftest.py
+import os
+import sys
+import tempfile
+from pathlib import Path
+
+# Importing ``server`` creates its cache and picks its sources from the
+# environment: keep it in a scratch directory, single process, no pool.
+os.environ.setdefault("SNAP_USER_COMMON", tempfile.mkdtemp(prefix="tv-plots-tests-"))
+os.environ.setdefault("TV_SHARED_STATE", "local")
+os.environ.setdefault("COMPUTE_WORKERS", "0")
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
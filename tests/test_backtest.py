@@ -0,0 +1,91 @@
+# tests/test_backtest.py
+"""The backtest must score every bar as the scanner scores the cached analysis.
+
+``signals`` computes the indicators of every bar at once; the scanner scores
+``analyze_dataframe``'s output with ``routes.filter_analysis``. These tests
+rebuild each bar's analysis with ``step_analyses`` and score it the
+scanner's way, and, where the analysis module is installed, compare the
+indicators with ``analyze_dataframe`` on the same window.
+"""
+import itertools
+
+import numpy as np
+import pytest
+
+from server import backtest
+from server.batch import stack
+from server.routes import filter_analysis
+from server.store import TIME_COLUMN
+
+WINDOW = 30
+ANALYSIS_KEYS = {"rsi", "macd", "fibonacci", "patterns", "trend", "score"}
+
+
+def _universe(n: int = 4, length: int = 120, seed: int = 0) -> dict:
+    """Stacked columns of ``n`` symbols, the later ones with shorter histories."""
+    rng = np.random.default_rng(seed)
+    rows = []
+    for i in range(n):
+        size = length - 15 * i
+        close = 100 * np.exp(np.cumsum(rng.normal(0, 0.02, size)))
+        rows.append({
+            TIME_COLUMN: 1_700_000_000 + 86400 * np.arange(size),
+            "Open": close * (1 + rng.normal(0, 0.005, size)),
+            "High": close * 1.01, "Low": close * 0.99, "Close": close,
+            "Volume": np.full(size, 1000.0),
+        })
+    return {f: stack([r[f] for r in rows], length) for f in rows[0]}
+
+
+def _patterns(close: np.ndarray, seed: int = 1) -> np.ndarray:
+    rng = np.random.default_rng(seed)
+    out = np.full(close.shape, None, dtype=object)
+    for r, t in zip(*np.nonzero(backtest.valid_bars(close, WINDOW))):
+        out[r, t] = ["doji"] if rng.random() < 0.3 else []
+    return out
+
+
+@pytest.mark.parametrize("toggles", list(itertools.product((True, False), repeat=3)))
+@pytest.mark.parametrize("with_patterns", (True, False))
+def test_scores_match_filter_analysis(toggles, with_patterns):
+    cols = _universe()
+    patterns = _patterns(cols["Close"]) if with_patterns else None
+    res = backtest.signals(cols, WINDOW, *toggles, patterns=patterns)
+    rows, bars = np.nonzero(res["valid"])
+    assert len(rows)
+    columns = backtest.step_columns(res, rows, bars, toggles)
+    analyses = backtest.step_analyses(columns, 0, len(rows))
+    expected = [filter_analysis(a, *toggles, with_patterns)["score"] for a in analyses]
+    assert res["score"][rows, bars] == pytest.approx(expected)
+
+
+def test_model_gets_only_analysis_fields():
+    cols = _universe()
+    res = backtest.signals(cols, WINDOW, patterns=_patterns(cols["Close"]))
+    rows, bars = np.nonzero(res["valid"])
+    full = backtest.step_analyses(backtest.step_columns(res, rows, bars), 0, 5)
+    assert all(set(a) == ANALYSIS_KEYS for a in full)
+    assert set(full[0]["macd"]) == {"macd_cross", "direction"}
+    assert set(full[0]["fibonacci"]) == {"at_level"}
+
+    res = backtest.signals(cols, WINDOW, macd_on=False)
+    partial = backtest.step_analyses(backtest.step_columns(res, rows, bars, (True, False, False)), 0, 5)
+    assert all(set(a) == {"rsi", "trend", "score"} for a in partial)
+
+
+def test_signals_match_analyze_dataframe():
+    analyze = pytest.importorskip("server.analyze")
+    cols = _universe(n=2)
+    patterns = backtest.pattern_lists(cols, WINDOW, "1m")
+    res = backtest.signals(cols, WINDOW, patterns=patterns)
+    rows, bars = np.nonzero(res["valid"])
+    analyses = backtest.step_analyses(backtest.step_columns(res, rows, bars), 0, len(rows))
+    for (r, t), got in list(zip(zip(rows, bars), analyses))[::7]:
+        window = {f: v[r, t - WINDOW + 1:t + 1] for f, v in cols.items()}
+        window[TIME_COLUMN] = window[TIME_COLUMN].astype(np.int64).astype("datetime64[s]")
+        want = analyze.analyze_dataframe(window, "1m")
+        assert got["rsi"] == pytest.approx(want["rsi"], rel=1e-6), (r, t)
+        assert got["macd"]["macd_cross"] == bool(want["macd"]["macd_cross"]), (r, t)
+        assert got["fibonacci"]["at_level"] == bool(want["fibonacci"]["at_level"]), (r, t)
+        assert got["trend"] == want["trend"], (r, t)
+        assert got["score"] == pytest.approx(filter_analysis(want, True, True, True, True)["score"]), (r, t)
@@ -0,0 +1,139 @@
+# tests/test_cache.py
+"""``BarCache`` tiers: which hot entries ``enforce`` demotes, in what order,
+and that a cold entry reads back the bars it had on the heap.
+
+The cache's clock is replaced by ``Clock`` so request times are exact.
+"""
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+from server import cache as cache_module
+from server.cache import COLD_FIELDS, BarCache, entry_bytes
+from server.store import BarStore
+
+WINDOWS = {"1w": 7, "2y": 730}
+
+
+class Clock:
+    def __init__(self, now: float = 1000.0):
+        self.now = now
+
+    def __call__(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(cache_module, "time", SimpleNamespace(time=clock))
+    return clock
+
+
+def _entry(n: int = 730, seed: int = 0) -> dict:
+    """A hot entry: ``2y`` columns and ``1w`` as views of their tail."""
+    rng = np.random.default_rng(seed)
+    close = 100 + np.cumsum(rng.normal(0, 1, n))
+    cols = {"Time": 1_600_000_000 + 86400 * np.arange(n, dtype=np.int64), "Open": close - 0.5, "High": close + 1,
+            "Low": close - 1, "Close": close, "Volume": np.full(n, 1000.0)}
+    return {
+        "data": {"1w": {k: v[-7:] for k, v in cols.items()}, "2y": cols},
+        "exchange": "CSEMA", "last_updated": 1.0, "status": "ok",
+        "analysis": {"2y": {"score": 2}}, "analysis_last_updated": {"2y": 1.0},
+        "indicators": {"2y": object()},
+    }
+
+
+def _cache(tmp_path, symbols, max_bytes: float = float("inf"), ttl: float = 3600) -> BarCache:
+    cache = BarCache(BarStore(tmp_path / "bars"), WINDOWS, max_bytes=max_bytes, ttl=ttl)
+    for i, symbol in enumerate(symbols):
+        cache[symbol] = _entry(seed=i)
+    return cache
+
+
+def _demoted(cache: BarCache) -> list:
+    order = []
+    cache.on_demote.append(order.append)
+    return order
+
+
+def test_views_are_counted_once():
+    entry = _entry()
+    assert entry_bytes(entry) == 6 * 730 * 8
+    assert entry_bytes({"data": {"2y": entry["data"]["2y"]}}) == entry_bytes(entry)
+
+
+def test_ttl_demotes_idle_entries(tmp_path, clock):
+    cache = _cache(tmp_path, ["A", "B", "C"], ttl=100)
+    order = _demoted(cache)
+    clock.now += 50
+    cache.touch("B")
+    cache.enforce(now=clock.now + 60)
+    assert order == ["A", "C"]
+    assert cache.hot_symbols() == ["B"]
+    assert cache.stats["demoted_ttl"] == 2 and cache.stats["demoted_lru"] == 0
+
+
+def test_lru_demotes_least_recently_requested_first(tmp_path, clock):
+    size = entry_bytes(_entry())
+    cache = _cache(tmp_path, ["A", "B", "C", "D"], max_bytes=2 * size)
+    order = _demoted(cache)
+    for symbol in ("C", "A", "D", "B"):
+        clock.now += 1
+        cache.touch(symbol)
+    cache.enforce(now=clock.now)
+    assert order == ["C", "A"]
+    assert cache.hot_symbols() == ["D", "B"]
+
+    cache.max_bytes = size
+    clock.now += 1
+    cache.touch("D")
+    cache.enforce(now=clock.now)
+    assert order == ["C", "A", "B"]
+    assert cache.stats["demoted_lru"] == 3
+
+
+def test_cold_entry_reads_back_from_the_store(tmp_path, clock):
+    hot = _entry()
+    cache = _cache(tmp_path, ["A"], ttl=10)
+    cache.enforce(now=clock.now + 11)
+    cold = cache["A"]
+    assert cache.is_cold(cold)
+    assert set(cold) - {"data"} <= set(COLD_FIELDS)
+    assert cold["analysis"] == hot["analysis"]
+    assert entry_bytes(cold) == 0
+    for label, window in WINDOWS.items():
+        bars = cold["data"][label]
+        assert isinstance(bars["Close"], np.memmap)
+        assert len(bars["Time"]) == window
+        for name, values in hot["data"][label].items():
+            np.testing.assert_array_equal(bars[name], values)
+    # Already cold: nothing to demote again.
+    assert not cache.demote("A")
+
+
+def test_touch_promotes_cold_entries(tmp_path, clock):
+    cache = _cache(tmp_path, ["A", "B"], ttl=10)
+    promoted = []
+    cache.on_promote.append(promoted.append)
+    cache.enforce(now=clock.now + 11)
+    cache.touch("B")
+    cache.touch("unknown")
+    assert promoted == ["B"]
+    assert cache.stats["promoted"] == 1
+    assert list(cache) == ["A", "B"]
+
+
+def test_usage_reports_tiers(tmp_path, clock):
+    size = entry_bytes(_entry())
+    cache = _cache(tmp_path, ["A", "B", "C"], max_bytes=2 * size)
+    clock.now += 5
+    cache.touch("B")
+    cache.touch("C")
+    cache.enforce(now=clock.now)
+    usage = cache.usage()
+    assert (usage["hot"], usage["cold"], usage["hot_bytes"]) == (2, 1, 2 * size)
+    assert usage["symbols"]["A"] == {"tier": "cold", "bytes": 0, "idle": 5.0}
+    assert usage["symbols"]["B"] == {"tier": "hot", "bytes": size, "idle": 0.0}
+    assert usage["demoted_lru"] == 1 and usage["max_bytes"] == 2 * size
@@ -0,0 +1,98 @@
+# tests/test_correlation.py
+"""The incremental correlation sums must match ``DataFrame.corr`` on the same returns.
+
+Each symbol trades on its own subset of a shared time grid, so the return
+columns are misaligned. The reference joins every symbol's returns on
+their timestamps, keeps the newest ``window`` of them, and takes the
+pairwise-complete Pearson correlation pandas computes.
+"""
+import numpy as np
+import pandas as pd
+import pytest
+
+from server.correlation import CorrelationEngine
+
+WINDOW = 60
+MIN_PERIODS = 5
+
+
+def _history(seed: int, symbols: int = 5, grid: int = 120) -> dict:
+    """Close series of ``symbols`` on random subsets of ``grid`` bar times."""
+    rng = np.random.default_rng(seed)
+    times = 1_700_000_000 + 1800 * np.arange(grid)
+    common = rng.normal(0, 0.01, grid)
+    out = {}
+    for i in range(symbols):
+        keep = np.sort(rng.choice(grid, size=int(grid * rng.uniform(0.6, 0.95)), replace=False))
+        ret = 0.5 * common + rng.normal(0, 0.01, grid)
+        out[f"S{i}"] = (times[keep], 100 * np.exp(np.cumsum(ret[keep])))
+    return out
+
+
+def _cache(history: dict, end: int, stamp: float, revise: float = 0.0) -> dict:
+    """Entries with each symbol's bars before grid time ``end``; ``revise`` moves the last close."""
+    cache = {}
+    for symbol, (times, close) in history.items():
+        n = int(np.searchsorted(times, end))
+        close = close[:n].copy()
+        close[-1] *= 1 + revise
+        cache[symbol] = {"data": {"1d": {"Time": times[:n], "Close": close}}, "last_updated": stamp}
+    return cache
+
+
+def _reference(cache: dict, applied: dict) -> pd.DataFrame:
+    """``DataFrame.corr`` of every return applied so far, newest ``WINDOW`` timestamps."""
+    for symbol, entry in cache.items():
+        bars = entry["data"]["1d"]
+        ret = pd.Series(bars["Close"][1:] / bars["Close"][:-1] - 1.0, index=bars["Time"][1:])
+        # Returns already applied and no longer in the cached bars stay in the grid.
+        applied[symbol] = ret.combine_first(applied.get(symbol, pd.Series(dtype=float)))
+    frame = pd.DataFrame(applied).sort_index().tail(WINDOW)
+    return frame.corr(min_periods=MIN_PERIODS)
+
+
+def _assert_matches(engine: CorrelationEngine, want: pd.DataFrame):
+    got = engine.matrix(list(want.columns))
+    for a in want.columns:
+        for b in want.columns:
+            if np.isnan(want.loc[b, a]):
+                assert got[a][b] is None, (a, b)
+            else:
+                assert got[a][b] == pytest.approx(want.loc[b, a], abs=1e-9), (a, b)
+
+
+@pytest.mark.parametrize("rebuild_every", (500, 1))
+def test_matches_dataframe_corr_before_and_after_update(rebuild_every):
+    history = _history(seed=rebuild_every)
+    grid = 1_700_000_000 + 1800 * np.arange(120)
+    engine = CorrelationEngine(WINDOW, min_periods=MIN_PERIODS, rebuild_every=rebuild_every)
+    applied = {}
+
+    cache = _cache(history, grid[80], stamp=1.0)
+    engine.sync(cache, "1d")
+    _assert_matches(engine, _reference(cache, applied))
+
+    # Same bars, new stamp, revised forming bar: only the tail is replaced.
+    cache = _cache(history, grid[80], stamp=2.0, revise=0.01)
+    engine.sync(cache, "1d")
+    _assert_matches(engine, _reference(cache, applied))
+
+    # New bars push the oldest timestamps out of the window.
+    cache = _cache(history, grid[110], stamp=3.0)
+    engine.sync(cache, "1d")
+    assert len(engine.row_of) == WINDOW
+    _assert_matches(engine, _reference(cache, applied))
+
+
+def test_dropped_symbol_leaves_the_sums():
+    history = _history(seed=7)
+    engine = CorrelationEngine(WINDOW, min_periods=MIN_PERIODS)
+    cache = _cache(history, 1_700_000_000 + 1800 * 100, stamp=1.0)
+    engine.sync(cache, "1d")
+    applied = {}
+    want = _reference(cache, applied)
+
+    del cache["S0"]
+    engine.sync(cache, "1d")
+    assert "S0" not in engine.col_of
+    _assert_matches(engine, want.drop(index="S0", columns="S0"))
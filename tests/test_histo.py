@@ -0,0 +1,159 @@
+# tests/test_histo.py
+"""Incremental fetch: gap sizing, merging into the cached window, and the
+refresh of a symbol when one interval group fails.
+
+The stub source serves bars on a fixed grid ending at the current bar, with
+``Close`` equal to the bar's epoch plus ``bump``, so a re-fetched bar is
+told apart from the cached one.
+"""
+import asyncio
+import calendar
+import time
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import server
+from server.histo import (
+    FetchEngine, Interval, RANGE_CONFIG, _group_ranges, _merge, _missing_bars, _normalize, interval_seconds,
+)
+
+STEP = interval_seconds(Interval.in_30_minute)
+DAILY = [label for label, cfg in RANGE_CONFIG.items() if cfg["interval"] is Interval.in_daily]
+# Bar times are naive local times stored as if UTC. Read once, so a bar
+# boundary passing mid-test does not move the stub's grid.
+CLOCK = calendar.timegm(time.localtime())
+
+
+def _now(step: int) -> int:
+    """The open of the bar in progress at ``CLOCK``."""
+    return CLOCK - CLOCK % step
+
+
+def _frame(times, bump: float = 0.0) -> pd.DataFrame:
+    """A ``get_hist`` frame: indexed by ``datetime``, lowercase OHLCV."""
+    close = np.asarray(times, dtype=float) + bump
+    return pd.DataFrame({
+        "open": close, "high": close + 1, "low": close - 1, "close": close,
+        "volume": np.full(len(close), 10.0),
+    }, index=pd.Index(pd.to_datetime(np.asarray(times, dtype=np.int64), unit="s"), name="datetime"))
+
+
+def _columns(times) -> dict:
+    times = np.asarray(times, dtype=np.int64)
+    close = times.astype(float)
+    return {"Time": times, "Open": close, "High": close + 1, "Low": close - 1, "Close": close,
+            "Volume": np.full(len(times), 10.0)}
+
+
+class StubSource:
+    """``session()`` returns itself; ``fail`` holds the intervals whose calls raise."""
+
+    def __init__(self, fail=(), bump: float = 0.0):
+        self.fail = set(fail)
+        self.bump = bump
+        self.calls = []
+
+    def session(self):
+        return self
+
+    def get_hist(self, symbol, exchange, interval, n_bars):
+        self.calls.append((interval, n_bars))
+        if interval in self.fail:
+            raise ConnectionError(f"{interval.name} unavailable")
+        step = interval_seconds(interval)
+        end = _now(step)
+        return _frame(end - step * np.arange(n_bars)[::-1], self.bump)
+
+
+def _engine(source) -> FetchEngine:
+    return FetchEngine(source=source, retries=1, rate=1000.0, burst=100)
+
+
+def test_missing_bars_without_cache_fetches_the_window():
+    assert _missing_bars(None, Interval.in_30_minute, 24) == 24
+    assert _missing_bars({"Time": np.empty(0, dtype=np.int64)}, Interval.in_30_minute, 24) == 24
+    assert _missing_bars(_columns([0]), Interval.in_monthly, 24) == 24
+
+
+def test_missing_bars_counts_the_gap():
+    last = _now(STEP) - 3 * STEP
+    # Three bars since the last cached one, plus it and the forming bar.
+    assert _missing_bars(_columns([last - STEP, last]), Interval.in_30_minute, 24) == 5
+    assert _missing_bars(_columns([last - 100 * STEP]), Interval.in_30_minute, 24) == 24
+    # A last bar in the future (clock skew) still re-fetches it.
+    assert _missing_bars(_columns([_now(STEP) + 5 * STEP]), Interval.in_30_minute, 24) == 2
+
+
+def test_merge_replaces_overlap_and_trims():
+    previous = _columns(1000 * np.arange(5))
+    merged = _merge(previous, _normalize(_frame(1000 * np.arange(3, 7), bump=0.5)), 4)
+    assert list(merged["Time"].astype("datetime64[s]").astype(np.int64)) == [3000, 4000, 5000, 6000]
+    # The re-fetched bars win over the cached ones.
+    assert list(merged["Close"]) == [3000.5, 4000.5, 5000.5, 6000.5]
+
+
+def test_group_ranges_slices_members_from_the_merged_window():
+    times = 1000 * np.arange(10)
+    previous = _columns(times[:8])
+    out = _group_ranges([("long", 6), ("short", 3)], previous, _frame(times[7:], bump=0.5), 3, 6)
+    assert list(out["long"]["Time"]) == list(times[-6:])
+    assert list(out["short"]["Time"]) == list(times[-3:])
+    assert out["long"]["Close"][-3:].tolist() == [7000.5, 8000.5, 9000.5]
+    assert out["long"]["Time"].dtype == np.int64 and out["long"]["Close"].dtype == np.float64
+
+
+def test_group_ranges_full_fetch_ignores_the_cache():
+    times = 1000 * np.arange(4)
+    out = _group_ranges([("only", 4)], _columns(1000 * np.arange(100, 104)), _frame(times), 4, 4)
+    assert list(out["only"]["Time"]) == list(times)
+    assert _group_ranges([("only", 4)], None, None, 4, 4) == {}
+    # Nothing new: the cached window is kept.
+    cached = _columns(times)
+    assert list(_group_ranges([("only", 4)], cached, None, 2, 4)["only"]["Time"]) == list(times)
+
+
+def test_fetch_requests_only_the_missing_bars():
+    source = StubSource()
+    first = asyncio.run(_engine(source).fetch("ATW", previous=None))
+    assert list(first) == list(RANGE_CONFIG)
+    assert sorted(n for _, n in source.calls) == [24, 730]
+    for label, cfg in RANGE_CONFIG.items():
+        assert len(first[label]["Time"]) == cfg["n_bars"]
+
+    source = StubSource(bump=0.5)
+    second = asyncio.run(_engine(source).fetch("ATW", previous=first))
+    assert all(n <= 3 for _, n in source.calls)
+    for label in RANGE_CONFIG:
+        assert list(second[label]["Time"]) == list(first[label]["Time"])
+        # Older bars come from the cache, the re-fetched tail from the source.
+        assert second[label]["Close"][0] == first[label]["Close"][0]
+        assert second[label]["Close"][-1] == first[label]["Close"][-1] + 0.5
+
+
+def test_fetch_leaves_out_failed_groups():
+    data = asyncio.run(_engine(StubSource(fail={Interval.in_daily})).fetch("ATW"))
+    assert list(data) == ["1d"]
+    with pytest.raises(ConnectionError):
+        asyncio.run(_engine(StubSource(fail={Interval.in_daily, Interval.in_30_minute})).fetch("ATW"))
+
+
+def test_refresh_keeps_ranges_of_a_failed_group(monkeypatch):
+    previous = asyncio.run(_engine(StubSource()).fetch("ATW"))
+    analysis = {label: {"score": 1, "range": label} for label in RANGE_CONFIG}
+    server.DATA_CACHE["ATW"] = {"data": previous, "exchange": "CSEMA", "last_updated": 0, "status": "ok",
+                                "analysis": analysis, "analysis_last_updated": dict.fromkeys(RANGE_CONFIG, 0)}
+    monkeypatch.setattr(server, "FETCHER", _engine(StubSource(fail={Interval.in_daily}, bump=0.5)))
+    try:
+        asyncio.run(server.update_cache_for_symbol("ATW", "CSEMA"))
+        entry = server.DATA_CACHE["ATW"]
+        assert entry["status"] == "ok"
+        assert entry["data"]["1d"]["Close"][-1] == previous["1d"]["Close"][-1] + 0.5
+        for label in DAILY:
+            assert entry["data"][label]["Close"].tolist() == previous[label]["Close"].tolist()
+            assert entry["analysis"][label] == analysis[label]
+            assert entry["analysis_last_updated"][label] == 0
+        assert entry["analysis_last_updated"]["1d"] > 0
+    finally:
+        del server.DATA_CACHE["ATW"]
@@ -0,0 +1,159 @@
+# tests/test_resample.py
+"""Chart reshaping: ``resample`` against pandas, the guarantees of the two
+downsamplers, and the source ``select_bars`` picks for a request."""
+import numpy as np
+import pandas as pd
+import pytest
+
+from server.histo import Interval, interval_seconds
+from server.resample import lttb, minmax, parse_interval, resample, select_bars
+from server.store import TIME_COLUMN, BarStore
+
+DAY = 86400
+HALF_HOUR = interval_seconds(Interval.in_30_minute)
+
+
+def _bars(n: int, step: int, start: int = 1_700_000_000, seed: int = 0) -> dict:
+    rng = np.random.default_rng(seed)
+    close = 100 * np.exp(np.cumsum(rng.normal(0, 0.01, n)))
+    return {TIME_COLUMN: start + step * np.arange(n, dtype=np.int64), "Open": close * 0.999,
+            "High": close * (1 + rng.uniform(0, 0.02, n)), "Low": close * (1 - rng.uniform(0, 0.02, n)),
+            "Close": close, "Volume": rng.uniform(100, 1000, n)}
+
+
+def _frame(cols: dict) -> pd.DataFrame:
+    index = pd.to_datetime(cols[TIME_COLUMN], unit="s")
+    return pd.DataFrame({k: v for k, v in cols.items() if k != TIME_COLUMN}, index=index)
+
+
+@pytest.mark.parametrize("interval,rule,step", [
+    ("4h", "4h", HALF_HOUR),
+    ("1d", "1D", HALF_HOUR),
+    ("1w", "W-MON", DAY),
+    ("1M", "MS", DAY),
+])
+def test_resample_matches_pandas(interval, rule, step):
+    cols = _bars(600, step)
+    got = resample(cols, parse_interval(interval))
+    kwargs = {"closed": "left", "label": "left"} if rule == "W-MON" else {}
+    want = _frame(cols).resample(rule, **kwargs).agg(
+        {"Open": "first", "High": "max", "Low": "min", "Close": "last", "Volume": "sum"}).dropna()
+    assert got[TIME_COLUMN].tolist() == want.index.values.astype("datetime64[s]").astype(np.int64).tolist()
+    for name in want.columns:
+        np.testing.assert_allclose(got[name], want[name].to_numpy())
+
+
+def test_resample_weeks_start_on_monday():
+    weeks = resample(_bars(30, DAY), parse_interval("1w"))[TIME_COLUMN]
+    assert len(weeks) and all(pd.Timestamp(t, unit="s").dayofweek == 0 for t in weeks.tolist())
+
+
+def _buckets(n: int, max_points: int):
+    buckets = max(1, max_points // 2)
+    ids = np.arange(n) * buckets // n
+    return [np.flatnonzero(ids == b) for b in range(buckets)]
+
+
+@pytest.mark.parametrize("n,max_points", [(1000, 100), (1001, 37), (250, 2)])
+def test_minmax_keeps_each_bucket_min_and_max(n, max_points):
+    cols = _bars(n, HALF_HOUR)
+    out = minmax(cols, max_points)
+    assert len(out[TIME_COLUMN]) <= max_points
+    assert np.all(np.diff(out[TIME_COLUMN]) > 0)
+    kept = set(out[TIME_COLUMN].tolist())
+    for members in _buckets(n, max_points):
+        times = cols[TIME_COLUMN][members]
+        assert times[np.argmin(cols["Low"][members])] in kept
+        assert times[np.argmax(cols["High"][members])] in kept
+    assert out["Low"].min() == cols["Low"].min()
+    assert out["High"].max() == cols["High"].max()
+
+
+def test_minmax_short_and_nan_buckets():
+    cols = _bars(50, HALF_HOUR)
+    assert minmax(cols, 50) is cols
+    for name in ("High", "Low"):
+        cols[name][:10] = np.nan
+    out = minmax(cols, 10)
+    # The all-NaN first bucket falls back to its first bar.
+    assert out[TIME_COLUMN][0] == cols[TIME_COLUMN][0]
+    assert len(out[TIME_COLUMN]) <= 10
+
+
+@pytest.mark.parametrize("n,max_points", [(1000, 100), (1001, 3), (500, 499)])
+def test_lttb_keeps_endpoints_and_length(n, max_points):
+    cols = _bars(n, HALF_HOUR)
+    out = lttb(cols, max_points)
+    assert len(out[TIME_COLUMN]) == max_points
+    assert out[TIME_COLUMN][0] == cols[TIME_COLUMN][0]
+    assert out[TIME_COLUMN][-1] == cols[TIME_COLUMN][-1]
+    assert np.all(np.diff(out[TIME_COLUMN]) > 0)
+    # Bars are kept whole.
+    rows = np.searchsorted(cols[TIME_COLUMN], out[TIME_COLUMN])
+    for name in cols:
+        np.testing.assert_array_equal(out[name], cols[name][rows])
+
+
+def test_lttb_small_budgets_and_spikes():
+    cols = _bars(100, HALF_HOUR)
+    assert lttb(cols, 100) is cols
+    assert lttb(cols, 2)[TIME_COLUMN].tolist() == cols[TIME_COLUMN][[0, -1]].tolist()
+    cols["Close"][57] *= 3
+    assert cols[TIME_COLUMN][57] in lttb(cols, 20)[TIME_COLUMN]
+
+
+@pytest.fixture
+def stored(tmp_path):
+    """A store holding 400 days and 200 half hours; the cache holds the newest part of each."""
+    daily = _bars(400, DAY, start=1_690_000_000 - 1_690_000_000 % DAY)
+    intraday = _bars(200, HALF_HOUR, start=int(daily[TIME_COLUMN][-1]) - 100 * HALF_HOUR, seed=1)
+    store = BarStore(tmp_path / "bars")
+    store.save_entry("ATW", {"data": {"2y": daily, "1d": intraday}, "last_updated": 1.0})
+    entry = {"data": {"2y": {k: v[-100:] for k, v in daily.items()},
+                      "1d": {k: v[-24:] for k, v in intraday.items()}}}
+    return store, entry, daily, intraday
+
+
+def _select(stored, range="2y", **kwargs):
+    store, entry, _, _ = stored
+    return select_bars(store, "ATW", entry, range, lambda label: entry["data"][label], **kwargs)
+
+
+def test_select_bars_cached_range(stored):
+    _, entry, daily, _ = stored
+    cols, meta = _select(stored)
+    assert meta == {} and cols[TIME_COLUMN].tolist() == entry["data"]["2y"][TIME_COLUMN].tolist()
+    start = int(daily[TIME_COLUMN][-10])
+    cols, _ = _select(stored, start=start)
+    assert cols[TIME_COLUMN].tolist() == daily[TIME_COLUMN][-10:].tolist()
+
+
+def test_select_bars_reaches_into_the_store(stored):
+    _, _, daily, _ = stored
+    start, end = int(daily[TIME_COLUMN][50]), int(daily[TIME_COLUMN][60])
+    cols, _ = _select(stored, start=start, end=end)
+    assert cols[TIME_COLUMN].tolist() == daily[TIME_COLUMN][50:61].tolist()
+    np.testing.assert_array_equal(cols["Close"], daily["Close"][50:61])
+
+
+def test_select_bars_picks_the_finest_covering_source(stored):
+    _, _, daily, intraday = stored
+    start = int(intraday[TIME_COLUMN][10])
+    cols, meta = _select(stored, range="1d", interval="4h", start=start)
+    assert meta == {"interval": "4h", "source_range": "1d", "source_interval": HALF_HOUR}
+    want = resample({k: v[10:] for k, v in intraday.items()}, 4 * 3600)
+    assert cols[TIME_COLUMN].tolist() == want[TIME_COLUMN].tolist()
+
+    # Half hours do not reach back far enough: the daily history serves it.
+    start = int(daily[TIME_COLUMN][0])
+    cols, meta = _select(stored, interval="1w", start=start)
+    assert meta["source_range"] == "2y" and meta["source_interval"] == DAY
+    want = resample(daily, parse_interval("1w"))
+    assert cols[TIME_COLUMN].tolist() == want[TIME_COLUMN].tolist()
+    np.testing.assert_allclose(cols["High"], want["High"])
+
+
+def test_select_bars_unknown_range(stored):
+    store, _, _, _ = stored
+    with pytest.raises(KeyError):
+        select_bars(store, "ATW", {"data": {}}, "2y", lambda label: None, interval="1w")
@@ -0,0 +1,92 @@
+# tests/test_scan_parity.py
+"""The scanner must rank by exactly the score ``/analyze_cached`` reports.
+
+Both go through ``routes.filter_analysis`` on the cached analysis: the
+leaderboard at refresh time, ``/analyze_cached`` per request. These tests
+put analyses in the cache and compare every combination of toggles.
+"""
+import time
+
+import numpy as np
+import pytest
+from fastapi.testclient import TestClient
+
+import server
+from server.leaderboard import COMBOS
+from server.routes import LEADERBOARD, filter_analysis
+
+RANGE = "1m"
+
+HANDMADE = {
+    "OVERSOLD": {"rsi": 22.0, "macd": {"macd_cross": True}, "fibonacci": {"at_level": True},
+                 "patterns": ["hammer"], "trend": "bull"},
+    "OVERBOUGHT": {"rsi": 81.5, "macd": {"macd_cross": False}, "fibonacci": {"at_level": False},
+                   "patterns": [], "trend": "bear"},
+    "NEUTRAL": {"rsi": 50.0, "macd": {"macd_cross": True}, "fibonacci": {"at_level": False},
+                "patterns": [], "trend": "flat"},
+    "PATTERNS": {"rsi": 45.0, "macd": {}, "fibonacci": {"at_level": True},
+                 "patterns": ["doji", "engulfing"], "trend": "bull"},
+    "SPARSE": {"rsi": 29.9, "trend": "bear"},
+}
+
+
+def _bars(n: int, seed: int) -> dict:
+    rng = np.random.default_rng(seed)
+    close = 100 * np.exp(np.cumsum(rng.normal(0, 0.02, n)))
+    return {
+        "Time": (1_700_000_000 + 86400 * np.arange(n)).astype(np.int64),
+        "Open": close, "High": close * 1.01, "Low": close * 0.99, "Close": close,
+        "Volume": np.full(n, 1000.0),
+    }
+
+
+def _load(analyses: dict):
+    """Cache an entry per symbol with ``analyses[symbol]`` as its RANGE analysis, as a refresh does."""
+    for symbol in list(server.DATA_CACHE):
+        LEADERBOARD.remove(symbol)
+        del server.DATA_CACHE[symbol]
+    now = time.time()
+    for i, (symbol, analysis) in enumerate(analyses.items()):
+        entry = {"data": {RANGE: _bars(30, i)}, "exchange": "CSEMA", "last_updated": now, "status": "ok",
+                 "analysis": {RANGE: analysis}, "analysis_last_updated": {RANGE: now}}
+        server.DATA_CACHE[symbol] = entry
+        LEADERBOARD.update_entry(symbol, entry)
+
+
+def _check_parity(analyses: dict):
+    _load(analyses)
+    client = TestClient(server.app)
+    for combo in COMBOS:
+        toggles = dict(zip(("rsi", "macd", "fib", "patterns"), combo))
+        expected = {s: filter_analysis(a, *combo)["score"] for s, a in analyses.items()}
+
+        body = client.get("/scan", params={"range": RANGE, **toggles}).json()
+        ranked = {row["symbol"]: row["score"] for row in body["results"]}
+        assert ranked == pytest.approx(expected), combo
+        scores = [row["score"] for row in body["results"]]
+        assert scores == sorted(scores, reverse=True), combo
+
+        for symbol in analyses:
+            reply = client.get("/analyze_cached", params={"symbol": symbol, "range": RANGE, **toggles}).json()
+            assert reply["analysis"]["score"] == pytest.approx(ranked[symbol]), (symbol, combo)
+
+
+def test_scan_matches_analyze_cached():
+    _check_parity(HANDMADE)
+
+
+def test_scan_follows_refreshed_analysis():
+    _load(HANDMADE)
+    changed = {**HANDMADE, "NEUTRAL": {**HANDMADE["NEUTRAL"], "rsi": 12.0, "trend": "bull"}}
+    _check_parity(changed)
+
+
+def test_scan_matches_analyze_dataframe():
+    analyze = pytest.importorskip("server.analyze")
+    analyses = {}
+    for i in range(8):
+        bars = _bars(30, 100 + i)
+        rdata = {k: v.tolist() for k, v in bars.items() if k != "Time"}
+        rdata["Time"] = server.store.epoch_to_times(bars["Time"])
+        analyses[f"SYM{i}"] = analyze.analyze_dataframe(rdata, RANGE)
+    _check_parity(analyses)